@@ -1,13 +1,18 @@
 # DataModel.py
+import asyncio
+import concurrent.futures
 import csv
+import hashlib
 import importlib.resources
 import json
 import logging
 import os
+import threading
+import time
 from abc import ABC, abstractmethod
 from typing import NamedTuple, Union, Dict, Literal
 
-import requests
+import httpx
 
 from RapidResponse.Utils import DirectoryError, SetupError, RequestsError, DataError
 
@@ -17,19 +22,25 @@ class AbstractDataModel(ABC):
         This is the data model for the environment. It includes information about the tables, columns, etc.
         """
 
-    def __init__(self, data_model_directory=None, url=None, headers=None, workbook=None):
+    def __init__(self, data_model_directory=None, url=None, headers=None, workbook=None, cache_directory=None,
+                 max_connections: int = 8):
         """
         :param data_model_directory: Optional. file directory containing the Fields.tab and Tables.tab
         :param url:
         :param headers:
         :param workbook:
+        :param cache_directory: Optional. directory the compiled data model snapshot is read from and written to
+        :param max_connections: Optional. concurrent requests used when loading from the helper workbook
         :raises TypeError: The parameter data_model_directory type must be str
         :raises ValueError: The parameter data_model_directory must be provided
         :raises DirectoryError: directory not valid or file not valid
         """
         self._excludedNamespacesList = ['System']
         self.tables = []
+        self._table_registry = dict()  # 'Namespace::Name' -> Table, kept in sync with tables via _add_table
         self._fields = []
+        self._field_index = dict()  # (table, field) -> list of field rows, in file order
+        self._reference_index = dict()  # table -> {field or referencedTable: reference field row}
         # logging.basicConfig(filename='logging.log', filemode='w',format='%(name)s - %(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
         self.logger = logging.getLogger('RapidPy.dm')
 
@@ -37,6 +48,8 @@ class AbstractDataModel(ABC):
         self._headers = headers
         self._workbook = workbook
         self._data_model_dir = data_model_directory
+        self._cache_dir = cache_directory
+        self._max_connections = max_connections
         self.Refresh()
 
     @abstractmethod
@@ -59,6 +72,41 @@ class AbstractDataModel(ABC):
     def _add_fields_to_tables(self):
         pass
 
+    def _add_table(self, tab):
+        """
+        append a table to the data model and register it by its fully qualified name\n
+        if the name is already registered the first table is kept for lookups, as list.index() would have returned it
+        :param tab: Table to add
+        :return: None
+        """
+        self.tables.append(tab)
+        self._table_registry.setdefault(tab.name, tab)
+
+    def _index_fields(self):
+        """
+        build the lookup indexes over _fields so field validation does not need to scan every field.\n
+        _field_index is keyed by (table, field) and holds every matching row in file order, as the same table name can
+        exist in more than one namespace. _reference_index holds, per table, the reference fields keyed by both their
+        field name and their referenced table name. later rows overwrite earlier ones, matching the old scan order.
+        :return: None
+        """
+        self._field_index = dict()
+        self._reference_index = dict()
+        for f in self._fields:
+            self._field_index.setdefault((f['Table'], f['Field']), []).append(f)
+            if f['Type'] == 'Reference':
+                refs = self._reference_index.setdefault(f['Table'], dict())
+                refs[f['Field']] = f
+                refs[f['referencedTable']] = f
+
+    def _get_field_rows(self, tablename, fieldname):
+        """
+        :param tablename: table name, not qualified. example Part
+        :param fieldname: field name, not . qualified. example ReferencePart
+        :return: list of field rows matching table and field, empty list if none
+        """
+        return self._field_index.get((tablename, fieldname), [])
+
     def _get_table_field(self, tablename, fieldname):
         """
         input like dm._get_table_field('Mfg::Part', 'Name')
@@ -103,11 +151,8 @@ class AbstractDataModel(ABC):
                 modified_column = self._get_table_field(tablename, fieldname)
             except DataError:
                 if self._is_reference_field(tablearray[1], fieldname):
-                    for c in self._fields:
-                        # print(f'{c['Table']} == {tablearray[1]}, {c["Field"]} == {field_to_search}')
-                        if c['Table'] == tablearray[1] and c["Field"] == fieldname:
-                            # print('found rec')
-                            modified_column = Column(name=c['Field'], datatype=c['Type'], key=c['Key'],
+                    for c in self._get_field_rows(tablearray[1], fieldname):
+                        modified_column = Column(name=c['Field'], datatype=c['Type'], key=c['Key'],
                                                      referencedTable=c['referencedTable'],
                                                      referencedTableNamespace=c['Related Namespace'],
                                                      fieldNamespace=c['FieldNameSpace'])
@@ -151,11 +196,8 @@ class AbstractDataModel(ABC):
             field_to_search = fieldarray[0]
 
         # get the namespace of the original field
-        for c in self._fields:
-            # print(f'{c['Table']} == {tablearray[1]}, {c["Field"]} == {field_to_search}')
-            if c['Table'] == tablearray[1] and c["Field"] == field_to_search:
-                # print('found rec')
-                col = col._replace(fieldNamespace=c['FieldNameSpace'])
+        for c in self._get_field_rows(tablearray[1], field_to_search):
+            col = col._replace(fieldNamespace=c['FieldNameSpace'])
         return col
 
     def _validate_fully_qualified_field_name(self, tablename, fieldname):
@@ -197,9 +239,7 @@ class AbstractDataModel(ABC):
         if '.' in fieldname:
             isValid = self._validate_fully_qualified_field_name(tablename, fieldname)
         else:
-            for f in self._fields:
-                if f['Table'] == tablename and f['Field'] == fieldname:
-                    isValid = True
+            isValid = (tablename, fieldname) in self._field_index
         return isValid
 
     def _get_referenced_table(self, tablename, fieldname):
@@ -212,8 +252,8 @@ class AbstractDataModel(ABC):
         """
         referencedTable = None
         if '.' not in fieldname:
-            for f in self._fields:
-                if f['Table'] == tablename and f['Field'] == fieldname and f['Type'] == 'Reference':
+            for f in self._get_field_rows(tablename, fieldname):
+                if f['Type'] == 'Reference':
                     referencedTable = f['referencedTable']
                     return referencedTable
         else:
@@ -235,15 +275,17 @@ class AbstractDataModel(ABC):
 
         referencedTableWithNamespace = None
 
-        for fld in self._fields:
-            if fld['Table'] == tablename and (fld['Field'] == fieldname or fld["referencedTable"] == fieldname) and fld[
-                'Type'] == 'Reference':
-                relatedNamespace = fld["Related Namespace"]
-                referencedTab = fld["referencedTable"]
-                referencedTableWithNamespace = f'{relatedNamespace}::{referencedTab}'
-            elif fld['Table'] == tablename and fld['Field'] == fieldname and fld['Type'] != 'Reference':
+        for fld in self._get_field_rows(tablename, fieldname):
+            if fld['Type'] != 'Reference':
                 raise DataError(f'tablename: {tablename}, fieldname: {fieldname}', 'is not a reference field')
 
+        # fieldname can be either the reference field itself, or the table it has already been resolved to
+        fld = self._reference_index.get(tablename, dict()).get(fieldname)
+        if fld is not None:
+            relatedNamespace = fld["Related Namespace"]
+            referencedTab = fld["referencedTable"]
+            referencedTableWithNamespace = f'{relatedNamespace}::{referencedTab}'
+
         if referencedTableWithNamespace is None:
             raise DataError(f'tablename: {tablename}, fieldname: {fieldname}',
                             f'tablename: {tablename}, fieldname: {fieldname} does not resolve to a referenced table with namespace')
@@ -258,13 +300,12 @@ class AbstractDataModel(ABC):
         :return boolean: isReference
         :raise ValueError: if fieldname contains .
         """
-        # list((filter(lambda x: x['Table'] == tablename and x['Field'] == fieldname, env.data_model._fields)))
         isReference = False
         if '.' in fieldname:
             raise ValueError(f'tablename: {tablename}, fieldname: {fieldname}', 'Fieldname cannot be . qualified')
 
-        for f in self._fields:
-            if f['Table'] == tablename and f['Field'] == fieldname and f['Type'] == 'Reference':
+        for f in self._get_field_rows(tablename, fieldname):
+            if f['Type'] == 'Reference':
                 isReference = True
         return isReference
 
@@ -286,25 +327,24 @@ class AbstractDataModel(ABC):
         :raises ValueError: tablename is not in data model
         """
 
-        tab = Table(table, namespace)
-        if tab in self.tables:
-            i = self.tables.index(tab)
-            return self.tables[i]
+        tab = self._table_registry.get(f'{namespace}::{table}')
+        if tab is not None:
+            return tab
         else:
-            raise ValueError('the table provided is not valid: ' + str(tab))
+            raise ValueError('the table provided is not valid: ' + str(Table(table, namespace)))
 
     def __contains__(self, item):
 
         if not isinstance(item, Table):
             tabarray = item.split('::')
             try:
-                to_check = Table(tabarray[1], tabarray[0])
+                to_check = f'{tabarray[0]}::{tabarray[1]}'
             except IndexError:
                 raise ValueError(f'tablename parameter must be in format namespace::tablename. Table: {Table}')
         else:
-            to_check = item
+            to_check = item.name
 
-        if to_check in self.tables:
+        if to_check in self._table_registry:
             return True
         else:
             return False
@@ -326,17 +366,28 @@ class DataModel(AbstractDataModel):
     This is the data model for the environment. It includes information about the tables, columns, etc.
     """
 
-    def __init__(self, data_model_directory=None, url=None, headers=None, workbook=None):
+    SNAPSHOT_VERSION = 1
+    HELPER_WBK_PAGESIZE = 500
+    SNAPSHOT_MAX_AGE = 24 * 60 * 60  # seconds a snapshot of a helper workbook is trusted, as the server cannot be hashed
+
+    def __init__(self, data_model_directory=None, url=None, headers=None, workbook=None, cache_directory=None,
+                 max_connections: int = 8):
         """
         :param data_model_directory: Optional. file directory containing the Fields.tab and Tables.tab\n
+        :param cache_directory: Optional. directory for the compiled data model snapshot. no snapshot is used if None
+        :param max_connections: Optional. concurrent requests used when loading from the helper workbook
         :raises TypeError: The parameter data_model_directory type must be str
         :raises ValueError: The parameter data_model_directory must be provided
         :raises DirectoryError: directory not valid or file not valid
         """
 
-        AbstractDataModel.__init__(self, data_model_directory, url, headers, workbook)
+        AbstractDataModel.__init__(self, data_model_directory, url, headers, workbook, cache_directory, max_connections)
 
     def Refresh(self):
+        # if a compiled snapshot of the same source is available, use that
+        snapshot_source = self._snapshot_source()
+        if snapshot_source and self._load_from_snapshot(*snapshot_source):
+            return
         # if we get a helper workbook, use that
         if self._workbook:
             self._load_from_workbook()
@@ -346,12 +397,121 @@ class DataModel(AbstractDataModel):
         # otherwise, if these are not provided, then load from package resources
         else:
             self._load_from_package_resources()
-        # then add fields to tables
+        # index fields for lookups, then add fields to tables
+        self._index_fields()
         self._add_fields_to_tables()
+        if snapshot_source:
+            self._save_snapshot(*snapshot_source)
+
+    def _snapshot_source(self):
+        """
+        identify the snapshot for the data model source. files are keyed on a hash of their contents, so any change to
+        Tables.tab or Fields.tab invalidates the snapshot. a helper workbook is keyed on url and workbook and expires
+        after SNAPSHOT_MAX_AGE\n
+        :return: tuple of (snapshot file path, source hash, max age in seconds or None), or None if not caching
+        """
+        if not self._cache_dir:
+            return None
+
+        max_age = None
+        if self._workbook:
+            source = f'workbook:{self._url}:{self._workbook}'
+            source_hash = hashlib.sha256(source.encode('UTF-8'))
+            max_age = self.SNAPSHOT_MAX_AGE
+        elif self._data_model_dir:
+            source = f'directory:{os.path.abspath(self._data_model_dir)}'
+            source_hash = hashlib.sha256()
+            for file_name in ('\\Tables.tab', '\\Fields.tab'):
+                try:
+                    with open(self._data_model_dir + file_name, 'rb') as f:
+                        source_hash.update(f.read())
+                except OSError:
+                    # leave it to _load_from_directory to raise the DirectoryError
+                    return None
+        else:
+            source = 'package'
+            source_hash = hashlib.sha256()
+            for file_name in ('Tables.tab', 'Fields.tab'):
+                try:
+                    source_hash.update(importlib.resources.files('RapidResponse.data').joinpath(file_name).read_bytes())
+                except OSError:
+                    # leave it to _load_from_package_resources to raise the SetupError
+                    return None
+        source_hash.update(str(self._excludedNamespacesList).encode('UTF-8'))
+
+        snapshot_name = 'DataModel-' + hashlib.sha256(source.encode('UTF-8')).hexdigest()[:16] + '.json'
+        return os.path.join(self._cache_dir, snapshot_name), source_hash.hexdigest(), max_age
+
+    def _load_from_snapshot(self, snapshot_path, source_hash, max_age=None):
+        """
+        load tables, columns and fields from a compiled snapshot written by _save_snapshot\n
+        :param snapshot_path: file path of the snapshot
+        :param source_hash: hash of the source the snapshot must have been built from
+        :param max_age: Optional. seconds after which the snapshot is considered stale
+        :return: boolean, True if the data model was loaded from the snapshot
+        """
+        try:
+            with open(snapshot_path, encoding='UTF-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if snapshot.get('version') != self.SNAPSHOT_VERSION or snapshot.get('source_hash') != source_hash:
+            self.logger.debug(f'snapshot {snapshot_path} is out of date, rebuilding data model')
+            return False
+        if max_age is not None and time.time() - snapshot.get('created', 0) > max_age:
+            self.logger.debug(f'snapshot {snapshot_path} has expired, rebuilding data model')
+            return False
+
+        for t in snapshot['tables']:
+            self._add_table(Table.from_dict(t))
+        field_keys = snapshot['field_keys']
+        self._fields.extend(dict(zip(field_keys, f)) for f in snapshot['fields'])
+        self._index_fields()
+        self.logger.debug(f'data model loaded from snapshot {snapshot_path}')
+        return True
+
+    def _save_snapshot(self, snapshot_path, source_hash, max_age=None):
+        """
+        write the built tables, columns and fields to a versioned json snapshot. failure to write is logged, not raised\n
+        :param snapshot_path: file path of the snapshot
+        :param source_hash: hash of the source the data model was built from
+        :param max_age: unused, accepted so the snapshot source can be passed straight through
+        :return: None
+        """
+        field_keys = list(self._fields[0].keys()) if self._fields else []
+        if any(list(f.keys()) != field_keys for f in self._fields):
+            self.logger.debug('fields do not share the same keys, snapshot not written')
+            return
+
+        snapshot = {
+            'version': self.SNAPSHOT_VERSION,
+            'source_hash': source_hash,
+            'created': time.time(),
+            'tables': [tab.to_dict() for tab in self.tables],
+            'field_keys': field_keys,
+            'fields': [list(f.values()) for f in self._fields]
+        }
+        try:
+            os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+            # write to a temp file first so a concurrent reader never sees a partial snapshot
+            temp_path = f'{snapshot_path}.{os.getpid()}.tmp'
+            with open(temp_path, 'w', encoding='UTF-8') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(temp_path, snapshot_path)
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.warning(f'failed to write data model snapshot {snapshot_path}: {e}')
 
     def _load_from_workbook(self):
-        self._load_table_data_from_helper_wbk(self._url, self._headers, self._workbook)
-        self._load_field_data_from_helper_wbk(self._url, self._headers, self._workbook)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self._load_from_workbook_async(self._url, self._headers, self._workbook))
+        else:
+            # already inside an event loop (e.g. Jupyter) where asyncio.run is not allowed, so load on a worker thread
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(asyncio.run,
+                                self._load_from_workbook_async(self._url, self._headers, self._workbook)).result()
 
     def _load_from_directory(self):
         # check tables file is present, then load
@@ -391,7 +551,7 @@ class DataModel(AbstractDataModel):
             rowcount = 0
             reader = csv.DictReader(csvfile, delimiter='\t')  # update delimiter if its comma not tab
             for row in reader:
-                self.tables.append(
+                self._add_table(
                     Table(row['Table'], row['Namespace'], row['Type'], row['Keyed'], row['Identification Fields']))
                 rowcount += 1
             self.logger.debug(f'info: filename {file_path} rowcount {rowcount}')
@@ -415,36 +575,33 @@ class DataModel(AbstractDataModel):
     def _add_fields_to_tables(self):
         """
         iterate over fields populated from file & add them to the tables\n
-        Should contain all possible fields that could be accessed from this table
+        Should contain all possible fields that could be accessed from this table.
+        fields are grouped by table once, and tables are found through the table registry, so reference fields are
+        expanded from a lookup rather than a scan of every field
         :return: list of tables
         """
+        fields_by_table = dict()
         for f in self._fields:
-            cols = list()
-            tab = Table(f['Table'], f['Namespace'])
+            fields_by_table.setdefault(f['Table'], []).append(f)
+
+        for f in self._fields:
+            tab = self._table_registry.get(f"{f['Namespace']}::{f['Table']}")
+            if tab is None:
+                continue
 
+            cols = list()
             if f['Type'] != 'Reference':
                 cols.append(
                     Column(name=f['Field'], datatype=f['Type'], key=f['Key'], fieldNamespace=f['FieldNameSpace']))
-            else:
-                for ref in self._fields:
-                    if ref['Table'] == f['referencedTable'] and f['Key'] == 'Y':  # and ref['Key'] == 'Y':
-                        cols.append(Column(name=f['Field'] + '.' + ref['Field'], datatype=ref['Type'], key=ref['Key'],
-                                           referencedTable=ref['referencedTable'],
-                                           referencedTableNamespace=ref['Related Namespace'],
-                                           fieldNamespace=f['FieldNameSpace']))
-                        # Column(name, datatype, key, referenceTable, referencedTableNamespace, identification_fields, correspondingField, correspondingFieldNamespace, fieldNamespace)
-                    elif ref['Table'] == f['referencedTable'] and f['Key'] == 'N':
-                        cols.append(Column(name=f['Field'] + '.' + ref['Field'], datatype=ref['Type'], key=f['Key'],
-                                           referencedTable=ref['referencedTable'],
-                                           referencedTableNamespace=ref['Related Namespace'],
-                                           fieldNamespace=f['FieldNameSpace']))
-                        # Column(name, datatype, key, referenceTable, referencedTableNamespace, identification_fields, correspondingField, correspondingFieldNamespace, fieldNamespace)
-                    else:
-                        pass
-                        # self.logger.debug(f'record not found, therefore not added to fields: {ref}')
-            if tab in self.tables:
-                i = self.tables.index(tab)
-                self.tables[i].add_fields(cols)
+            elif f['Key'] == 'Y' or f['Key'] == 'N':
+                for ref in fields_by_table.get(f['referencedTable'], []):
+                    # key reference fields take the key of the referenced field, non key references are never key
+                    cols.append(Column(name=f['Field'] + '.' + ref['Field'], datatype=ref['Type'],
+                                       key=ref['Key'] if f['Key'] == 'Y' else f['Key'],
+                                       referencedTable=ref['referencedTable'],
+                                       referencedTableNamespace=ref['Related Namespace'],
+                                       fieldNamespace=f['FieldNameSpace']))
+            tab.add_fields(cols)
 
         return self.tables
 
@@ -468,15 +625,13 @@ class DataModel(AbstractDataModel):
 
         return isValid
 
-    def _load_table_data_from_helper_wbk(self, url, headers, workbook):
-        queryID = None
-        total_row_count = None
-        b_url = url
-        url = b_url + "/integration/V1/data/workbook"
-        headers = headers
-        headers['Content-Type'] = 'application/json'
-
-        payload = json.dumps({
+    def _helper_wbk_payload(self, workbook, worksheet):
+        """
+        :param workbook: name of the helper workbook, example KXSHelperREST
+        :param worksheet: name of the data model worksheet, DataModel_Tables or DataModel_Fields
+        :return: json payload to initialise the worksheet query
+        """
+        return json.dumps({
             "Scenario": {
                 "Name": "Enterprise Data",
                 "Scope": "Public"
@@ -498,138 +653,200 @@ class DataModel(AbstractDataModel):
                     "FilterType": "All"
                 },
                 "WorksheetNames": [
-                    "DataModel_Tables"
+                    worksheet
                 ]
             }
         })
 
-        response = requests.request("POST", url, headers=headers, data=payload)
-        if response.status_code == 200:
-            response_dict = json.loads(response.text)
-        else:
-            self.logger.debug(f'payload: {payload}')
-            self.logger.debug(f'url: {url}')
-            raise RequestsError(response,
-                                " failure during workbook initialise_for_extract, status not 200", payload)
-        response_worksheets = response_dict.get('Worksheets')
-        for ws in response_worksheets:
-            if ws.get('Name') == 'DataModel_Tables':
-                queryID = ws['QueryHandle']['QueryID']
-                total_row_count = ws.get('TotalRowCount')
-            else:
-                raise RequestsError(response, 'missing queryID', payload)
-        q_url = b_url + "/integration/V1/data/worksheet" + "?queryId=" + queryID[
-                                                                         1:] + "&workbookName=" + 'KXSHelperREST' + "&Scope=" + 'Public' + "&worksheetName=" + 'DataModel_Tables'
-        pagesize = 500
-        pages = total_row_count // pagesize
-        if total_row_count % pagesize != 0:
-            pages = pages + 1
-
-        for i in range(pages):
-            url = q_url + "&startRow=" + str(0 + (pagesize * i)) + "&pageSize=" + str(pagesize)
-            response = requests.request("GET", url,
-                                        headers=headers)  # using GET means you can embed stuff in url, rather than the POST endpoint which needs you to have stuff in payload
-            if response.status_code == 200:
-                response_dict = json.loads(response.text)
-            else:
-                raise RequestsError(response,
-                                    "failure during workbook retrieve_worksheet_data, status not 200" + '\nurl:' + url)
-            for r in response_dict["Rows"]:
-                if r['Values'][1] in self._excludedNamespacesList:
-                    self.logger.debug(f'record skipped due to excluded namespace: {r['Values'][1]}')
-                else:
-                    self.tables.append(Table(*r['Values']))
-        return self.tables
-
-    def _load_field_data_from_helper_wbk(self, url, headers, workbook):
-        total_row_count = None
+    def _process_helper_wbk_query(self, response, payload, url, workbook, worksheet):
+        """
+        take the response from initialising a worksheet query, and return the url to page over the results\n
+        :return: tuple of (query url without paging parameters, total row count)
+        :raises RequestsError: status not 200 or worksheet missing from response
+        """
         queryID = None
-        b_url = url
-        url = b_url + "/integration/V1/data/workbook"
-        headers = headers
-        headers['Content-Type'] = 'application/json'
-
-        payload = json.dumps({
-            "Scenario": {
-                "Name": "Enterprise Data",
-                "Scope": "Public"
-            },
-            "WorkbookParameters": {
-                "Workbook": {
-                    "Name": workbook,
-                    "Scope": "Public"
-                },
-                "SiteGroup": "All Sites",
-                "Filter": {
-                    "Name": "All Parts",
-                    "Scope": "Public"
-                },
-                "VariableValues": {
-                    "DataModel_IsHidden": "No",
-                    "DataModel_IsReadOnly": "All",
-                    "DataModel_IsIncludeDataTypeSet": "N",
-                    "FilterType": "All"
-                },
-                "WorksheetNames": [
-                    "DataModel_Fields"
-                ]
-            }
-        })
-
-        response = requests.request("POST", url, headers=headers, data=payload)
+        total_row_count = None
         if response.status_code == 200:
             response_dict = json.loads(response.text)
         else:
             self.logger.debug(f'payload: {payload}')
             self.logger.debug(f'url: {url}')
-            raise RequestsError(response,"failure during workbook initialise_for_extract", payload)
+            raise RequestsError(response, " failure during workbook initialise_for_extract, status not 200", payload)
 
         response_worksheets = response_dict.get('Worksheets')
         for ws in response_worksheets:
-            if ws.get('Name') == 'DataModel_Fields':
+            if ws.get('Name') == worksheet:
                 queryID = ws['QueryHandle']['QueryID']
                 total_row_count = ws.get('TotalRowCount')
-                # columns = ws.get('Columns')
-                # rows = ws.get('Rows')  # should be []
             else:
                 raise RequestsError(response, 'missing queryID', payload)
-        q_url = b_url + "/integration/V1/data/worksheet" + "?queryId=" + queryID[
-                                                                         1:] + "&workbookName=" + workbook + "&Scope=" + 'Public' + "&worksheetName=" + 'DataModel_Fields'
-
-        pagesize = 500
-        pages = total_row_count // pagesize
-        if total_row_count % pagesize != 0:
-            pages = pages + 1
-
-        for i in range(pages):
-            url = q_url + "&startRow=" + str(0 + (pagesize * i)) + "&pageSize=" + str(pagesize)
-            response = requests.request("GET", url,
-                                        headers=headers)  # using GET means you can embed stuff in url, rather than the POST endpoint which needs you to have stuff in payload
-            # check valid response
-            if response.status_code == 200:
-                response_dict = json.loads(response.text)
+        q_url = url + "/integration/V1/data/worksheet" + "?queryId=" + queryID[1:] + "&workbookName=" + workbook + "&Scope=" + 'Public' + "&worksheetName=" + worksheet
+        return q_url, total_row_count
 
+    def _add_table_rows(self, rows):
+        """
+        add tables from a page of DataModel_Tables worksheet rows, skipping excluded namespaces\n
+        :param rows: list of worksheet rows, each with Values
+        :return: None
+        """
+        for r in rows:
+            if r['Values'][1] in self._excludedNamespacesList:
+                self.logger.debug(f'record skipped due to excluded namespace: {r['Values'][1]}')
             else:
+                self._add_table(Table(*r['Values']))
 
-                raise RequestsError(response,
-                                    "failure during workbook retrieve_worksheet_data, status not 200" + '\nurl:' + url, payload)
+    def _add_field_rows(self, rows):
+        """
+        add fields from a page of DataModel_Fields worksheet rows, skipping excluded namespaces\n
+        :param rows: list of worksheet rows, each with Values
+        :return: None
+        """
+        for r in rows:
+            if r['Values'][8] in self._excludedNamespacesList:
+                self.logger.debug(f'record skipped due to excluded namespace: {r['Values'][1]}')
+            else:
+                self._fields.append({'Table': r['Values'][0],
+                                     'Namespace': r['Values'][1],
+                                     'Field': r['Values'][2],
+                                     'Type': r['Values'][3],
+                                     'Key': r['Values'][4],
+                                     'referencedTable': r['Values'][5],
+                                     'Related Namespace': r['Values'][7][0:r['Values'][7].find('::')],
+                                     'FieldNameSpace': r['Values'][8]
+                                     })
+
+    async def _create_helper_wbk_query_async(self, client, limit, url, headers, workbook, worksheet):
+        payload = self._helper_wbk_payload(workbook, worksheet)
+        async with limit:
+            response = await client.post(url=url + "/integration/V1/data/workbook", headers=headers, content=payload)
+        return self._process_helper_wbk_query(response, payload, url, workbook, worksheet)
+
+    async def _get_helper_wbk_page_async(self, client, limit, q_url, headers, startRow):
+        page_url = q_url + "&startRow=" + str(startRow) + "&pageSize=" + str(self.HELPER_WBK_PAGESIZE)
+        async with limit:
+            response = await client.get(url=page_url, headers=headers)
+        if response.status_code == 200:
+            response_dict = json.loads(response.text)
+        else:
+            raise RequestsError(response, "failure during workbook retrieve_worksheet_data, status not 200" + '\nurl:' + page_url)
+        return response_dict["Rows"]
 
-            for r in response_dict["Rows"]:
-                if r['Values'][8] in self._excludedNamespacesList:
-                    self.logger.debug(f'record skipped due to excluded namespace: {r['Values'][1]}')
-                else:
-                    self._fields.append({'Table': r['Values'][0],
-                                         'Namespace': r['Values'][1],
-                                         'Field': r['Values'][2],
-                                         'Type': r['Values'][3],
-                                         'Key': r['Values'][4],
-                                         'referencedTable': r['Values'][5],
-                                         'Related Namespace': r['Values'][7][0:r['Values'][7].find('::')],
-                                         'FieldNameSpace': r['Values'][8]
-                                         })
-                # self.tables.append(Table(row['Table'], row['Namespace'], row['Type'], row['Keyed'], row['Identification Fields']))
+    async def _load_from_workbook_async(self, url, headers, workbook):
+        """
+        initialise the tables and fields worksheet queries together, then fetch every page of both concurrently,
+        bounded by max_connections. pages are added in row order once all have been retrieved\n
+        :raises RequestsError: status not 200
+        """
+        headers['Content-Type'] = 'application/json'
+        limit = asyncio.Semaphore(self._max_connections)
+        pool_limits = httpx.Limits(max_connections=self._max_connections)
+        async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=60.0), limits=pool_limits) as client:
+            (tables_url, tables_count), (fields_url, fields_count) = await asyncio.gather(
+                self._create_helper_wbk_query_async(client, limit, url, headers, workbook, 'DataModel_Tables'),
+                self._create_helper_wbk_query_async(client, limit, url, headers, workbook, 'DataModel_Fields'))
+
+            table_pages = [self._get_helper_wbk_page_async(client, limit, tables_url, headers, i)
+                           for i in range(0, tables_count, self.HELPER_WBK_PAGESIZE)]
+            field_pages = [self._get_helper_wbk_page_async(client, limit, fields_url, headers, i)
+                           for i in range(0, fields_count, self.HELPER_WBK_PAGESIZE)]
+            pages = await asyncio.gather(*table_pages, *field_pages)
+
+        for rows in pages[:len(table_pages)]:
+            self._add_table_rows(rows)
+        for rows in pages[len(table_pages):]:
+            self._add_field_rows(rows)
+
+
+class DataModelRegistry:
+    """
+    process wide registry of built data models, keyed by their source (package resources, directory, or url and
+    bootstrap workbook). Environments acquire a data model from here so that a model is only built once per source,
+    and release it when closed. once the last holder releases a model it is dropped from the registry.\n
+    data models handed out by the registry are shared, and must be treated as read only.
+    """
+    _lock = threading.Lock()
+    _models = dict()  # source key -> [DataModel, reference count]
+    _building = dict()  # source key -> lock held while that source is built, outside _lock
+
+    @staticmethod
+    def _source_key(data_model_directory=None, url=None, workbook=None):
+        if workbook:
+            return 'workbook', url, workbook
+        elif data_model_directory:
+            return 'directory', os.path.abspath(data_model_directory)
+        else:
+            return ('package',)
 
-        return self._fields
+    @classmethod
+    def acquire(cls, data_model_directory=None, url=None, headers=None, workbook=None, cache_directory=None,
+                max_connections: int = 8):
+        """
+        return the data model for the source, building it if it is not already held by the registry\n
+        :param data_model_directory: Optional. file directory containing the Fields.tab and Tables.tab
+        :param url: Optional. instance url, used with workbook
+        :param headers: Optional. headers used to retrieve the data model from the workbook
+        :param workbook: Optional. helper workbook to bootstrap the data model from
+        :param cache_directory: Optional. directory for the compiled data model snapshot
+        :param max_connections: Optional. concurrent requests used when loading from the helper workbook
+        :return: DataModel
+        """
+        key = cls._source_key(data_model_directory, url, workbook)
+        with cls._lock:
+            model = cls._hold(key)
+            if model is not None:
+                return model
+            build_lock = cls._building.setdefault(key, threading.Lock())
+        # a build may download the helper workbook, only acquirers of the same source wait for it
+        with build_lock:
+            with cls._lock:
+                model = cls._hold(key)
+                if model is not None:
+                    return model
+            try:
+                model = DataModel(data_model_directory, url, headers, workbook, cache_directory, max_connections)
+                with cls._lock:
+                    cls._models[key] = [model, 1]
+                return model
+            finally:
+                with cls._lock:
+                    if cls._building.get(key) is build_lock:
+                        del cls._building[key]
+
+    @classmethod
+    def _hold(cls, key):
+        # call with _lock held. the registered model with its reference count raised, or None
+        entry = cls._models.get(key)
+        if entry is None:
+            return None
+        entry[1] += 1
+        return entry[0]
+
+    @classmethod
+    def release(cls, data_model):
+        """
+        release a data model previously returned by acquire. it is dropped once nothing holds it\n
+        :param data_model: DataModel returned by acquire
+        :return: None
+        """
+        with cls._lock:
+            for key, entry in cls._models.items():
+                if entry[0] is data_model:
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        del cls._models[key]
+                    return
+
+    @classmethod
+    def reference_count(cls, data_model):
+        """
+        :param data_model: DataModel
+        :return: number of holders of the data model, 0 if it is not in the registry
+        """
+        with cls._lock:
+            for entry in cls._models.values():
+                if entry[0] is data_model:
+                    return entry[1]
+        return 0
 
 
 class Column(NamedTuple):
@@ -684,6 +901,7 @@ class Table:
         self._logger = logging.getLogger('RapidPy.dm.tab')
         self._table_fields = []
         self._key_fields = []
+        self._fields_by_name = dict()
 
         self._table_name = name
         self._table_namespace = namespace
@@ -706,6 +924,32 @@ class Table:
         else:
             return False
 
+    def to_dict(self) -> dict:
+        """
+        json serialisable form of the table and its fields, from_dict restores it\n
+        :return: dict of the Table arguments and the values of each Column, trailing None values removed
+        """
+        fields = []
+        for col in self._table_fields:
+            values = list(col)
+            while values and values[-1] is None:
+                values.pop()
+            fields.append(values)
+        return {'table': [self._table_name, self._table_namespace, self._table_type, self._keyed,
+                          self._identification_fields],
+                'fields': fields}
+
+    @classmethod
+    def from_dict(cls, values: dict):
+        """
+        rebuild a table written by to_dict\n
+        :param values: dict from to_dict
+        :return: Table
+        """
+        table = cls(*values['table'])
+        table.add_fields([Column(*c) for c in values['fields']])
+        return table
+
     def _add_field(self, field: Column):
         """
         Add field to the current table and record if it's a key field\n
@@ -719,11 +963,12 @@ class Table:
         if not field:
             raise ValueError('The parameter field must be provided')
 
-        if field in self._table_fields:
+        if field.name in self._fields_by_name:
             return 0
             # print('The field is already assigned to table')
         else:
             self._table_fields.append(field)
+            self._fields_by_name[field.name] = field
             if field.key == 'Y':
                 self._key_fields.append(field.name)
 
@@ -748,10 +993,12 @@ class Table:
         if not field:
             raise ValueError('The parameter field must be provided')
 
-        if field in self._table_fields:
-            self._table_fields.remove(field)
-            if field.key == 'Y':
-                self._key_fields.remove(field.name)
+        if field.name in self._fields_by_name:
+            # the field held by the table, field may differ from it in anything but name
+            stored = self._fields_by_name.pop(field.name)
+            self._table_fields.remove(stored)
+            if stored.key == 'Y':
+                self._key_fields.remove(stored.name)
         else:
             raise ValueError(f'The field: {field.name} is not associated to {self.name}')
 
@@ -781,11 +1028,7 @@ class Table:
         if not str:
             raise ValueError('The parameter name must be provided')
 
-        response = None
-        for f in self._table_fields:
-            if name == f.name:
-                response = f
-                return response
+        response = self._fields_by_name.get(name)
         if response:
             return response
         else:
@@ -1,17 +1,32 @@
 # DataTable.py
 import abc
 import asyncio
+import contextlib
+import hashlib
+import importlib
+import io
 import json
 import logging
-from collections import UserList
+import os
+import shutil
+import threading
+import time
+from array import array
+from collections import UserList, deque
 from copy import deepcopy
+from datetime import date, datetime
+from functools import partial
+from itertools import compress, islice
+from operator import methodcaller
 
-import httpx
-import requests
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from RapidResponse.DataModel import Column, Table
-from RapidResponse.Environment import Environment
-from RapidResponse.Utils import RequestsError, DataError
+from RapidResponse.Environment import Environment, AdaptivePager
+from RapidResponse.Utils import RequestsError, DataError, SetupError, DATE_PAST, DATE_FUTURE, DATE_UNDEFINED, DATE_TODAY
 
 
 class AbstractDataTable(abc.ABC):
@@ -133,6 +148,643 @@ class AbstractDataTable(abc.ABC):
 
 
 
+class ExportCheckpoint:
+    """
+    completed pages of a bulk export spilled to a local directory, so an interrupted export can be resumed against the
+    same ExportId instead of starting over.\n
+    :param directory: spill directory. a sub directory is created per export query
+    :param key: identifies the export query, a checkpoint is never reused for a different query
+    """
+    # seconds an ExportId is trusted to still be valid on the server
+    MAX_AGE = 3600
+    MANIFEST = 'export.json'
+
+    def __init__(self, directory: str, key: str):
+        self._directory = os.path.join(directory, key)
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        hash the parts identifying an export query into a checkpoint key\n
+        :param parts: json serialisable values, e.g. url, scenario, table, fields and filter
+        :return: hex digest
+        """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('UTF-8')).hexdigest()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def load(self):
+        """
+        read the manifest of an unfinished export. a manifest older than MAX_AGE is discarded\n
+        :return: dict with ExportId, TotalRows and PageSize, or None if there is nothing to resume
+        """
+        try:
+            with open(os.path.join(self._directory, self.MANIFEST), encoding='UTF-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - manifest.get('created', 0) > self.MAX_AGE:
+            self.clear()
+            return None
+        return manifest
+
+    def start(self, export_id: str, total_rows: int, page_size: int):
+        """
+        discard any previous pages and record a new export\n
+        :param export_id: ExportId returned by the server
+        :param total_rows: TotalRows returned by the server
+        :param page_size: page size the export is fetched with
+        """
+        self.clear()
+        os.makedirs(self._directory, exist_ok=True)
+        self._write(self.MANIFEST, {'ExportId': export_id, 'TotalRows': total_rows, 'PageSize': page_size,
+                                    'created': time.time()})
+
+    def completed_pages(self) -> set:
+        """
+        :return: start rows of the pages already spilled
+        """
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return set()
+        return {int(name[5:-5]) for name in names if name.startswith('page_') and name.endswith('.json')}
+
+    def save_page(self, start_row: int, rows: list):
+        self._write(f'page_{start_row}.json', rows)
+
+    def read_page(self, start_row: int) -> list:
+        with open(os.path.join(self._directory, f'page_{start_row}.json'), encoding='UTF-8') as f:
+            return json.load(f)
+
+    def clear(self):
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _write(self, name, obj):
+        # write to a temp file first so a crash never leaves a partial page behind
+        path = os.path.join(self._directory, name)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='UTF-8') as f:
+            json.dump(obj, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+
+def _parse_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return datetime.fromisoformat(value).date()
+
+
+def _parse_bool(value: str) -> bool:
+    if value in ('Y', 'true', 'True', '1'):
+        return True
+    if value in ('N', 'false', 'False', '0'):
+        return False
+    raise ValueError(f'invalid boolean: {value!r}')
+
+
+# datatypes decoded by a typed DataTable, any other datatype is kept as str
+_PARSERS = {'Integer': int, 'Quantity': float, 'Money': float, 'Date': _parse_date,
+            'DateTime': datetime.fromisoformat, 'Boolean': _parse_bool}
+# Past and Future decode to the earliest and latest date so they still sort and compare. Today is relative to the day
+# it is read, so it is kept as the str 'Today' and written back as is
+_SENTINELS = {'Date': {DATE_PAST: date.min, DATE_FUTURE: date.max, DATE_UNDEFINED: None, '': None},
+              'DateTime': {DATE_PAST: datetime.min, DATE_FUTURE: datetime.max, DATE_UNDEFINED: None, '': None}}
+_EMPTY = {'': None}
+
+
+def _decode_values(datatype: str, values) -> list:
+    """
+    decode one column of a page from the strings sent by RapidResponse\n
+    :param datatype: Column.datatype
+    :param values: str values of the column
+    :return: list of int, float, date, datetime, bool, str or None
+    :raises DataError: a value is not valid for the datatype
+    """
+    parse = _PARSERS.get(datatype)
+    if parse is None:
+        return list(values)
+    try:
+        # most columns hold no empty or sentinel values, so decode the whole column in one pass first
+        return list(map(parse, values))
+    except ValueError:
+        return [_decode_value(datatype, parse, value) for value in values]
+
+
+def _decode_value(datatype: str, parse, value: str):
+    sentinels = _SENTINELS.get(datatype, _EMPTY)
+    if value in sentinels:
+        return sentinels[value]
+    if value == DATE_TODAY and datatype == 'Date':
+        return value
+    try:
+        return parse(value)
+    except ValueError:
+        raise DataError(value, f'value is not a valid {datatype}') from None
+
+
+def _loads(content: bytes):
+    # orjson is several times faster at parsing a page, json is the fallback
+    return orjson.loads(content) if orjson else json.loads(content)
+
+
+def _dumps(obj) -> bytes:
+    # orjson serialises an upload chunk several times faster, json is the fallback
+    return orjson.dumps(obj) if orjson else json.dumps(obj).encode()
+
+
+def _decode_records(records: list, width: int, datatypes: tuple = None) -> list:
+    """
+    split the tab delimited records of a page into columns. the page is split in one pass and each column is a
+    slice of the cells, rather than splitting record by record\n
+    :param records: tab delimited records
+    :param width: number of columns
+    :param datatypes: Optional. Column.datatype per column, to decode the values of a typed DataTable
+    :return: list of columns, each a list of values
+    :raises DataError: a record does not have width values
+    """
+    if not records:
+        return [[] for _ in range(width)]
+    # counting delimiters per record is cheap and catches records whose extra and missing values cancel out
+    if set(map(methodcaller('count', '\t'), records)) != {width - 1}:
+        for rec in records:
+            found = rec.count('\t') + 1
+            if found != width:
+                raise DataError(rec, f'mismatch in length of data table columns {width} and row: {found} ')
+    cells = '\t'.join(records).split('\t')
+    columns = [cells[i::width] for i in range(width)]
+    if datatypes:
+        columns = [_decode_values(datatype, values) for datatype, values in zip(datatypes, columns)]
+    return columns
+
+
+def _decode_export_page(content: bytes, width: int, datatypes: tuple = None, keep_records: bool = False):
+    """
+    parse and decode one page of a bulk export response. runs wherever the environment decodes pages, so it only
+    takes and returns plain data\n
+    :param content: response body
+    :param width: number of columns
+    :param datatypes: Optional. Column.datatype per column, to decode the values of a typed DataTable
+    :param keep_records: return the records as well, e.g. to checkpoint them
+    :return: tuple of the records, or None, and the list of columns
+    """
+    records = _loads(content)['Rows']
+    return (records if keep_records else None), _decode_records(records, width, datatypes)
+
+
+def _encode_value(datatype: str, value) -> str:
+    """
+    encode a value of a typed DataTable back to the string RapidResponse expects, the reverse of _decode_values\n
+    :param datatype: Column.datatype
+    :param value: decoded value, or a str which is sent as is
+    :return: str
+    """
+    if value is None:
+        return DATE_UNDEFINED if datatype in _SENTINELS else ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        # the form RapidResponse sends Boolean fields in
+        return 'Y' if value else 'N'
+    if isinstance(value, date):
+        if value in (date.min, datetime.min):
+            return DATE_PAST
+        if value in (date.max, datetime.max):
+            return DATE_FUTURE
+        return value.isoformat()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# arrow and numpy types of the decoded columns of a typed DataTable, every other column is exported as strings
+_ARROW_TYPES = {'Integer': 'int64', 'Quantity': 'double', 'Money': 'double', 'Date': 'date32',
+                'DateTime': 'timestamp[us]', 'Boolean': 'bool'}
+_NUMPY_TYPES = {'Integer': 'int64', 'Quantity': 'float64', 'Money': 'float64', 'Date': 'datetime64[D]',
+                'DateTime': 'datetime64[us]', 'Boolean': 'bool'}
+
+
+def _import_optional(module: str, extra: str):
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise SetupError(f'{module} is required, install it with: pip install RapidResponse[{extra}]') from None
+
+
+def _resolve_today(values):
+    # exports are a snapshot, so a Date column's 'Today' is exported as the current date
+    return [date.today() if value == DATE_TODAY else value for value in values] if DATE_TODAY in values else values
+
+
+def _arrow_array(pa, values, arrow_type):
+    if arrow_type == pa.date32():
+        values = _resolve_today(values)
+    return pa.array(values, type=arrow_type)
+
+
+def _numpy_array(np, values, dtype: str = None):
+    if dtype is not None and dtype.startswith('datetime64'):
+        values = _resolve_today(values)
+    # None has no int or bool representation, such columns are returned as object arrays
+    if dtype is not None and not (dtype in ('int64', 'bool') and None in values):
+        try:
+            return np.array(values, dtype=dtype)
+        except (TypeError, ValueError):
+            pass
+    return np.array(values, dtype=object)
+
+
+# typecode for dictionary codes once a column outgrows 2 byte codes, 'I' is 4 bytes on all common platforms
+_WIDE_CODE = 'I' if array('I').itemsize >= 4 else 'L'
+
+
+class _DictionaryColumn:
+    """
+    column of string values held as an array of codes into the list of distinct values. codes start 1 byte wide
+    and are widened as distinct values are added. set, append and extend return the column now holding the data\n
+    """
+    __slots__ = ('_codes', '_values', '_lookup')
+
+    def __init__(self):
+        self._codes = array('B')
+        self._values = []
+        self._lookup = {}
+
+    def __len__(self):
+        return len(self._codes)
+
+    def __getitem__(self, index):
+        return self._values[self._codes[index]]
+
+    def __delitem__(self, index):
+        # the distinct value is kept, it is dropped on clear
+        del self._codes[index]
+
+    def compress(self, keep):
+        self._codes = array(self._codes.typecode, compress(self._codes, keep))
+
+    def _code(self, value):
+        code = self._lookup.get(value)
+        if code is None:
+            code = self._lookup[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def _widen(self):
+        distinct = len(self._values)
+        if distinct > 0xFF and self._codes.typecode == 'B':
+            self._codes = array('H', self._codes)
+        if distinct > 0xFFFF and self._codes.typecode == 'H':
+            self._codes = array(_WIDE_CODE, self._codes)
+
+    def set(self, index, value):
+        code = self._code(value)
+        self._widen()
+        self._codes[index] = code
+        return self
+
+    def append(self, value):
+        return self.extend([value])
+
+    def extend(self, values):
+        codes = [self._code(value) for value in values]
+        self._widen()
+        self._codes.extend(codes)
+        return self
+
+    def find(self, value, start=0):
+        code = self._lookup.get(value)
+        if code is None:
+            return -1
+        try:
+            return self._codes.index(code, start)
+        except ValueError:
+            return -1
+
+    def values(self) -> list:
+        return list(map(self._values.__getitem__, self._codes))
+
+    def to_arrow(self, pa, arrow_type):
+        if arrow_type != pa.string():
+            return _arrow_array(pa, self.values(), arrow_type)
+        # keep the dictionary encoding, the codes are copied straight into the arrow indices
+        index_type = {1: pa.uint8(), 2: pa.uint16(), 4: pa.uint32()}.get(self._codes.itemsize, pa.uint64())
+        indices = pa.Array.from_buffers(index_type, len(self._codes), [None, pa.py_buffer(self._codes.tobytes())])
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self._values, type=arrow_type))
+
+    def to_numpy(self, np, dtype: str = None):
+        # decode the distinct values once then take them by code
+        return _numpy_array(np, self._values, dtype)[np.array(self._codes, dtype=np.intp)]
+
+
+class _ArrayColumn:
+    """
+    column of numbers held in an array, 8 byte integers for typecode 'q' or doubles for 'd'. an untyped column holds
+    str values and only takes those that are returned exactly as received, a typed column holds int or float values.
+    a value the array cannot hold, e.g. empty, zero padded or None, moves the column to a _DictionaryColumn\n
+    :param typecode: 'q' or 'd'
+    :param typed: True when values are decoded numbers rather than str
+    """
+    __slots__ = ('_array', '_typed')
+
+    def __init__(self, typecode: str = 'q', typed: bool = False):
+        self._array = array(typecode)
+        self._typed = typed
+
+    def __len__(self):
+        return len(self._array)
+
+    def __getitem__(self, index):
+        return self._array[index] if self._typed else str(self._array[index])
+
+    def __delitem__(self, index):
+        del self._array[index]
+
+    def compress(self, keep):
+        self._array = array(self._array.typecode, compress(self._array, keep))
+
+    def _parse(self, values):
+        typecode = self._array.typecode
+        if self._typed:
+            kinds = (int,) if typecode == 'q' else (int, float)
+            if not all(type(value) in kinds for value in values):
+                return None
+            numbers = values
+        else:
+            try:
+                numbers = [int(value) for value in values]
+            except ValueError:
+                return None
+            if any(str(i) != value for i, value in zip(numbers, values)):
+                return None
+        try:
+            return array(typecode, numbers)
+        except OverflowError:
+            return None
+
+    def _as_dictionary(self):
+        return _DictionaryColumn().extend(self.values())
+
+    def set(self, index, value):
+        numbers = self._parse([value])
+        if numbers is None:
+            return self._as_dictionary().set(index, value)
+        self._array[index] = numbers[0]
+        return self
+
+    def append(self, value):
+        return self.extend([value])
+
+    def extend(self, values):
+        values = list(values)
+        numbers = self._parse(values)
+        if numbers is None:
+            return self._as_dictionary().extend(values)
+        self._array.extend(numbers)
+        return self
+
+    def find(self, value, start=0):
+        numbers = self._parse([value])
+        if numbers is None:
+            return -1
+        try:
+            return self._array.index(numbers[0], start)
+        except ValueError:
+            return -1
+
+    def values(self) -> list:
+        return self._array.tolist() if self._typed else list(map(str, self._array))
+
+    def to_arrow(self, pa, arrow_type):
+        if not self._typed:
+            return pa.array(self.values(), type=arrow_type)
+        # copy rather than share the buffer, an array exporting its buffer cannot grow
+        buffer = pa.py_buffer(self._array.tobytes())
+        return pa.Array.from_buffers(arrow_type, len(self._array), [None, buffer])
+
+    def to_numpy(self, np, dtype: str = None):
+        if not self._typed:
+            return _numpy_array(np, self.values(), dtype)
+        return np.array(self._array, dtype=dtype)
+
+
+class ColumnStore:
+    """
+    columnar storage for the rows of a DataTable. each column is one compact array typed by the Column datatype,
+    repeated values are stored once. rows are handed out as DataRowView objects that read and write the store.
+    a view addresses a row position, so views taken before rows are deleted may point at a different row\n
+    :param data_table: owning DataTable, its columns are read when the store is created or cleared
+    """
+
+    def __init__(self, data_table):
+        self._data_table = data_table
+        self._columns = []
+        self._length = 0
+        self.clear()
+
+    def _new_column(self, column: Column):
+        typed = self._data_table.typed
+        if column.datatype == 'Integer':
+            return _ArrayColumn('q', typed)
+        if typed and column.datatype in ('Quantity', 'Money'):
+            return _ArrayColumn('d', typed)
+        return _DictionaryColumn()
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [DataRowView(self, i) for i in range(*position.indices(self._length))]
+        return DataRowView(self, self._position(position))
+
+    def __setitem__(self, position, row):
+        if isinstance(position, slice):
+            # every row is validated before any is written. columns cannot grow or shrink in the middle
+            positions = range(*position.indices(self._length))
+            rows = [self._validate(values) for values in row]
+            if len(rows) != len(positions):
+                raise ValueError(f'attempt to assign {len(rows)} rows to a slice of {len(positions)} rows of a columnar DataTable')
+            for position, values in zip(positions, rows):
+                self._columns = [column.set(position, value) for column, value in zip(self._columns, values)]
+            return
+        values = self._validate(row)
+        position = self._position(position)
+        self._columns = [column.set(position, value) for column, value in zip(self._columns, values)]
+
+    def __delitem__(self, position):
+        if isinstance(position, slice):
+            positions = sorted(range(*position.indices(self._length)), reverse=True)
+        else:
+            positions = [self._position(position)]
+        for i in positions:
+            for column in self._columns:
+                del column[i]
+        self._length -= len(positions)
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield DataRowView(self, i)
+
+    def remove_positions(self, positions):
+        """
+        delete many rows with one pass over each column\n
+        :param positions: row positions to delete
+        """
+        drop = set(positions)
+        if not drop:
+            return
+        keep = [i not in drop for i in range(self._length)]
+        for column in self._columns:
+            column.compress(keep)
+        self._length -= len(drop)
+
+    def __contains__(self, row):
+        try:
+            self.index(row)
+        except ValueError:
+            return False
+        return True
+
+    def _position(self, position: int) -> int:
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError('DataTable index out of range')
+        return position
+
+    def _values(self, row) -> list:
+        return list(row) if self._data_table.typed else [str(value) for value in row]
+
+    def _validate(self, row) -> list:
+        values = self._values(row)
+        if len(values) != len(self._columns):
+            raise DataError(str(values), f'mismatch in length of data table columns {len(self._columns)} and row: {len(values)} ')
+        return values
+
+    def append(self, row):
+        values = self._validate(row)
+        self._columns = [column.append(value) for column, value in zip(self._columns, values)]
+        self._length += 1
+
+    def extend(self, rows):
+        """
+        add rows column by column\n
+        :param rows: sequences of values, one per column, e.g. DataRow or a decoded export record
+        :raises DataError: a row does not have one value per column
+        """
+        rows = list(rows)
+        width = len(self._columns)
+        for row in rows:
+            if len(row) != width:
+                raise DataError(str(row), f'mismatch in length of data table columns {width} and row: {len(row)} ')
+        if rows:
+            self.extend_columns([list(values) for values in zip(*rows)])
+
+    def extend_columns(self, columns: list):
+        """
+        add rows given as columns, e.g. a decoded export page\n
+        :param columns: one list of values per column, all the same length
+        :raises DataError: wrong number of columns, or columns of different lengths
+        """
+        lengths = {len(values) for values in columns}
+        if len(columns) != len(self._columns) or len(lengths) > 1:
+            raise DataError(str(lengths), f'mismatch in data table columns {len(self._columns)} and page columns: {len(columns)} ')
+        self._columns = [column.extend(values) for column, values in zip(self._columns, columns)]
+        self._length += lengths.pop() if lengths else 0
+
+    def clear(self):
+        self._columns = [self._new_column(column) for column in self._data_table.columns]
+        self._length = 0
+
+    def index(self, row) -> int:
+        values = self._values(row)
+        if self._columns and len(values) == len(self._columns):
+            first = self._columns[0]
+            position = first.find(values[0])
+            while position >= 0:
+                if self.row_values(position) == values:
+                    return position
+                position = first.find(values[0], position + 1)
+        raise ValueError(f'{values!r} is not in DataTable')
+
+    def value(self, position: int, column: int) -> str:
+        return self._columns[column][position]
+
+    def set_value(self, position: int, column: int, value: str):
+        value = value if self._data_table.typed else str(value)
+        self._columns[column] = self._columns[column].set(self._position(position), value)
+
+    def row_values(self, position: int) -> list:
+        return [column[position] for column in self._columns]
+
+    def column_values(self, column: int) -> list:
+        return self._columns[column].values()
+
+    def arrow_column(self, column: int, pa, arrow_type):
+        return self._columns[column].to_arrow(pa, arrow_type)
+
+    def numpy_column(self, column: int, np, dtype: str = None):
+        return self._columns[column].to_numpy(np, dtype)
+
+
+class BulkResult:
+    """
+    counts from the bulk upload or removal transactions of one call, summed. status is Success only if every
+    transaction succeeded and Failure only if every one failed, otherwise Partial Success\n
+    """
+
+    def __init__(self):
+        self.transactions = 0
+        self.inserted = 0
+        self.modified = 0
+        self.deleted = 0
+        self.errors = 0
+        self.unchanged = 0
+        self._statuses = set()
+
+    def __repr__(self):
+        return f'BulkResult(status={self.status!r}, transactions={self.transactions!r}, inserted={self.inserted!r}, ' \
+               f'modified={self.modified!r}, deleted={self.deleted!r}, errors={self.errors!r}, unchanged={self.unchanged!r})'
+
+    @property
+    def status(self) -> str:
+        if self._statuses <= {'Success'}:
+            return 'Success'
+        if self._statuses == {'Failure'}:
+            return 'Failure'
+        return 'Partial Success'
+
+    def add(self, results: dict):
+        """
+        add the counts of one completed transaction\n
+        :param results: Results of a complete upload or complete removal response
+        """
+        self.transactions += 1
+        self._statuses.add(results.get('Status'))
+        self.inserted += results.get('InsertedRowCount') or 0
+        self.modified += results.get('ModifiedRowCount') or 0
+        self.deleted += results.get('DeleteRowCount') or 0
+        self.errors += results.get('ErrorRowCount') or 0
+        self.unchanged += results.get('UnchangedRowCount') or 0
+
+    def merge(self, other: 'BulkResult'):
+        """
+        add the counts of another BulkResult, e.g. the removals and uploads of one flush\n
+        :param other: BulkResult to add
+        """
+        self.transactions += other.transactions
+        self._statuses |= other._statuses
+        self.inserted += other.inserted
+        self.modified += other.modified
+        self.deleted += other.deleted
+        self.errors += other.errors
+        self.unchanged += other.unchanged
+
+
 class DataTable(Table, AbstractDataTable):
     """
     subclass of Table that contains row data & can be used to push updates to RR\n
@@ -144,14 +796,23 @@ class DataTable(Table, AbstractDataTable):
     :param sync: boolean control whether any updates are pushed back to RR
     :param refresh: boolean refresh row data on initialisation
     :param scenario: dict {"Name": "Enterprise Data", "Scope": "Public"}
+    :param columnar: boolean hold row data in a ColumnStore, one compact array per column, rather than a list of DataRow
+    :param typed: boolean decode values to int, float, date, datetime and bool by Column.datatype rather than keep str
+    :param write_behind: boolean when sync, queue changes and send them in bulk on flush(), leaving a with block, or once WRITE_BEHIND_ROWS rows or WRITE_BEHIND_SECONDS seconds are pending. only the last change to each key is sent. environment close() and interpreter exit flush what is still queued
     :raises ValueError: environment or tablename is not provided, or tablename is not in data model
     :raises TypeError: environment, tablename is not correctly typed
     :raises DataError: key column not in column list. will log failure but not fail.
     """
-
+    # suggested page size when streaming, smaller than a refresh so only a few pages are held in memory at once
+    STREAM_PAGESIZE = 50_000
+    # write-behind flushes once this many keys have changes pending
+    WRITE_BEHIND_ROWS = 10_000
+    # or this many seconds after the first pending change
+    WRITE_BEHIND_SECONDS = 5.0
 
     def __init__(self, environment: Environment, tablename: str, columns: list = None, table_filter: str = None,
-                 sync: bool = True, refresh: bool = True, scenario=None):
+                 sync: bool = True, refresh: bool = True, scenario=None, columnar: bool = False,
+                 typed: bool = False, write_behind: bool = False):
 
         self._logger = logging.getLogger('RapidPy.dt')
 
@@ -166,6 +827,7 @@ class DataTable(Table, AbstractDataTable):
             self._key_fields = deepcopy(temp_tab._key_fields)
             self._keyed = deepcopy(temp_tab._keyed)
             self._table_fields = deepcopy(temp_tab._table_fields)
+            self._fields_by_name = {f.name: f for f in self._table_fields}
             self._table_type = deepcopy(temp_tab._table_type)
         except IndexError:
             raise ValueError('table name parameter must be in format namespace::tablename')
@@ -187,12 +849,28 @@ class DataTable(Table, AbstractDataTable):
                     columns.append(k)
             self.set_columns(columns)
 
-        self.client =  httpx.AsyncClient(timeout=httpx.Timeout(10.0, connect=60.0)) # self.environment.client #
-        self.limit =  asyncio.Semaphore(self.max_connections) # self.environment.limit #
-
-        self._session = requests.Session()
-        self.environment.refresh_auth()
-        self._session.headers = self.environment.global_headers
+        self._typed = bool(typed)
+        self._columnar = bool(columnar)
+        if self._columnar:
+            self._table_data = ColumnStore(self)
+
+        # pending changes by row key, a key is either upserted or deleted
+        self._write_behind = bool(write_behind)
+        self._pending_upserts = {}
+        self._pending_deletes = {}
+        self._pending_lock = threading.Lock()
+        self._flush_timer = None
+        self._batch_depth = 0
+        self._batch_result = None
+        # keys appended in the current batch that were not in the table, a delete of one cancels out
+        self._batch_created = set()
+        # True while the rows are every row of the table as of an unfiltered refresh
+        self._complete = False
+        # row position by key, built on the first key lookup
+        self._key_index = None
+        self._key_index_unique = True
+        if self._write_behind:
+            self.environment._register_write_behind(self)
 
         if refresh:
             self.RefreshData_async()
@@ -215,26 +893,57 @@ class DataTable(Table, AbstractDataTable):
         return response
 
     def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            rows = [row if isinstance(row, DataRow) else DataRow(row, self) for row in value]
+            length = len(self._table_data)
+            self._table_data[key] = rows
+            self._total_row_count += len(self._table_data) - length
+            self._key_index = None
+            if self.sync and rows:
+                self._push_rows(rows)
+            return
+        if self._key_index is not None:
+            self._unindex(self._table_data[key], key)
         if not isinstance(value, DataRow):
             self._table_data[key] = DataRow(value, self)
         else:
             self._table_data[key] = value
+        if self._key_index is not None:
+            self._index_rows([self._table_data[key]], key % len(self._table_data))
         if self.sync:
-            self.environment.refresh_auth()
-            self._create_upload(self._table_data[key])
-            self._complete_upload()
-            self._uploadId = None
+            self._push_rows([self._table_data[key]])
 
     def __delitem__(self, key):
-
+        rows = self._table_data[key]
+        if not isinstance(key, slice):
+            rows = [rows]
         if self.sync:
             # delete from RR
-            self._create_deletion(self._table_data[key])
-            self._complete_deletion()
-            self._uploadId = None
+            self._push_deletes(rows)
 
+        if self._key_index is not None:
+            if isinstance(key, slice) or key % len(self._table_data) != len(self._table_data) - 1:
+                # the rows after it move up, the index is rebuilt on the next lookup
+                self._key_index = None
+            else:
+                self._unindex(rows[0], key)
         del self._table_data[key]
-        self._total_row_count -= 1
+        self._total_row_count -= len(rows)
+
+    def __contains__(self, item):
+        # a whole row is found by its key then compared value by value, a key alone only has to be present
+        kind = self._lookup_kind(item)
+        if kind == 'row':
+            return self._find_row(self._row_values(item)) is not None
+        if kind == 'key':
+            return tuple(self._row_values(item)) in self._get_key_index()
+        return AbstractDataTable.__contains__(self, item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
 
     def append(self, values):
         """
@@ -245,10 +954,12 @@ class DataTable(Table, AbstractDataTable):
         if not isinstance(values, DataRow):
             values = DataRow(values, self)
         if self.sync:
-            self.add_row(values)
+            self._push_rows([values], created=True)
 
         self._table_data.append(values)
         self._total_row_count += 1
+        if self._key_index is not None:
+            self._index_rows([values], len(self._table_data) - 1)
 
     def extend(self, args):
         to_send = []
@@ -257,11 +968,307 @@ class DataTable(Table, AbstractDataTable):
                 to_send.append(rec)
             else:
                 to_send.append(DataRow(rec, self))
+        created = self._created_keys(to_send) if self.sync and self._batch_depth else None
         self._table_data.extend(to_send)
+        if self._key_index is not None:
+            self._index_rows(to_send, len(self._table_data) - len(to_send))
         if self.sync:
-            self.add_rows(to_send)
+            self._push_rows(to_send, created=created)
         self._total_row_count += len(args)
 
+    @property
+    def write_behind(self):
+        return self._write_behind
+
+    @property
+    def pending(self) -> int:
+        """
+        :return: number of keys with a change waiting to be flushed
+        """
+        return len(self._pending_upserts) + len(self._pending_deletes)
+
+    def _push_rows(self, rows: list, created=None):
+        # rows changed locally on a sync table, sent now or queued. created is True, or the keys, for appended rows
+        if self._batch_depth and created:
+            self._batch_created.update(self._created_keys(rows) if created is True else created)
+        if self._write_behind or self._batch_depth:
+            self._queue_changes(rows, self._pending_upserts, self._pending_deletes)
+            return
+        self._unqueue(rows)
+        if len(rows) == 1:
+            self.add_row(rows[0])
+        else:
+            self.add_rows(rows)
+
+    def _push_deletes(self, rows: list):
+        if self._write_behind or self._batch_depth:
+            self._queue_changes(rows, self._pending_deletes, self._pending_upserts)
+        elif rows:
+            self._unqueue(rows)
+            self._create_deletion(*rows)
+            self._complete_deletion()
+            self._uploadId = None
+
+    def _queue_changes(self, rows: list, queue: dict, opposite: dict):
+        # snapshot the values, a later change to the row is queued again and replaces this one
+        with self._pending_lock:
+            for row in rows:
+                key = self._row_key(row)
+                opposite.pop(key, None)
+                queue.pop(key, None)
+                if queue is self._pending_deletes and key in self._batch_created:
+                    # created and deleted in the same batch, the server never sees it
+                    self._batch_created.discard(key)
+                    continue
+                queue[key] = DataRow._from_values(row.data, self)
+            if self._batch_depth:
+                # a batch is only sent when it ends
+                return
+            pending = self.pending
+            self._schedule_flush()
+        if pending >= self.WRITE_BEHIND_ROWS:
+            self.flush()
+
+    def _unqueue(self, rows: list):
+        # a change sent now replaces any still queued for its key, e.g. by a batch that raised, so a later flush does
+        # not send the older change over it
+        if self.pending:
+            with self._pending_lock:
+                for key in map(self._row_key, rows):
+                    self._pending_upserts.pop(key, None)
+                    self._pending_deletes.pop(key, None)
+
+    def _created_keys(self, rows: list) -> set:
+        # keys of rows neither in the table nor deleted earlier in the batch. only a table holding every row of an
+        # unfiltered refresh knows such a key is not on the server, otherwise no row counts as created
+        if not self._complete:
+            return set()
+        index = self._get_key_index()
+        return {key for key in map(self._row_key, rows) if key not in index and key not in self._pending_deletes}
+
+    def _schedule_flush(self):
+        # called holding _pending_lock. starts the timer flush of the queued changes if none is due
+        if self.pending and self._write_behind and not self._batch_depth and self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.WRITE_BEHIND_SECONDS, self._flush_on_timer)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _key_positions(self) -> list:
+        # positions of the key columns, every column for a table without keys
+        if self._key_columns is None:
+            positions = [i for i, col in enumerate(self.columns) if col.key == 'Y']
+            self._key_columns = positions or list(range(len(self.columns)))
+        return self._key_columns
+
+    def _row_key(self, row) -> tuple:
+        return tuple(row[i] for i in self._key_positions())
+
+    def _row_values(self, values) -> list:
+        # values as the table holds them, str unless typed
+        return list(values) if self._typed else [str(value) for value in values]
+
+    def _lookup_kind(self, item):
+        # 'row' for one value per column, 'key' for one value per key column
+        if isinstance(item, (str, bytes)) or not hasattr(item, '__len__'):
+            return None
+        if len(item) == len(self.columns):
+            return 'row'
+        if len(item) == len(self._key_positions()):
+            return 'key'
+        return None
+
+    def _find_row(self, values: list):
+        """
+        :return: position of the first row equal to values, or None
+        """
+        position = self._get_key_index().get(self._row_key(values))
+        if position is not None and self._table_data[position] == values:
+            return position
+        if self._key_index_unique:
+            # no other row has the key
+            return None
+        for position, row in enumerate(self._table_data):
+            if row == values:
+                return position
+        return None
+
+    def _get_key_index(self) -> dict:
+        if self._key_index is None:
+            positions = self._key_positions()
+            if self._columnar:
+                keys = zip(*(self._table_data.column_values(i) for i in positions))
+            else:
+                keys = (tuple([row.data[i] for i in positions]) for row in self._table_data)
+            index = {}
+            for position, key in enumerate(keys):
+                # with duplicate keys the first row is found
+                index.setdefault(key, position)
+            self._key_index = index
+            self._key_index_unique = len(index) == len(self._table_data)
+        return self._key_index
+
+    def _index_rows(self, rows: list, start: int):
+        for position, row in enumerate(rows, start):
+            key = self._row_key(row)
+            if key in self._key_index:
+                self._key_index_unique = False
+            else:
+                self._key_index[key] = position
+
+    def _unindex(self, row, position: int):
+        key = self._row_key(row)
+        if self._key_index.get(key) == position % len(self._table_data):
+            if self._key_index_unique:
+                del self._key_index[key]
+            else:
+                # a later row may have the same key, the index is rebuilt on the next lookup
+                self._key_index = None
+
+    def _key_changed(self, column: int):
+        # called when a value of a row changes in place, only an indexed column moves the row in the index. a table
+        # without key columns indexes every column
+        if self._key_index is not None and (isinstance(column, slice)
+                                            or column % len(self.columns) in self._key_positions()):
+            self._key_index = None
+
+    def get_by_key(self, *key):
+        """
+        find a row by its key through a hash index over the key columns, built on the first lookup and kept up to date
+        by append, extend, assignment and deletion\n
+        :param key: values of the key columns in column order, e.g. get_by_key('P1', 'Site1'), or a tuple of them
+        :return: DataRow, or None if no row has the key
+        """
+        if len(key) == 1 and isinstance(key[0], (tuple, list)):
+            key = key[0]
+        position = self._get_key_index().get(tuple(self._row_values(key)))
+        return None if position is None else self._table_data[position]
+
+    def delete_by_key(self, *key):
+        """
+        delete the row with the given key, from RR as well when sync\n
+        :param key: values of the key columns in column order, or a tuple of them
+        :raises KeyError: no row has the key
+        """
+        if len(key) == 1 and isinstance(key[0], (tuple, list)):
+            key = key[0]
+        position = self._get_key_index().get(tuple(self._row_values(key)))
+        if position is None:
+            raise KeyError(key)
+        del self[position]
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        context manager that holds back the changes made in the block and sends the net upserts and deletions when it
+        ends, as few bulk transactions as the chunk size allows. a row appended and then deleted in the block is not
+        sent at all, when the table holds every row of an unfiltered refresh so the row cannot be on the server already.
+        if the block raises nothing is sent and the local rows are not rolled back, the changes stay queued for flush(),
+        the next batch or a refresh to send. a change sent before then replaces the queued one for its key.
+        batches nest, only the outermost one sends\n
+        :return: BulkResult, filled in when the outermost batch ends
+        :raises RequestsError: non 200 response, or a transaction failed. the changes stay queued for the next flush
+        """
+        if not self._batch_depth and self.pending:
+            # send write-behind changes made before the batch so they are not discarded with it
+            self.flush()
+        result = self._enter_batch()
+        try:
+            yield result
+        except BaseException:
+            self._exit_batch()
+            raise
+        if self._exit_batch():
+            result.merge(self.flush())
+
+    @contextlib.asynccontextmanager
+    async def batch_async(self):
+        """
+        async context manager equivalent of batch, for callers already running an event loop (e.g. Jupyter)\n
+        :return: BulkResult, filled in when the outermost batch ends
+        """
+        if not self._batch_depth and self.pending:
+            await self.flush_async()
+        result = self._enter_batch()
+        try:
+            yield result
+        except BaseException:
+            self._exit_batch()
+            raise
+        if self._exit_batch():
+            result.merge(await self.flush_async())
+
+    def _enter_batch(self) -> BulkResult:
+        if not self._batch_depth:
+            self._batch_result = BulkResult()
+        self._batch_depth += 1
+        return self._batch_result
+
+    def _exit_batch(self) -> bool:
+        # True when the outermost batch ended
+        self._batch_depth -= 1
+        if self._batch_depth:
+            return False
+        self._batch_result = None
+        self._batch_created.clear()
+        with self._pending_lock:
+            # a write-behind table sends changes kept by a batch that raised on its timer
+            self._schedule_flush()
+        return True
+
+    def flush(self) -> BulkResult:
+        """
+        send the queued write-behind changes now, deletions then upserts, as bulk transactions. if a transaction fails
+        the changes not superseded since are queued again for the next flush\n
+        :return: BulkResult summing the counts of every transaction
+        :raises RequestsError: non 200 response, or a transaction failed
+        :raises DataError: a transaction partially succeeded with more than 10 error rows
+        """
+        return self.environment.run(self._flush_async())
+
+    async def flush_async(self) -> BulkResult:
+        """
+        coroutine equivalent of flush, for callers already running an event loop (e.g. Jupyter)\n
+        :return: BulkResult summing the counts of every transaction
+        """
+        return await self.environment.run_async(self._flush_async())
+
+    async def _flush_async(self) -> BulkResult:
+        with self._pending_lock:
+            upserts, self._pending_upserts = self._pending_upserts, {}
+            deletes, self._pending_deletes = self._pending_deletes, {}
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        result = BulkResult()
+        try:
+            if deletes:
+                result.merge(await self._bulk_rows_async(list(deletes.values()), remove=True))
+                deletes = {}
+            if upserts:
+                result.merge(await self._bulk_rows_async(list(upserts.values())))
+        except BaseException:
+            self._requeue(upserts, deletes)
+            raise
+        return result
+
+    def _requeue(self, upserts: dict, deletes: dict):
+        # changes queued while the flush ran are newer and win
+        with self._pending_lock:
+            for queue, opposite, failed in ((self._pending_upserts, self._pending_deletes, upserts),
+                                            (self._pending_deletes, self._pending_upserts, deletes)):
+                for key, row in failed.items():
+                    if key not in queue and key not in opposite:
+                        queue[key] = row
+            self._schedule_flush()
+
+    def _flush_on_timer(self):
+        with self._pending_lock:
+            self._flush_timer = None
+        try:
+            self.flush()
+        except Exception as e:
+            self._logger.error(f'write-behind flush failed, {self.pending} changes stay queued for the next flush: {e!r}')
+
     def explode_reference_field(self, col: Column, running_list_of_cols: list = None):
         """
         recursive algo that explodes fields.
@@ -367,17 +1374,239 @@ class DataTable(Table, AbstractDataTable):
             self._assign_all_cols()
         else:
             self._assign_cols_from_input(columns)
+        self._key_columns = None
+        self._key_index = None
+
+    @property
+    def columnar(self):
+        return self._columnar
+
+    @property
+    def typed(self):
+        return self._typed
+
+    def column(self, name: str) -> list:
+        """
+        all values of one column, in row order. reads the column array directly when the table is columnar\n
+        :param name: column name, e.g. 'Part.Name'
+        :return: list of str
+        :raises ValueError: name is not one of the table columns
+        """
+        position = [c.name for c in self.columns].index(name)
+        if self._columnar:
+            return self._table_data.column_values(position)
+        return [row[position] for row in self._table_data]
+
+    def to_arrow(self):
+        """
+        the table data as a pyarrow Table, one column per DataTable column. typed columns get the matching arrow type,
+        the rest are strings. string columns of a columnar table stay dictionary encoded\n
+        :return: pyarrow.Table
+        :raises SetupError: pyarrow is not installed
+        """
+        pa = _import_optional('pyarrow', 'arrow')
+        arrays = []
+        for position, column in enumerate(self.columns):
+            arrow_type = self._arrow_type(pa, column)
+            if self._columnar:
+                arrays.append(self._table_data.arrow_column(position, pa, arrow_type))
+            else:
+                arrays.append(_arrow_array(pa, [row[position] for row in self._table_data], arrow_type))
+        return pa.table(arrays, names=[c.name for c in self.columns])
+
+    def to_numpy(self) -> dict:
+        """
+        the table data as numpy arrays. typed columns get the matching dtype, the rest are object arrays of str\n
+        :return: dict of column name to numpy.ndarray
+        :raises SetupError: numpy is not installed
+        """
+        np = _import_optional('numpy', 'numpy')
+        arrays = {}
+        for position, column in enumerate(self.columns):
+            dtype = _NUMPY_TYPES.get(column.datatype) if self._typed else None
+            if self._columnar:
+                arrays[column.name] = self._table_data.numpy_column(position, np, dtype)
+            else:
+                arrays[column.name] = _numpy_array(np, [row[position] for row in self._table_data], dtype)
+        return arrays
+
+    def to_pandas(self):
+        """
+        the table data as a pandas DataFrame, built from to_arrow. string columns of a columnar table become
+        categoricals\n
+        :return: pandas.DataFrame
+        :raises SetupError: pandas or pyarrow is not installed
+        """
+        _import_optional('pandas', 'pandas')
+        return self.to_arrow().to_pandas()
+
+    def export_arrow(self, page_size: int = None, max_in_flight: int = None):
+        """
+        export the table from RapidResponse straight into a pyarrow Table. each page is parsed by pyarrow into a
+        record batch, no DataRow is created and the rows are not added to the DataTable\n
+        :param page_size: rows per page. Optional, default is the optimal page size for STREAM_PAGESIZE
+        :param max_in_flight: pages fetched ahead of the one being parsed. Optional, default is the environment max_connections
+        :return: pyarrow.Table
+        :raises SetupError: pyarrow is not installed
+        :raises DataError: a record does not match the table columns
+        """
+        pa = _import_optional('pyarrow', 'arrow')
+        schema = pa.schema([(c.name, self._arrow_type(pa, c)) for c in self.columns])
+        pages = self._stream_pages_async(page_size, max_in_flight, partial(self._arrow_batch, pa, schema))
+        return pa.Table.from_batches(list(self.environment.run_iter(pages)), schema=schema)
+
+    def _arrow_type(self, pa, column: Column):
+        if self._typed and column.datatype in _ARROW_TYPES:
+            return pa.type_for_alias(_ARROW_TYPES[column.datatype])
+        return pa.string()
+
+    def _arrow_batch(self, pa, schema, records: list):
+        csv = importlib.import_module('pyarrow.csv')
+        names = [str(i) for i in range(len(self.columns))]
+        try:
+            table = csv.read_csv(io.BytesIO('\n'.join(records).encode('UTF-8')),
+                                 read_options=csv.ReadOptions(column_names=names, use_threads=False),
+                                 parse_options=csv.ParseOptions(delimiter='\t', quote_char=False,
+                                                                ignore_empty_lines=False),
+                                 convert_options=csv.ConvertOptions(column_types={n: pa.string() for n in names}))
+        except pa.ArrowInvalid as e:
+            raise DataError(records, f'export page does not match the data table columns: {e}') from None
+        if table.num_rows != len(records):
+            raise DataError(records, f'mismatch in number of export rows {len(records)} and parsed rows {table.num_rows}')
+        arrays = [self._arrow_decode(pa, column, field.type, table.column(i).combine_chunks())
+                  for i, (column, field) in enumerate(zip(self.columns, schema))]
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    @staticmethod
+    def _arrow_decode(pa, column: Column, arrow_type, strings):
+        """
+        decode a string column of a page to arrow_type with arrow compute, the arrow equivalent of _decode_values.
+        anything arrow cannot cast goes through _decode_values\n
+        """
+        if arrow_type == pa.string():
+            return strings
+        pc = importlib.import_module('pyarrow.compute')
+        sentinels = dict(_SENTINELS.get(column.datatype, _EMPTY))
+        if column.datatype == 'Date':
+            sentinels[DATE_TODAY] = date.today()
+        try:
+            is_sentinel = pc.is_in(strings, value_set=pa.array(list(sentinels), type=pa.string()))
+            values = pc.cast(pc.if_else(is_sentinel, pa.scalar(None, pa.string()), strings), arrow_type)
+            for text, value in sentinels.items():
+                if value is not None:
+                    values = pc.if_else(pc.equal(strings, text), pa.scalar(value, arrow_type), values)
+            return values
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            return _arrow_array(pa, _decode_values(column.datatype, strings.to_pylist()), arrow_type)
 
     def indexof(self, rec):
-        return self._table_data.index(rec)
+        if self._lookup_kind(rec) != 'row':
+            return self._table_data.index(rec)
+        position = self._find_row(self._row_values(rec))
+        if position is None:
+            raise ValueError(f'{rec!r} is not in DataTable')
+        return position
 
     def del_row(self, rec):
         index = self.indexof(rec)
         self.__delitem__(index)
 
+    def delete_rows(self, rows, chunk_size: int = None, max_in_flight: int = None) -> BulkResult:
+        """
+        delete many rows, from RR in chunked bulk removals, several at once, then from the table in one pass.
+        in a batch, or with write_behind, the removals are queued instead\n
+        :param rows: rows to delete, matched to the table by key, or a predicate called with each DataRow that is True for the rows to delete
+        :param chunk_size: Optional. rows per removal transaction. default from _calc_optimal_pagesize(100_000)
+        :param max_in_flight: Optional. most removal transactions at once. default max_connections
+        :return: BulkResult summing the counts of every removal transaction, empty when nothing was sent
+        :raises RequestsError: non 200 response, or a transaction failed. only the rows of the chunks removed from RR
+        before the failure are removed from the table
+        """
+        positions, targets = self._delete_targets(rows)
+        return self.environment.run(self._remove_rows_async(positions, targets, chunk_size, max_in_flight))
+
+    async def delete_rows_async(self, rows, chunk_size: int = None, max_in_flight: int = None) -> BulkResult:
+        """
+        coroutine equivalent of delete_rows, for callers already running an event loop (e.g. Jupyter)\n
+        :param rows: rows to delete, matched to the table by key, or a predicate called with each DataRow that is True for the rows to delete
+        :param chunk_size: Optional. rows per removal transaction
+        :param max_in_flight: Optional. most removal transactions at once. default max_connections
+        :return: BulkResult summing the counts of every removal transaction
+        """
+        positions, targets = self._delete_targets(rows)
+        return await self.environment.run_async(self._remove_rows_async(positions, targets, chunk_size, max_in_flight))
+
+    def _delete_targets(self, rows):
+        """
+        :return: tuple of the positions of the rows to delete from the table and the rows to remove from RR now, none
+        when the table does not sync or the removals were queued
+        """
+        positions, targets = self._rows_to_delete(rows)
+        if not self.sync:
+            return positions, []
+        if self._write_behind or self._batch_depth:
+            self._push_deletes(targets)
+            return positions, []
+        self._unqueue(targets)
+        return positions, targets
+
+    async def _remove_rows_async(self, positions: list, targets: list, chunk_size: int = None,
+                                 max_in_flight: int = None) -> BulkResult:
+        result = BulkResult()
+        if targets:
+            completed = []
+            try:
+                result = await self._bulk_rows_async(targets, chunk_size, max_in_flight, remove=True,
+                                                     completed=completed)
+            except BaseException:
+                # the chunks removed from RR before the failure are removed from the table too
+                removed = {self._row_key(row) for row in completed}
+                self._remove_positions([i for i in positions if self._row_key(self._table_data[i]) in removed])
+                raise
+        self._remove_positions(positions)
+        return result
+
+    def _rows_to_delete(self, rows):
+        """
+        :return: tuple of the positions of the rows to delete from the table and the rows to remove from RR. given rows
+        are matched by key, so every row with the key is deleted whatever its other values, and are removed from RR even
+        if they are not in the table
+        """
+        if callable(rows):
+            matched = [(i, row) for i, row in enumerate(self._table_data) if rows(row)]
+            return [i for i, _ in matched], [row for _, row in matched]
+        targets = {}
+        for row in rows:
+            row = row if isinstance(row, DataRow) else DataRow(row, self)
+            targets[self._row_key(row)] = row
+        index = self._get_key_index()
+        if self._key_index_unique:
+            positions = sorted(index[key] for key in targets if key in index)
+        else:
+            positions = [i for i, row in enumerate(self._table_data) if self._row_key(row) in targets]
+        return positions, list(targets.values())
+
+    def _remove_positions(self, positions: list):
+        if not positions:
+            return
+        if self._columnar:
+            self._table_data.remove_positions(positions)
+        else:
+            drop = set(positions)
+            self._table_data[:] = [row for i, row in enumerate(self._table_data) if i not in drop]
+        self._total_row_count -= len(positions)
+        self._key_index = None
+
     async def _create_export_async(self, client, limit: asyncio.Semaphore = None):
         # https://help.kinaxis.com/20162/webservice/default.htm#rr_webservice/external/bulkread_rest.htm?
+        self._format_export_response(await self._request_export_async(client, limit))
 
+    async def _request_export_async(self, client, limit: asyncio.Semaphore = None) -> dict:
+        """
+        create an export of the table without recording it on the table, so a stream does not disturb a refresh\n
+        :return: export response, with ExportId and TotalRows
+        :raises RequestsError: non 200 response
+        """
         if self._filter:
             query_filter = self.filter
         else:
@@ -392,57 +1621,338 @@ class DataTable(Table, AbstractDataTable):
         self._logger.debug(f'Create Export payload sent is: {payload}')
         try:
             async with limit:
-                response = await client.post(url=self.environment.bulk_export_url, headers=self.environment.global_headers, content=payload)
+                response = await self.environment.request_async("POST", self.environment.bulk_export_url, client, content=payload)
         except:
             raise RequestsError(response, f"error during POST to: {self.environment.bulk_export_url}", payload)
         else:
             if response.status_code == 200:
-                self._format_export_response(json.loads(response.text))
+                return json.loads(response.text)
             else:
                 raise RequestsError(response, f"error during POST to: {self.environment.bulk_export_url}", payload)
 
     async def _get_export_results_async(self, client, startRow: int = 0, pageSize: int = 5000, limit: asyncio.Semaphore = None):
-        url = self.environment.bulk_export_url + "/" + self._exportID[1:] + "?startRow=" + str(startRow) + "&pageSize=" + str(pageSize) + "&delimiter=%09" + "&finishExport=false"
+        # data returned with tab delimiter %09. split results.
+        records = await self._get_export_page_async(client, startRow, pageSize, limit)
+        return self._decode_rows(records)
+
+    async def _get_export_page_async(self, client, startRow: int = 0, pageSize: int = 5000, limit: asyncio.Semaphore = None,
+                                     export_id: str = None):
+        """
+        fetch one page of the current export\n
+        :param export_id: Optional. export to page over, default the export of the current refresh
+        :return: list of tab delimited records, as returned by the server
+        :raises RequestsError: non 200 response
+        """
+        return _loads(await self._get_export_content_async(client, startRow, pageSize, limit,
+                                                           export_id=export_id))["Rows"]
+
+    async def _get_export_content_async(self, client, startRow: int = 0, pageSize: int = 5000, limit: asyncio.Semaphore = None,
+                                        retry_timeouts: bool = True, export_id: str = None):
+        """
+        fetch one page of the current export without parsing it\n
+        :param retry_timeouts: False to raise a timeout rather than retry the page at the same size
+        :param export_id: Optional. export to page over, default the export of the current refresh
+        :return: response body
+        :raises RequestsError: non 200 response
+        """
+        export_id = export_id or self._exportID
+        url = self.environment.bulk_export_url + "/" + export_id[1:] + "?startRow=" + str(startRow) + "&pageSize=" + str(pageSize) + "&delimiter=%09" + "&finishExport=false"
         if limit:
             async with limit:
-                response = await client.get(url=url, headers=self.environment.global_headers)
+                response = await self.environment.request_async("GET", url, client, idempotent=True,
+                                                                retry_timeouts=retry_timeouts)
                 if limit.locked():
                     self._logger.info("Concurrency limit reached, waiting ...")
                     await asyncio.sleep(1)
         else:
-            response = await client.get(url=url, headers=self.environment.global_headers)
+            response = await self.environment.request_async("GET", url, client, idempotent=True,
+                                                            retry_timeouts=retry_timeouts)
 
-        if response.status_code == 200:
-            response_dict = json.loads(response.text)
-        else:
+        if response.status_code != 200:
             raise RequestsError(response, f"error during GET to: {url}", None)
+        return response.content
+
+    async def _main_get_export_results_async(self, data_range, checkpoint: ExportCheckpoint = None,
+                                             ordered: bool = False, max_buffered_pages: int = None,
+                                             adaptive: bool = False):
+        # borrow the environment's connection pool, it stays open for the next refresh
+        limit = self.environment.limit
+        client = self.environment.client
+
+        if adaptive:
+            await self._create_export_async(client, limit)
+            pager = AdaptivePager(self._total_row_count, data_range, self.max_connections)
+            await pager.run(partial(self._fetch_adaptive_page_async, client), lambda start, rows: self._add_rows(rows),
+                            limit, ordered, max_buffered_pages)
+            return
+
+        if ordered:
+            fetch_pages = partial(self._fetch_export_pages_ordered_async, max_buffered_pages=max_buffered_pages)
+        else:
+            fetch_pages = self._fetch_export_pages_async
+
+        manifest = checkpoint.load() if checkpoint else None
+        if manifest:
+            self._exportID = manifest['ExportId']
+            self._total_row_count = manifest['TotalRows']
+            data_range = manifest['PageSize']
+            completed = checkpoint.completed_pages()
+            self._logger.info(f'resuming export {self._exportID}, {len(completed)} pages already fetched')
+            try:
+                await fetch_pages(client, limit, data_range, checkpoint, completed)
+            except RequestsError:
+                # the export has most likely expired on the server, start again
+                self._logger.warning(f'export {self._exportID} could not be resumed, starting a new export')
+                self._table_data.clear()
+                self._key_index = None
+            else:
+                checkpoint.clear()
+                return
 
-        # data returned with tab delimiter %09. split results.
-        rows = [DataRow(rec.split('\t'), self) for rec in response_dict["Rows"]]
-        return rows
+        await self._create_export_async(client, limit)
+        if checkpoint:
+            checkpoint.start(self._exportID, self._total_row_count, data_range)
+        await fetch_pages(client, limit, data_range, checkpoint)
+        if checkpoint:
+            checkpoint.clear()
+
+    async def _fetch_export_pages_async(self, client, limit, data_range, checkpoint: ExportCheckpoint = None,
+                                        completed: set = frozenset()):
+        for start in sorted(completed):
+            self._add_rows(await self._read_checkpoint_page_async(checkpoint, start))
+
+        pending = [i for i in range(0, self._total_row_count, data_range) if i not in completed]
+        tasks = [asyncio.ensure_future(self._fetch_export_page_async(client, i, data_range, limit, checkpoint))
+                 for i in pending]
+        try:
+            for coroutine in asyncio.as_completed(tasks):
+                self._add_rows(await coroutine)
+        except BaseException:
+            await self._abandon_export_pages_async(tasks, checkpoint)
+            raise
+
+    async def _fetch_export_pages_ordered_async(self, client, limit, data_range, checkpoint: ExportCheckpoint = None,
+                                                completed: set = frozenset(), max_buffered_pages: int = None):
+        """
+        fetch pages concurrently but add them to the table in row order. pages that arrive early wait in a reorder
+        buffer keyed by startRow. no more than max_buffered_pages are in flight or buffered at once\n
+        """
+        window = max_buffered_pages or self.max_connections
+        if window < 1:
+            raise ValueError('max_buffered_pages must be at least 1')
+        pending = deque(range(0, self._total_row_count, data_range))
+        next_start = 0
+        tasks = {}
+        buffered = {}
+
+        def launch():
+            while pending and len(tasks) + len(buffered) < window:
+                start = pending.popleft()
+                if start in completed:
+                    tasks[start] = asyncio.ensure_future(self._read_checkpoint_page_async(checkpoint, start))
+                else:
+                    tasks[start] = asyncio.ensure_future(
+                        self._fetch_export_page_async(client, start, data_range, limit, checkpoint))
 
-    async def _main_get_export_results_async(self, data_range):
-        limit = self.limit
-        client = self.client
+        launch()
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_COMPLETED)
+                for start in [start for start, task in tasks.items() if task in done]:
+                    buffered[start] = tasks.pop(start).result()
+                # the page at next_start is always in flight or buffered, so the buffer always drains
+                while next_start in buffered:
+                    self._add_rows(buffered.pop(next_start))
+                    next_start += data_range
+                launch()
+        except BaseException:
+            await self._abandon_export_pages_async(list(tasks.values()), checkpoint)
+            raise
+
+    @staticmethod
+    async def _abandon_export_pages_async(tasks, checkpoint: ExportCheckpoint = None):
+        if checkpoint:
+            # let the pages in flight land in the checkpoint so a rerun does not fetch them again
+            await asyncio.gather(*tasks, return_exceptions=True)
+        else:
+            for task in tasks:
+                task.cancel()
+
+    async def _read_checkpoint_page_async(self, checkpoint: ExportCheckpoint, startRow):
+        records = await asyncio.to_thread(checkpoint.read_page, startRow)
+        return self._decode_rows(records)
+
+    async def _fetch_export_page_async(self, client, startRow, pageSize, limit, checkpoint: ExportCheckpoint = None):
+        content = await self._get_export_content_async(client, startRow, pageSize, limit)
+        # parsing and splitting happen on the decode executor, if there is one, while other pages download
+        records, columns = await self.environment.decode_async(_decode_export_page, content, len(self.columns),
+                                                               self._datatypes(), checkpoint is not None)
+        if checkpoint:
+            await asyncio.to_thread(checkpoint.save_page, startRow, records)
+        return self._rows_from_columns(columns)
+
+    async def _fetch_adaptive_page_async(self, client, startRow, pageSize):
+        # the pager holds the concurrency limit so its timing only covers the request and decoding. a timeout is
+        # left to the pager, which retries the page as two smaller ones
+        content = await self._get_export_content_async(client, startRow, pageSize, retry_timeouts=False)
+        _, columns = await self.environment.decode_async(_decode_export_page, content, len(self.columns),
+                                                         self._datatypes())
+        rows = self._rows_from_columns(columns)
+        return rows, len(columns[0]) if columns else 0, len(content)
+
+    def _datatypes(self):
+        return tuple(c.datatype for c in self.columns) if self._typed else None
+
+    def _decode_rows(self, records: list) -> list:
+        """
+        decode the records of a page into what _add_rows takes, the columns for a columnar table or DataRows\n
+        """
+        return self._rows_from_columns(self._decode_columns(records))
 
-        await self._create_export_async(client, limit)
+    def _decode_page(self, records: list) -> list:
+        return [DataRow._from_values(values, self) for values in zip(*self._decode_columns(records))]
+
+    def _decode_columns(self, records: list) -> list:
+        return _decode_records(records, len(self.columns), self._datatypes())
 
-        tasks = [asyncio.Task(self._get_export_results_async(client, i, data_range, limit)) for i in range(0, self._total_row_count - data_range, data_range)]
-        for coroutine in asyncio.as_completed(tasks):
-            self._table_data.extend(await coroutine)
+    def _rows_from_columns(self, columns: list) -> list:
+        # a ColumnStore takes the columns as they are, no DataRow is built per record
+        if self._columnar:
+            return columns
+        return [DataRow._from_values(values, self) for values in zip(*columns)]
+
+    def _add_rows(self, rows: list):
+        self._key_index = None
+        if self._columnar:
+            self._table_data.extend_columns(rows)
+        else:
+            self._table_data.extend(rows)
 
-        remaining_records = self._total_row_count % data_range
-        if remaining_records > 0:
-            self._table_data.extend(await self._get_export_results_async(client, self._total_row_count - remaining_records, data_range,limit))
-        # todo can I close client here? No. Need to shift this to environment level for client and limit
-        await self.client.aclose()
+    def _encode_values(self, row) -> list:
+        if not self._typed:
+            return row.data
+        return [_encode_value(col.datatype, value) for col, value in zip(self.columns, row)]
 
-    def RefreshData_async(self, data_range: int = 500_000):
+    def RefreshData_async(self, data_range: int = 500_000, spill_directory: str = None, ordered: bool = False,
+                          max_buffered_pages: int = None, adaptive: bool = False):
+        """
+        refresh the table data, fetching pages concurrently on the environment event loop. blocks until complete\n
+        :param data_range: suggested page size
+        :param spill_directory: Optional. directory completed pages are checkpointed to. if the refresh fails, rerunning it with the same directory resumes at the missing pages
+        :param ordered: Optional. True to keep rows in server order rather than the order pages complete in
+        :param max_buffered_pages: Optional. when ordered, the most pages in flight or waiting to be reordered. default is the environment max_connections
+        :param adaptive: Optional. True to tune page size and concurrency from the throughput of the pages fetched, data_range is the size of the first pages. cannot be combined with spill_directory
+        """
+        self.environment.run(self._refresh_data_async(data_range, spill_directory, ordered, max_buffered_pages,
+                                                      adaptive))
+
+    async def refresh_data_async(self, data_range: int = 500_000, spill_directory: str = None, ordered: bool = False,
+                                 max_buffered_pages: int = None, adaptive: bool = False):
+        """
+        coroutine equivalent of RefreshData_async, for callers already running an event loop (e.g. Jupyter)\n
+        :param data_range: suggested page size
+        :param spill_directory: Optional. directory completed pages are checkpointed to
+        :param ordered: Optional. True to keep rows in server order
+        :param max_buffered_pages: Optional. when ordered, the most pages in flight or waiting to be reordered
+        :param adaptive: Optional. True to tune page size and concurrency from the throughput of the pages fetched
+        """
+        await self.environment.run_async(self._refresh_data_async(data_range, spill_directory, ordered,
+                                                                  max_buffered_pages, adaptive))
+
+    async def _refresh_data_async(self, data_range: int, spill_directory: str = None, ordered: bool = False,
+                                  max_buffered_pages: int = None, adaptive: bool = False):
+        if adaptive and spill_directory:
+            # a checkpoint is resumed against a fixed page plan, which adaptive paging does not have
+            raise ValueError('adaptive paging cannot be combined with spill_directory')
         calc_data_range = self._calc_optimal_pagesize(data_range)
+        checkpoint = ExportCheckpoint(spill_directory, self._export_key()) if spill_directory else None
+        if self.pending:
+            # queued changes are sent first so the reloaded rows include them
+            await self._flush_async()
         self._table_data.clear()
-        self.environment.refresh_auth()
-        asyncio.run(self._main_get_export_results_async(calc_data_range))
-        self._exportID = None
+        self._key_index = None
+        self._complete = False
+        try:
+            await self._main_get_export_results_async(calc_data_range, checkpoint, ordered, max_buffered_pages,
+                                                      adaptive)
+        finally:
+            self._exportID = None
+        self._complete = not self._filter
+
+    def stream_pages(self, page_size: int = None, max_in_flight: int = None):
+        """
+        iterate over a fresh export of the table one page at a time, in row order, without keeping the table in memory.
+        the rows are not added to the DataTable\n
+        :param page_size: rows per page. Optional, default is the optimal page size for STREAM_PAGESIZE
+        :param max_in_flight: pages fetched ahead of the consumer. Optional, default is the environment max_connections
+        :return: generator of lists of DataRow
+        """
+        return self.environment.run_iter(self._stream_pages_async(page_size, max_in_flight))
+
+    def stream_rows(self, page_size: int = None, max_in_flight: int = None):
+        """
+        iterate over a fresh export of the table row by row, see stream_pages\n
+        :param page_size: rows per page. Optional
+        :param max_in_flight: pages fetched ahead of the consumer. Optional
+        :return: generator of DataRow
+        """
+        for page in self.stream_pages(page_size, max_in_flight):
+            yield from page
+
+    def stream_pages_async(self, page_size: int = None, max_in_flight: int = None):
+        """
+        async iterator equivalent of stream_pages, for callers already running an event loop\n
+        :param page_size: rows per page. Optional
+        :param max_in_flight: pages fetched ahead of the consumer. Optional
+        :return: async generator of lists of DataRow
+        """
+        return self.environment.run_iter_async(self._stream_pages_async(page_size, max_in_flight))
+
+    async def stream_rows_async(self, page_size: int = None, max_in_flight: int = None):
+        """
+        async iterator equivalent of stream_rows\n
+        :param page_size: rows per page. Optional
+        :param max_in_flight: pages fetched ahead of the consumer. Optional
+        :return: async generator of DataRow
+        """
+        async for page in self.stream_pages_async(page_size, max_in_flight):
+            for row in page:
+                yield row
+
+    async def _stream_pages_async(self, page_size: int = None, max_in_flight: int = None, decode=None):
+        # decode turns the records of a page into what is yielded, by default a list of DataRow
+        decode = decode or self._decode_page
+        page_size = page_size or self._calc_optimal_pagesize(self.STREAM_PAGESIZE)
+        max_in_flight = max_in_flight or self.max_connections
+        if page_size < 1 or max_in_flight < 1:
+            raise ValueError('page_size and max_in_flight must be at least 1')
+        limit = self.environment.limit
+        client = self.environment.client
+
+        # the export is kept to the stream, the table's own export and row count are left as they are
+        export = await self._request_export_async(client, limit)
+        export_id = export["ExportId"]
+        starts = iter(range(0, export["TotalRows"], page_size))
+
+        def fetch(start):
+            return asyncio.ensure_future(self._get_export_page_async(client, start, page_size, limit, export_id))
+
+        # pages are awaited in row order. at most max_in_flight are fetched or held ahead of the consumer
+        in_flight = deque(fetch(start) for start in islice(starts, max_in_flight))
+        try:
+            while in_flight:
+                records = await in_flight.popleft()
+                start = next(starts, None)
+                if start is not None:
+                    in_flight.append(fetch(start))
+                yield decode(records)
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    def _export_key(self) -> str:
+        return ExportCheckpoint.key(self.environment.base_url, self.scenario, self._table_namespace, self._table_name,
+                                    [f.name for f in self.columns], self._filter or '')
 
     def _format_export_response(self, response_dict):
 
@@ -515,18 +2025,147 @@ class DataTable(Table, AbstractDataTable):
         return round(PageSize)
 
     def add_row(self, rec):
-        self.environment.refresh_auth()
         self._create_upload(rec)
         self._complete_upload()
         self._uploadId = None
 
-    def add_rows(self, rows: list):
-        self.environment.refresh_auth()
-        pagesize = self._calc_optimal_pagesize(100_000)
-        for i in range(0, len(rows), pagesize):
-            self._create_upload(*rows[i:i + pagesize])
-            self._complete_upload()
-            self._uploadId = None
+    def add_rows(self, rows: list, chunk_size: int = None, max_in_flight: int = None):
+        """
+        upload rows in chunks, running several upload transactions at once on the environment event loop. blocks until
+        every chunk is complete. on a failure the chunks not yet sent are dropped, those already complete stay uploaded\n
+        :param rows: list of DataRow
+        :param chunk_size: Optional. rows per upload transaction. default from _calc_optimal_pagesize(100_000)
+        :param max_in_flight: Optional. most upload transactions at once. default max_connections, 1 uploads one chunk after another
+        :return: BulkResult summing the counts of every transaction
+        :raises RequestsError: non 200 response, or a transaction failed
+        :raises DataError: a transaction partially succeeded with more than 10 error rows
+        """
+        return self.environment.run(self._bulk_rows_async(rows, chunk_size, max_in_flight))
+
+    async def add_rows_async(self, rows: list, chunk_size: int = None, max_in_flight: int = None):
+        """
+        coroutine equivalent of add_rows, for callers already running an event loop (e.g. Jupyter)\n
+        :param rows: list of DataRow
+        :param chunk_size: Optional. rows per upload transaction
+        :param max_in_flight: Optional. most upload transactions at once. default max_connections
+        :return: BulkResult summing the counts of every transaction
+        """
+        return await self.environment.run_async(self._bulk_rows_async(rows, chunk_size, max_in_flight))
+
+    async def _bulk_rows_async(self, rows: list, chunk_size: int = None, max_in_flight: int = None,
+                               remove: bool = False, completed: list = None) -> BulkResult:
+        """
+        send rows as chunks through create and complete upload, or removal, transactions. while max_in_flight
+        transactions are on the server the next chunk is already being serialised, on the decode executor if there is
+        one. the first failure cancels the chunks not yet sent, lets the transactions already created on the server
+        complete so none is left open, and is raised. the chunks that completed stay on the server\n
+        :param completed: Optional. list the rows of each chunk are added to once its transaction succeeds
+        """
+        chunk_size = chunk_size or self._calc_optimal_pagesize(100_000)
+        max_in_flight = max_in_flight or self.max_connections
+        if chunk_size < 1 or max_in_flight < 1:
+            raise ValueError('chunk_size and max_in_flight must be at least 1')
+        client = self.environment.client
+        in_flight = asyncio.Semaphore(max_in_flight)
+        header = {'Scenario': self.scenario,
+                  'Table': {'Namespace': self._table_namespace, 'Name': self._table_name},
+                  'Fields': self._bulk_fields()}
+        pending = deque(range(0, len(rows), chunk_size))
+        result = BulkResult()
+        tasks = set()
+        sending = set()
+        open_transactions = set()
+        error = None
+
+        async def transaction(start):
+            chunk = [{"Values": self._encode_values(row)} for row in rows[start:start + chunk_size]]
+            payload = await self.environment.decode_async(_dumps, dict(header, Rows=chunk))
+            async with in_flight:
+                sending.add(asyncio.current_task())
+                results = await self._bulk_transaction_async(client, payload, remove, open_transactions)
+            if completed is not None:
+                completed.extend(rows[start:start + chunk_size])
+            return results
+
+        def collect(finished):
+            nonlocal error
+            for task in finished:
+                if task.cancelled():
+                    continue
+                if task.exception() is None:
+                    result.add(task.result())
+                elif error is None:
+                    error = task.exception()
+
+        try:
+            while (pending or tasks) and error is None:
+                # one more chunk than max_in_flight, so the next payload is ready when a transaction completes
+                while pending and len(tasks) <= max_in_flight:
+                    tasks.add(asyncio.ensure_future(transaction(pending.popleft())))
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+            if error is not None:
+                # chunks not yet sent are dropped, transactions already on the server are completed
+                for task in tasks - sending:
+                    task.cancel()
+                if tasks:
+                    done, tasks = await asyncio.wait(tasks)
+                    collect(done)
+                raise error
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            self._logger.error(f'bulk {"removal" if remove else "upload"} stopped. completed so far: {result!r}')
+            if open_transactions:
+                self._logger.warning(f'bulk {"removal" if remove else "upload"} transactions created but never '
+                                     f'completed: {sorted(open_transactions)}')
+            raise
+        self._logger.info(f'bulk {"removal" if remove else "upload"} of {len(rows)} rows complete: {result!r}')
+        return result
+
+    async def _bulk_transaction_async(self, client, payload: bytes, remove: bool = False,
+                                      open_transactions: set = None) -> dict:
+        """
+        create and complete one upload or removal transaction\n
+        :param open_transactions: Optional. holds the transaction id between create and complete
+        :return: Results of the complete response
+        :raises RequestsError: non 200 response, or the transaction failed
+        :raises DataError: an upload partially succeeded with more than 10 error rows
+        """
+        url = self.environment.bulk_remove_url if remove else self.environment.bulk_upload_url
+        limit = self.environment.limit
+        async with limit:
+            response = await self.environment.request_async("POST", url, client, content=payload)
+        if response.status_code != 200:
+            raise RequestsError(response, f"error during POST to: {url}", payload)
+        transaction_id = _loads(response.content)['RemovalId' if remove else 'UploadId']
+        if open_transactions is not None:
+            open_transactions.add(transaction_id)
+
+        url = f'{url}/{transaction_id[1:]}/complete'
+        async with limit:
+            response = await self.environment.request_async("POST", url, client)
+        if open_transactions is not None:
+            open_transactions.discard(transaction_id)
+        if response.status_code != 200:
+            raise RequestsError(response, f"error during POST to: {url}")
+        results = _loads(response.content)['Results']
+        response_readable = self._format_upload_delete_response(results)
+
+        if results['Status'] == 'Failure':
+            raise RequestsError(response, f"Status is Failure during bulk complete. error during POST to: {url}. {response.text}", None)
+        elif not remove and results['Status'] == 'Partial Success' and results['ErrorRowCount'] > 10:
+            raise DataError(response.text, f"Status is Partial Success during bulk upload complete, error count: {str(results['ErrorRowCount'])}")
+        elif remove and results['Status'] != 'Success':
+            self._logger.warning(response_readable)
+        else:
+            self._logger.debug(response_readable)
+        return results
+
+    def _bulk_fields(self) -> list:
+        # fields on another namespace are qualified with it
+        return [f.name if self._table_namespace == self.get_field(f.name).fieldNamespace
+                else f.fieldNamespace + '::' + f.name for f in self.columns]
 
     def _create_upload(self, *args):
         # https://help.kinaxis.com/20162/webservice/default.htm#rr_webservice/external/update_rest.htm?
@@ -534,11 +2173,10 @@ class DataTable(Table, AbstractDataTable):
                  'Name': self._table_name}
 
         # local_query_fields = [f.name for f in self.columns]
-        local_query_fields = [f.name if self._table_namespace == self.get_field(
-            f.name).fieldNamespace else f.fieldNamespace + '::' + f.name for f in self.columns]
+        local_query_fields = self._bulk_fields()
         # local_query_fields = [f.name if self._table_namespace == self.get_field(f.name).fieldNamespace else f.fieldNamespace + '::' + f.name for f in self.columns]
         # local_query_fields = [f.name if self._table_namespace == f.fieldNamespace else f.fieldNamespace + '::' + f.name for f in self.columns]
-        rows = [{"Values": i.data} for i in args]
+        rows = [{"Values": self._encode_values(i)} for i in args]
 
         payload = json.dumps({
             'Scenario': self.scenario,
@@ -547,7 +2185,7 @@ class DataTable(Table, AbstractDataTable):
             'Rows': rows
         })
         self._logger.debug(f'Create Upload payload: {payload}')
-        response = requests.request("POST", self.environment.bulk_upload_url, headers=self.environment.global_headers, data=payload)
+        response = self.environment.request("POST", self.environment.bulk_upload_url, data=payload)
 
         # check valid response
         if response.status_code == 200:
@@ -558,7 +2196,7 @@ class DataTable(Table, AbstractDataTable):
 
     def _complete_upload(self):
         url = f'{self.environment.bulk_upload_url}/{self._uploadId[1:]}/complete'
-        response = requests.request("POST", url, headers=self.environment.global_headers)
+        response = self.environment.request("POST", url)
 
         if response.status_code == 200:
             response_dict = json.loads(response.text)
@@ -580,11 +2218,11 @@ class DataTable(Table, AbstractDataTable):
         payload = json.dumps({
             'Scenario': self.scenario,
             'Table': {'Namespace': self._table_namespace, 'Name': self._table_name},
-            'Fields': [f.name if self._table_namespace == self.get_field(f.name).fieldNamespace else f.fieldNamespace + '::' + f.name for f in self.columns],
-            'Rows': [{"Values": i.data} for i in args]
+            'Fields': self._bulk_fields(),
+            'Rows': [{"Values": self._encode_values(i)} for i in args]
         })
         self._logger.debug(f'Create Deletion payload: {payload}')
-        response = requests.request("POST", self.environment.bulk_remove_url, headers=self.environment.global_headers, data=payload)
+        response = self.environment.request("POST", self.environment.bulk_remove_url, data=payload)
 
         # check valid response
         if response.status_code == 200:
@@ -595,7 +2233,7 @@ class DataTable(Table, AbstractDataTable):
 
     def _complete_deletion(self):
         url = self.environment.bulk_remove_url + "/" + self._uploadId[1:] + '/complete'
-        response = requests.request("POST", url, headers=self.environment.global_headers)
+        response = self.environment.request("POST", url)
 
         if response.status_code == 200:
             response_dict = json.loads(response.text)
@@ -642,17 +2280,26 @@ class DataRow(UserList):
         self._data_table = data_table
 
         if len(iterable) == len(self._data_table.columns):
-            super().__init__(str(item) for item in iterable)
+            super().__init__(iterable if data_table.typed else (str(item) for item in iterable))
         else:
             raise DataError(str(iterable),
                             f'mismatch in length of data table columns {str(len(self._data_table.columns))} and row: {str(len(iterable))} ')
 
+    @classmethod
+    def _from_values(cls, values, data_table: DataTable):
+        # rows decoded from an export already have one value per column and need no validation
+        row = cls.__new__(cls)
+        row._data_table = data_table
+        row.data = list(values)
+        return row
+
     def __setitem__(self, index, item):
         # assign a new value using the item’s index, like a_list[index] = item
         # when something is updated it should be pushed back to RR, if datatable is sync
-        super().__setitem__(index, str(item))
+        super().__setitem__(index, item if self._data_table.typed else str(item))
+        self._data_table._key_changed(index)
         if self._data_table.sync:
-            self._data_table.add_row(self)
+            self._data_table._push_rows([self])
 
     def __eq__(self, other):
         return super().__eq__(other)  # and self._data_table == other._data_table
@@ -784,3 +2431,36 @@ class DataRow(UserList):
         data_dict = json.loads(json_str)
         return cls.from_dict(data_dict, data_table)
 
+
+class DataRowView(DataRow):
+    """
+    a row of a columnar DataTable. values are read from and written to the ColumnStore rather than held by the row\n
+    :param store: ColumnStore holding the row
+    :param position: row position in the store
+    """
+    def __init__(self, store: ColumnStore, position: int):
+        self._data_table = store._data_table
+        self._store = store
+        self._position = position
+
+    @property
+    def data(self):
+        return self._store.row_values(self._position)
+
+    def __len__(self):
+        return len(self._data_table.columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.data[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('DataRow index out of range')
+        return self._store.value(self._position, index)
+
+    def __setitem__(self, index, item):
+        self._store.set_value(self._position, index, item)
+        self._data_table._key_changed(index)
+        if self._data_table.sync:
+            self._data_table._push_rows([self])
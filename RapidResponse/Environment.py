@@ -1,17 +1,48 @@
 import abc
 import asyncio
 import base64
+import contextlib
 import json
 import logging
+import multiprocessing
 import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 import httpx
 import requests
+from requests.adapters import HTTPAdapter
 
-from RapidResponse.DataModel import DataModel
+from RapidResponse.DataModel import DataModelRegistry
 from RapidResponse.Utils import WORKBOOK_URL, BULK_URL, WORKSHEET_URL, SCRIPT_URL, ENTERPRISE_DATA_SCENARIO, SetupError, \
     RequestsError
 
+# environments with write-behind tables by id, flushed at exit
+_write_behind_environments = weakref.WeakValueDictionary()
+_write_behind_exit_lock = threading.Lock()
+_write_behind_exit_registered = False
+
+
+def _flush_write_behind_at_exit():
+    for environment in list(_write_behind_environments.values()):
+        environment._flush_write_behind()
+
+
+def _register_write_behind_exit():
+    # a threading exit hook runs before the concurrent.futures one that shuts the decode executors down, so the flush
+    # can still serialise on them. atexit hooks run after it
+    global _write_behind_exit_registered
+    with _write_behind_exit_lock:
+        if not _write_behind_exit_registered:
+            threading._register_atexit(_flush_write_behind_at_exit)
+            _write_behind_exit_registered = True
+
 
 class BaseEnvironment(abc.ABC):
     """
@@ -19,6 +50,10 @@ class BaseEnvironment(abc.ABC):
         :param configuration: dictionary containing necessary information for initialising environment
         :raises SetupError: Data Model directory not valid
         """
+    # seconds before an oauth2 token expires that it is proactively refreshed
+    TOKEN_REFRESH_MARGIN = 60
+    # statuses an idempotent request is retried on
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
 
     def __init__(self, configuration: dict):
 
@@ -33,12 +68,31 @@ class BaseEnvironment(abc.ABC):
         self.global_headers = dict()
         self._data_model_dir = None
         self.data_model = None
+        self._data_model_acquired = False
         self.scenarios = None
         self._maxconnections = None
         self._session = None
+        self._http_limits = None
+        self._http_timeout = None
+        self._http2 = False
+        self._max_retries = 0
+        self._retry_backoff = 0.0
+        self._retry_backoff_max = 0.0
+        self._client = None
+        self._client_loop = None
+        self._limit = None
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+        self._auth_lock = None
+        self._token_refresh_at = 0.0
+        self._decode_executor_type = None
+        self._decode_workers = None
+        self._decode_executor = None
         self._variables_script = None
         self._worksheet_script = None
-        self.client = None
+        # write-behind tables by id, flushed on close or at interpreter exit
+        self._write_behind_tables = weakref.WeakValueDictionary()
 
 
         if not isinstance(configuration, dict):
@@ -61,12 +115,37 @@ class BaseEnvironment(abc.ABC):
         return self
 
     def close(self):
+        self._flush_write_behind()
         self._session.close()
-        self.client.aclose()
+        self._close_loop()
+        self._close_decode_executor()
+        if self._data_model_acquired:
+            DataModelRegistry.release(self.data_model)
+            self._data_model_acquired = False
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
+    def _register_write_behind(self, table):
+        _register_write_behind_exit()
+        _write_behind_environments[id(self)] = self
+        self._write_behind_tables[id(table)] = table
+
+    def _flush_write_behind(self):
+        """
+        send the changes still queued on every write-behind table of this environment. a failure is logged with the
+        number of changes not sent, the other tables are still flushed\n
+        """
+        _write_behind_environments.pop(id(self), None)
+        tables, self._write_behind_tables = list(self._write_behind_tables.values()), weakref.WeakValueDictionary()
+        for table in tables:
+            if not table.pending:
+                continue
+            try:
+                table.flush()
+            except Exception as e:
+                self._logger.error(f'write-behind flush of {table!r} failed, {table.pending} changes were not sent: {e!r}')
+
     def set_scenarios(self, *args):
         """
 
@@ -132,15 +211,187 @@ class BaseEnvironment(abc.ABC):
     def max_connections(self):
         return self._maxconnections
 
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        event loop dedicated to this environment, running in a background thread. async requests are made on it so the
+        connection pool outlives any single call\n
+        :return: asyncio.AbstractEventLoop
+        """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name='RapidPy-env-loop', daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+    def run(self, coro):
+        """
+        run a coroutine on the environment event loop and block until it completes. this is the sync facade, it works
+        whether or not an event loop is already running in the calling thread (e.g. Jupyter)\n
+        :param coro: coroutine to run
+        :return: result of the coroutine
+        :raises RuntimeError: called from the environment event loop itself, await the coroutine instead
+        """
+        loop = self.loop
+        if self._running_loop() is loop:
+            coro.close()
+            raise RuntimeError('Environment.run cannot block the environment event loop, await the coroutine instead')
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def run_async(self, coro):
+        """
+        await a coroutine on the environment event loop from any other event loop, e.g. a FastAPI request handler\n
+        :param coro: coroutine to run
+        :return: result of the coroutine
+        """
+        loop = self.loop
+        if self._running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    def run_iter(self, agen):
+        """
+        iterate an async generator on the environment event loop from synchronous code. each item is produced on the
+        loop and handed back to the calling thread\n
+        :param agen: async generator to iterate
+        :return: generator of the items yielded by agen
+        """
+        done = object()
+        try:
+            while (item := self.run(self._anext(agen, done))) is not done:
+                yield item
+        finally:
+            self.run(agen.aclose())
+
+    async def run_iter_async(self, agen):
+        """
+        iterate an async generator on the environment event loop from any other event loop\n
+        :param agen: async generator to iterate
+        :return: async generator of the items yielded by agen
+        """
+        done = object()
+        try:
+            while (item := await self.run_async(self._anext(agen, done))) is not done:
+                yield item
+        finally:
+            await self.run_async(agen.aclose())
+
+    @staticmethod
+    async def _anext(agen, default):
+        try:
+            return await agen.__anext__()
+        except StopAsyncIteration:
+            return default
+
+    @property
+    def decode_executor(self):
+        """
+        executor export pages are decoded on, created on first use from the decode_executor configuration.
+        None when pages are decoded on the event loop\n
+        :return: concurrent.futures.Executor or None
+        """
+        with self._loop_lock:
+            if self._decode_executor is None and self._decode_executor_type == 'thread':
+                self._decode_executor = ThreadPoolExecutor(max_workers=self._decode_workers,
+                                                           thread_name_prefix='RapidPy-decode')
+            elif self._decode_executor is None and self._decode_executor_type == 'process':
+                # spawn rather than fork, the environment already runs threads that a forked child would inherit
+                self._decode_executor = ProcessPoolExecutor(max_workers=self._decode_workers,
+                                                            mp_context=multiprocessing.get_context('spawn'))
+            return self._decode_executor
+
+    async def decode_async(self, func, *args):
+        """
+        call func(*args) on the decode executor, so the event loop keeps fetching while a page is decoded.
+        without a decode executor func is called directly\n
+        :param func: module level function taking and returning plain data, it is pickled for a process executor
+        :return: result of func
+        """
+        executor = self.decode_executor
+        if executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+    def _close_decode_executor(self):
+        with self._loop_lock:
+            executor, self._decode_executor = self._decode_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        keep-alive requests session shared by every synchronous call made against this environment\n
+        """
+        return self._session
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """
+        keep-alive async client shared by every DataTable, Worksheet and Script using this environment.
+        connections are bound to the event loop they were opened on, so a new client is created if the running loop has changed\n
+        :return: httpx.AsyncClient
+        """
+        loop = self._running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._discard_client()
+            self._client = httpx.AsyncClient(limits=self._http_limits, timeout=self._http_timeout, http2=self._http2)
+            self._client_loop = loop
+        return self._client
+
+    @property
+    def limit(self) -> asyncio.Semaphore:
+        """
+        semaphore capping the number of concurrent requests against this environment to max_connections\n
+        :return: asyncio.Semaphore
+        """
+        if self._limit is None or self._client_loop is not self._running_loop():
+            # rebinding the client to this loop also resets the semaphore
+            _ = self.client
+            self._limit = asyncio.Semaphore(self.max_connections)
+        return self._limit
+
+    @staticmethod
+    def _running_loop():
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    def _discard_client(self):
+        # the pool can only be closed cleanly from the loop that owns it. otherwise let the connections be collected
+        client, loop = self._client, self._client_loop
+        self._client = None
+        self._client_loop = None
+        self._limit = None
+        if client is not None and loop is not None and loop is self._running_loop():
+            loop.create_task(client.aclose())
+
+    def _close_loop(self):
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            if loop is not None and self._running_loop() is loop:
+                raise RuntimeError('Environment.close cannot be called from the environment event loop')
+            self._loop = None
+            self._loop_thread = None
+        if loop is None:
+            self._discard_client()
+            return
+        # close the pool on the loop that owns it, then stop the loop
+        if self._client is not None and self._client_loop is loop:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), loop).result()
+        self._discard_client()
+        self._auth_lock = None
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
 class Environment(BaseEnvironment):
     def __init__(self, configuration: dict):
         super().__init__(configuration)
-        self._session = requests.Session()
-        self._maxconnections = 8
-
-        timeout = httpx.Timeout(10.0, connect=60.0)
-        self.client = httpx.AsyncClient(timeout=timeout)
-        self.limit = asyncio.Semaphore(self.max_connections)
+        # connection pools
+        self._configure_http(configuration)
 
         # url
         self._configure_url(configuration)
@@ -177,6 +428,40 @@ class Environment(BaseEnvironment):
             raise ValueError(f'invalid authentication type {self.auth_type}')
         self.refresh_auth()
 
+    def _configure_http(self, configuration):
+        """
+        size the connection pools and decode executor shared by all resources created against this environment\n
+        :param configuration: dictionary containing the optional keys max_connections, max_keepalive_connections, keepalive_expiry, timeout, connect_timeout, http2, max_retries, retry_backoff, retry_backoff_max, decode_executor and decode_workers
+        :raises SetupError: http2 requested but the h2 package is not installed
+        """
+        self._maxconnections = int(configuration.get('max_connections', 8))
+        if self._maxconnections < 1:
+            raise ValueError('max_connections must be at least 1')
+        self._http_limits = httpx.Limits(max_connections=self._maxconnections,
+                                         max_keepalive_connections=configuration.get('max_keepalive_connections', self._maxconnections),
+                                         keepalive_expiry=configuration.get('keepalive_expiry', 30.0))
+        self._http_timeout = httpx.Timeout(configuration.get('timeout', 10.0),
+                                           connect=configuration.get('connect_timeout', 60.0))
+        self._max_retries = int(configuration.get('max_retries', 3))
+        self._retry_backoff = float(configuration.get('retry_backoff', 0.5))
+        self._retry_backoff_max = float(configuration.get('retry_backoff_max', 60.0))
+        self._http2 = bool(configuration.get('http2', False))
+        if self._http2:
+            try:
+                import h2
+            except ImportError:
+                raise SetupError('http2 requires the h2 package, install it with: pip install RapidResponse[http2]')
+
+        self._decode_executor_type = configuration.get('decode_executor')
+        if self._decode_executor_type not in (None, 'thread', 'process'):
+            raise ValueError(f"invalid decode_executor {self._decode_executor_type}, expected 'thread', 'process' or None")
+        self._decode_workers = configuration.get('decode_workers')
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._maxconnections)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
     def _configure_workbook_defaults(self, configuration):
         try:
             self._variables_script = configuration['variables_script']
@@ -203,23 +488,156 @@ class Environment(BaseEnvironment):
             else:
                 raise SetupError("Data Model directory not valid: " + configuration['data_model_directory'])
 
-        # bootstrap in data model from local
+        # compiled snapshot of the data model, reused while its source is unchanged
+        cache_dir = configuration.get('data_model_cache_directory')
+
+        # bootstrap in data model from local. the data model is shared with any other environment using the same source
         try:
             bootstrap_wbk = configuration['data_model_bootstrap']
         except KeyError:
-            self.data_model = DataModel(None, None, None, None)
+            self.data_model = DataModelRegistry.acquire(None, None, None, None, cache_directory=cache_dir)
         else:
-            self.data_model = DataModel(data_model_directory=None, url=self.base_url, headers=self.global_headers,
-                                        workbook=bootstrap_wbk)
+            self.data_model = DataModelRegistry.acquire(data_model_directory=None, url=self.base_url,
+                                                        headers=self.global_headers, workbook=bootstrap_wbk,
+                                                        cache_directory=cache_dir,
+                                                        max_connections=self.max_connections)
+        self._data_model_acquired = True
 
     def refresh_auth(self):
-        auth = self._getAuth(self.auth_type)
-        self.global_headers['Authorization'] = str(auth)
-        asyncio.run(self.refresh_auth_async())
+        """
+        make sure the Authorization header is current. the cached header is kept until shortly before an oauth2 token expires\n
+        """
+        if self._auth_current():
+            return
+        self.run(self._refresh_auth_locked())
 
     async def refresh_auth_async(self):
-        auth = await self._getAuth_async(self.auth_type)
-        self.global_headers['Authorization'] = str(auth)
+        """
+        coroutine equivalent of refresh_auth\n
+        """
+        if self._auth_current():
+            return
+        await self.run_async(self._refresh_auth_locked())
+
+    async def _refresh_auth_locked(self, rejected_auth: str = None):
+        # single-flight, concurrent callers wait on the one refresh in progress
+        if self._auth_lock is None:
+            self._auth_lock = asyncio.Lock()
+        async with self._auth_lock:
+            if rejected_auth is None and self._auth_current():
+                return
+            if rejected_auth is not None and self.global_headers.get('Authorization') != rejected_auth:
+                # another caller has already replaced the rejected header
+                return
+            auth = await self._getAuth_async(self.auth_type)
+            self.global_headers['Authorization'] = str(auth)
+
+    def request(self, method: str, url: str, idempotent: bool = False, **kwargs) -> requests.Response:
+        """
+        send a request through the shared session with the environment headers. on a 401 the token is refreshed once
+        and the request replayed\n
+        :param method: HTTP method
+        :param url: url to send to
+        :param idempotent: True if the request is safe to repeat. it is then retried with backoff on a timeout, connection error or retryable status
+        :param kwargs: passed to requests.Session.request, e.g. data
+        :return: requests.Response
+        """
+        attempts = self._max_retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            try:
+                response = self._send(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == attempts - 1:
+                    raise
+                delay = self._retry_delay(attempt)
+                self._logger.warning(f'{e!r} from {url}, retry {attempt + 1} of {self._max_retries} in {delay:.2f}s')
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == attempts - 1:
+                    return response
+                delay = self._retry_delay(attempt, response.headers.get('Retry-After'))
+                self._logger.warning(f'{response.status_code} from {url}, retry {attempt + 1} of {self._max_retries} in {delay:.2f}s')
+            time.sleep(delay)
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        self.refresh_auth()
+        sent_auth = self.global_headers.get('Authorization')
+        response = self.session.request(method, url, headers=dict(self.global_headers), **kwargs)
+        if response.status_code == 401:
+            self._logger.info(f'401 from {url}, reauthenticating and retrying')
+            self.run(self._refresh_auth_locked(sent_auth))
+            response = self.session.request(method, url, headers=dict(self.global_headers), **kwargs)
+        return response
+
+    async def request_async(self, method: str, url: str, client: httpx.AsyncClient = None, idempotent: bool = False,
+                            retry_timeouts: bool = True, **kwargs) -> httpx.Response:
+        """
+        coroutine equivalent of request, sent on the shared async client unless another is given\n
+        :param method: HTTP method
+        :param url: url to send to
+        :param client: httpx.AsyncClient to send on. Optional, default is the environment client
+        :param idempotent: True if the request is safe to repeat. it is then retried with backoff on a timeout, connection error or retryable status
+        :param retry_timeouts: Optional. False to raise a timeout straight away, e.g. for a caller that reacts to it by asking for less
+        :param kwargs: passed to httpx.AsyncClient.request, e.g. content
+        :return: httpx.Response
+        """
+        if client is None:
+            client = self.client
+        attempts = self._max_retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            try:
+                response = await self._send_async(method, url, client, **kwargs)
+            except httpx.TransportError as e:
+                if attempt == attempts - 1 or (not retry_timeouts and isinstance(e, httpx.TimeoutException)):
+                    raise
+                delay = self._retry_delay(attempt)
+                self._logger.warning(f'{e!r} from {url}, retry {attempt + 1} of {self._max_retries} in {delay:.2f}s')
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == attempts - 1:
+                    return response
+                delay = self._retry_delay(attempt, response.headers.get('Retry-After'))
+                self._logger.warning(f'{response.status_code} from {url}, retry {attempt + 1} of {self._max_retries} in {delay:.2f}s')
+            await asyncio.sleep(delay)
+
+    async def _send_async(self, method: str, url: str, client: httpx.AsyncClient, **kwargs) -> httpx.Response:
+        await self.refresh_auth_async()
+        sent_auth = self.global_headers.get('Authorization')
+        response = await client.request(method, url, headers=dict(self.global_headers), **kwargs)
+        if response.status_code == 401:
+            self._logger.info(f'401 from {url}, reauthenticating and retrying')
+            await self.run_async(self._refresh_auth_locked(sent_auth))
+            response = await client.request(method, url, headers=dict(self.global_headers), **kwargs)
+        return response
+
+    def _retry_delay(self, attempt: int, retry_after: str = None) -> float:
+        """
+        seconds to wait before the next attempt. the server's Retry-After is used when given, otherwise exponential
+        backoff with full jitter. either way capped at retry_backoff_max\n
+        :param attempt: zero based number of the attempt that failed
+        :param retry_after: Retry-After header value, either seconds or an HTTP date
+        :return: delay in seconds
+        """
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), self._retry_backoff_max)
+        return random.uniform(0, min(self._retry_backoff_max, self._retry_backoff * 2 ** attempt))
+
+    def _auth_current(self) -> bool:
+        return 'Authorization' in self.global_headers and time.monotonic() < self._token_refresh_at
+
+    def _set_token_expiry(self, expires_in):
+        # without expires_in the token is not cached
+        if expires_in is None:
+            self._token_refresh_at = 0.0
+            return
+        expires_in = float(expires_in)
+        self._token_refresh_at = time.monotonic() + expires_in - min(self.TOKEN_REFRESH_MARGIN, expires_in / 2)
 
     def _getOauth2(self):
         """return the access token from RR instance based on clientID and client secret"""
@@ -245,6 +663,7 @@ class Environment(BaseEnvironment):
             response_dict = json.loads(response.text)
         else:
             raise RequestsError(response, "failure during oauth2, status not 200", payload)
+        self._set_token_expiry(response_dict.get('expires_in'))
         return response_dict["access_token"]
 
     async def _get_oauth_async(self, client, limit: asyncio.Semaphore = None):
@@ -263,13 +682,15 @@ class Environment(BaseEnvironment):
         }
 
         try:
-            async with limit:
+            async with limit or contextlib.nullcontext():
                 response = await client.post(url=self.oauth2_url, headers=headers, content=payload)
-                # do I need to check limit here?
-        except:
-            raise RequestsError(response, f"error during POST to: {self.oauth2_url}", payload)
+        except httpx.HTTPError as e:
+            raise RequestsError(None, f"error during POST to: {self.oauth2_url}. {e!r}", payload) from e
         else:
+            if response.status_code != 200:
+                raise RequestsError(response, "failure during oauth2, status not 200", payload)
             response_dict = json.loads(response.text)
+            self._set_token_expiry(response_dict.get('expires_in'))
             return response_dict["access_token"]
 
     def _getBasicAuth(self):
@@ -310,6 +731,8 @@ class Environment(BaseEnvironment):
         """
         if auth_type == 'basic':
             b64_authentication = 'Basic ' + str(self._getBasicAuth())
+            # basic credentials never expire
+            self._token_refresh_at = float('inf')
         elif auth_type == 'oauth2':
             bstr = await self._get_oauth_async(self.client, self.limit)
             b64_authentication = 'Bearer ' + str(bstr)
@@ -339,3 +762,155 @@ class Environment(BaseEnvironment):
         # get the Table from the data model and return it.
         tab = self.data_model.get_table(table, namespace)
         return tab
+
+
+class AdaptivePager:
+    """
+    plans the pages of a paged download and tunes page size and concurrency from the pages fetched so far. each page
+    is timed, and the next pages are sized to take about TARGET_SECONDS at the rows per second observed. fast pages
+    also open up concurrency one page at a time, while a slow page or a timeout halves it. a page that times out is
+    split in two and fetched again\n
+    :param total_rows: rows to download
+    :param page_size: size of the first pages
+    :param max_concurrency: most pages in flight, e.g. the environment max_connections
+    :param min_page_size: Optional. smallest page, a timeout on a page this size is raised. default MIN_PAGE_SIZE
+    :param max_page_size: Optional. largest page. default is no limit other than MAX_PAGE_BYTES
+    """
+    # seconds a page should take
+    TARGET_SECONDS = 2.0
+    MIN_PAGE_SIZE = 500
+    # largest page body, pages are shrunk to stay below it whatever the throughput
+    MAX_PAGE_BYTES = 64 * 1024 * 1024
+    # weight of the latest page in the throughput estimates
+    SMOOTHING = 0.5
+
+    def __init__(self, total_rows: int, page_size: int, max_concurrency: int, min_page_size: int = None,
+                 max_page_size: int = None):
+        self._logger = logging.getLogger('RapidPy.pager')
+        self.total_rows = total_rows
+        self.min_page_size = max(1, min(min_page_size or self.MIN_PAGE_SIZE, page_size))
+        self.max_page_size = max_page_size or total_rows or page_size
+        self.page_size = max(self.min_page_size, min(page_size, self.max_page_size))
+        self.max_concurrency = max(1, max_concurrency)
+        # open up from half the connections rather than flood a server that may be slow
+        self.concurrency = max(1, self.max_concurrency // 2)
+        self.rows_per_second = None
+        self.bytes_per_row = None
+        self.latency = None
+        self._cursor = 0
+        self._retry = deque()
+
+    @property
+    def stats(self) -> dict:
+        return {'page_size': self.page_size, 'concurrency': self.concurrency, 'rows_per_second': self.rows_per_second,
+                'bytes_per_row': self.bytes_per_row, 'latency': self.latency}
+
+    def next_page(self):
+        """
+        :return: tuple of start row and page size of the next page to fetch, or None when every row is planned
+        """
+        if self._retry:
+            return self._retry.popleft()
+        if self._cursor >= self.total_rows:
+            return None
+        start = self._cursor
+        size = min(self.page_size, self.total_rows - start)
+        self._cursor += size
+        return start, size
+
+    def record(self, rows: int, nbytes: int, seconds: float):
+        """
+        fold a completed page into the estimates and resize the pages not yet planned\n
+        :param rows: rows in the page
+        :param nbytes: size of the page body
+        :param seconds: time the page took
+        """
+        seconds = max(seconds, 1e-3)
+        self.latency = self._smooth(self.latency, seconds)
+        if rows:
+            self.rows_per_second = self._smooth(self.rows_per_second, rows / seconds)
+            self.bytes_per_row = self._smooth(self.bytes_per_row, nbytes / rows)
+        if self.rows_per_second:
+            target = self.rows_per_second * self.TARGET_SECONDS
+            if self.bytes_per_row:
+                target = min(target, self.MAX_PAGE_BYTES / self.bytes_per_row)
+            # move at most a factor of two per page so one odd page does not swing the size
+            target = min(max(target, self.page_size / 2), self.page_size * 2)
+            self.page_size = int(max(self.min_page_size, min(target, self.max_page_size)))
+        if seconds < self.TARGET_SECONDS:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        elif seconds > 2 * self.TARGET_SECONDS:
+            self.concurrency = max(1, self.concurrency // 2)
+
+    def timed_out(self, start: int, size: int) -> bool:
+        """
+        shrink after a page timed out, the page is planned again as two halves\n
+        :param start: start row of the page
+        :param size: size of the page
+        :return: False if the page is already as small as allowed and cannot be split
+        """
+        self.concurrency = max(1, self.concurrency // 2)
+        self.page_size = max(self.min_page_size, min(self.page_size, size) // 2)
+        if size <= self.min_page_size:
+            return False
+        half = size // 2
+        self._retry.extendleft([(start + half, size - half), (start, half)])
+        return True
+
+    def _smooth(self, estimate, value):
+        return value if estimate is None else self.SMOOTHING * value + (1 - self.SMOOTHING) * estimate
+
+    async def run(self, fetch, on_page, limit: asyncio.Semaphore = None, ordered: bool = False,
+                  max_buffered_pages: int = None):
+        """
+        fetch every page, keeping up to concurrency pages in flight\n
+        :param fetch: coroutine function fetch(start, size) returning a tuple of the page, its number of rows and the size of its body
+        :param on_page: called with the start row and page of each page fetched
+        :param limit: Optional. semaphore held while a page is fetched, the timing excludes waiting for it
+        :param ordered: Optional. True to call on_page in row order, pages that arrive early are buffered
+        :param max_buffered_pages: Optional. when ordered, the most pages in flight or buffered. default max_concurrency
+        """
+        window = max_buffered_pages or self.max_concurrency
+        tasks = {}
+        buffered = {}
+        next_start = 0
+
+        async def timed(start, size):
+            async with limit or contextlib.nullcontext():
+                began = time.monotonic()
+                page, rows, nbytes = await fetch(start, size)
+                return page, rows, nbytes, time.monotonic() - began
+
+        try:
+            while True:
+                # when ordered the window may be full of pages waiting on one that timed out, it is always let through
+                while len(tasks) < self.concurrency and (not ordered or not tasks or len(tasks) + len(buffered) < window):
+                    planned = self.next_page()
+                    if planned is None:
+                        break
+                    tasks[asyncio.ensure_future(timed(*planned))] = planned
+                if not tasks:
+                    break
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    start, size = tasks.pop(task)
+                    try:
+                        page, rows, nbytes, seconds = task.result()
+                    except httpx.TimeoutException:
+                        if not self.timed_out(start, size):
+                            raise
+                        self._logger.warning(f'page at {start} of {size} rows timed out, retrying as smaller pages. {self.stats}')
+                        continue
+                    self.record(rows, nbytes, seconds)
+                    if ordered:
+                        buffered[start] = (size, page)
+                    else:
+                        on_page(start, page)
+                while next_start in buffered:
+                    size, page = buffered.pop(next_start)
+                    on_page(next_start, page)
+                    next_start += size
+        finally:
+            for task in tasks:
+                task.cancel()
+        self._logger.info(f'paged download of {self.total_rows} rows complete. {self.stats}')
@@ -6,12 +6,11 @@ import re
 from abc import abstractmethod
 from collections import UserList
 from datetime import date
+from functools import partial
 
-import httpx
-import requests
-from requests import Session, Request, HTTPError
+from requests import HTTPError
 
-from RapidResponse.Environment import Environment
+from RapidResponse.Environment import Environment, AdaptivePager
 from RapidResponse.Utils import VALID_SCOPES, SCOPE_PUBLIC, ScriptError, RequestsError, ALL_SITES, ALL_PARTS, DataError
 
 
@@ -168,8 +167,6 @@ class AbstractScript(Resource,abc.ABC):
         self._response = {'console': '', 'value': '', 'error': ''}
         self._internal_status = 0  # 0=not run, -1=error, 1=success
 
-        self._session = Session()
-
     @property
     def console(self) -> str:
         return self._response['console']
@@ -222,7 +219,8 @@ class AbstractScript(Resource,abc.ABC):
         self.close()
 
     def close(self):
-        self._session.close()
+        # requests are sent through the environment, whose connections are closed along with it
+        pass
 
     @abstractmethod
     def execute(self):
@@ -245,8 +243,6 @@ class Script(AbstractScript):
     def __init__(self, environment: Environment, name: str, scope: str = None, parameters: dict = None):
         AbstractScript.__init__(self,environment, name, scope, parameters)
 
-        self._session.headers.update(self.environment.global_headers)
-
     def execute(self, sync=True):
         """
         Executes the script. Currently, supports only synchronous execution.
@@ -257,7 +253,7 @@ class Script(AbstractScript):
         """
         self._logger.debug(f"Executing script {self._name} with scope {self._scope} and parameters {self._parameters}")
         try:
-            response_dict = self._send_execute_script(self._session)
+            response_dict = self._send_execute_script()
             self._process_execute_response(response_dict)
             self._internal_status = 1
         except ScriptError as e:
@@ -270,11 +266,10 @@ class Script(AbstractScript):
         finally:
             self.close()
 
-    def _send_execute_script(self, session):
+    def _send_execute_script(self):
         """
 
         :rtype: JSON
-        :param session:
         :raises RequestsError:
         """
         self._reset_response_state()
@@ -283,11 +278,9 @@ class Script(AbstractScript):
         url = f'{self.environment.script_url}/{self.scope}/{self._sanitized_name}'
         self._logger.debug(f"Sending POST request to {url} with payload {payload}")
 
-        req = Request('POST', url, headers=session.headers, data=payload)
-        prepped = req.prepare()
         response = None
         try:
-            response = session.send(prepped)
+            response = self.environment.request('POST', url, data=payload)
             response.raise_for_status()  # Will raise HTTPError for bad responses
             return response.json()
         except HTTPError as e:
@@ -557,9 +550,6 @@ class Worksheet(WorkbookResource):
         self._rows = list()
         self._queryID = None
         self.total_row_count = 0
-        timeout = httpx.Timeout(10.0, connect=60.0)
-        self.client = httpx.AsyncClient(timeout=timeout)
-        self.max_connections = 10
 
         if self._refresh: self.RefreshData()
             #self.RefreshData_async()
@@ -577,6 +567,10 @@ class Worksheet(WorkbookResource):
         else:
             return f'Not Run'
 
+    @property
+    def max_connections(self):
+        return self.environment.max_connections
+
     @property
     def parent_workbook(self):
         return self._parent_workbook
@@ -652,16 +646,12 @@ class Worksheet(WorkbookResource):
         else:
             self._rows[key] = value
         if self._sync:
-            self.environment.refresh_auth()
             self.upload(self._rows[key])
 
     def add_row(self, rec):
-        #s = requests.Session()
-        self.environment.refresh_auth()
         self.upload(rec)
 
     def add_rows(self, rows: list):
-        self.environment.refresh_auth()
         for i in range(0, len(rows), 500_000):
             self.upload(*rows)
 
@@ -715,9 +705,8 @@ class Worksheet(WorkbookResource):
                 # self.rows = ws.get('Rows')  # should be []
                 self._export_status = ws
 
-    def _create_export(self, session):
+    def _create_export(self):
         """
-        :param session:
         :return: response_dict
         """
 
@@ -728,9 +717,7 @@ class Worksheet(WorkbookResource):
             'WorkbookParameters': workbook_parameters
         })
 
-        req = requests.Request("POST", self.environment.workbook_url, headers=self.environment.global_headers, data=payload)
-        prepped = req.prepare()
-        response = session.send(prepped)
+        response = self.environment.request("POST", self.environment.workbook_url, data=payload)
 
         # check valid response
         if response.status_code == 200:
@@ -750,11 +737,10 @@ class Worksheet(WorkbookResource):
                 self._export_status = ws
         return response_dict
 
-    def _get_export_results(self, session, startRow: int = 0, pageSize: int = DEFAULT_PAGESIZE):
+    def _get_export_results(self, startRow: int = 0, pageSize: int = DEFAULT_PAGESIZE):
         # add some checking for not null, blah. check pagesize is not insane
         """
 
-        :param session:
         :param startRow:
         :param pageSize:
         :return: rows[]
@@ -763,9 +749,7 @@ class Worksheet(WorkbookResource):
 
         url = self.environment.worksheet_url + "?queryId=" + self._queryID[1:] + "&workbookName=" + self.parent_workbook['Name'].replace('&', '%26').replace(' ','%20') + "&Scope=" + self.parent_workbook['Scope'] + "&worksheetName=" + self.name.replace('&', '%26').replace(' ','%20') + "&startRow=" + str(startRow) + "&pageSize=" + str(pageSize)
 
-        req = requests.Request("GET", url, headers=self.environment.global_headers)
-        prepped = req.prepare()
-        response = session.send(prepped)
+        response = self.environment.request("GET", url, idempotent=True)
 
         # check valid response
         if response.status_code == 200:
@@ -778,19 +762,16 @@ class Worksheet(WorkbookResource):
         return rows
 
     def RefreshData(self, data_range: int = DEFAULT_PAGESIZE):
-        s = requests.Session()
-        self.environment.refresh_auth()
         try:
-            self._create_export(s)
+            self._create_export()
         except TypeError:
             raise RequestsError(None, msg='LIKELY due to invalid worksheetname')
         else:
             self._rows.clear()
             for i in range(0, self.total_row_count, data_range):
-                self._rows.extend(self._get_export_results(s, i, data_range))
+                self._rows.extend(self._get_export_results(i, data_range))
         finally:
             self._queryID = None
-            s.close()
 
     async def _create_export_async(self, client, limit: asyncio.Semaphore = None):
         """
@@ -808,8 +789,8 @@ class Worksheet(WorkbookResource):
 
         try:
             async with limit:
-                response = await client.post(url=self.environment.workbook_url, headers=self.environment.global_headers,
-                                             content=payload)
+                response = await self.environment.request_async("POST", self.environment.workbook_url, client,
+                                                                content=payload)
         except:
             raise RequestsError(response,
                                 f"failure during POST workbook _create_export_async to: {self.environment.workbook_url}",
@@ -824,49 +805,88 @@ class Worksheet(WorkbookResource):
                                     f"failure during POST workbook _create_export_async to: {self.environment.global_headers}",
                                     payload)
 
-    async def _get_export_results_async(self, client, startRow: int = 0, pageSize: int = DEFAULT_PAGESIZE):
+    async def _get_export_results_async(self, client, startRow: int = 0, pageSize: int = DEFAULT_PAGESIZE, limit: asyncio.Semaphore = None):
+        rows, _ = await self._get_export_page_async(client, startRow, pageSize, limit)
+        return rows
+
+    async def _get_export_page_async(self, client, startRow: int, pageSize: int, limit: asyncio.Semaphore = None,
+                                     retry_timeouts: bool = True):
+        """
+        fetch one page of worksheet rows\n
+        :param retry_timeouts: False to raise a timeout rather than retry the page at the same size
+        :return: tuple of the rows and the size of the response body
+        :raises RequestsError: non 200 response
+        """
         url = self.environment.worksheet_url + "?queryId=" + self._queryID[1:] + "&workbookName=" + self.parent_workbook['Name'].replace('&', '%26').replace(' ','%20') + "&Scope=" + self.parent_workbook['Scope'] + "&worksheetName=" + self.name.replace('&', '%26').replace(' ','%20') + "&startRow=" + str(startRow) + "&pageSize=" + str(pageSize)
         self._logger.debug(f'_get_export_results start: {startRow}, pagesize: {pageSize}')
 
-        response = await client.get(url=url, headers=self.environment.global_headers)
+        if limit:
+            async with limit:
+                response = await self.environment.request_async("GET", url, client, idempotent=True,
+                                                                retry_timeouts=retry_timeouts)
+        else:
+            response = await self.environment.request_async("GET", url, client, idempotent=True,
+                                                            retry_timeouts=retry_timeouts)
         if response.status_code == 200:
-            response_dict = json.loads(response.text)
+            response_dict = json.loads(response.content)
         else:
             raise RequestsError(response, f"error during GET to: {url}", None)
         rows = [WorksheetRow(rec['Values'], self) for rec in response_dict["Rows"]]
-        return rows
+        return rows, len(response.content)
 
-    async def _main_get_export_results_async(self, data_range):
+    async def _fetch_adaptive_page_async(self, client, startRow: int, pageSize: int):
+        # a timeout is left to the pager, which retries the page as two smaller ones
+        rows, nbytes = await self._get_export_page_async(client, startRow, pageSize, retry_timeouts=False)
+        return rows, len(rows), nbytes
 
-        limit = asyncio.Semaphore(self.max_connections)
+    async def _main_get_export_results_async(self, data_range, adaptive: bool = False):
+        # borrow the environment's connection pool, it stays open for the next refresh
+        client = self.environment.client
+        limit = self.environment.limit
         # set exportID and totrowcount
-        response_dict = await self._create_export_async(self.client, limit)
+        response_dict = await self._create_export_async(client, limit)
         self._process_create_export_response(response_dict)
 
-        tasks = [asyncio.Task(self._get_export_results_async(self.client, i, data_range)) for i in
-                 range(0, self.total_row_count - data_range, data_range)]
+        if adaptive:
+            pager = AdaptivePager(self.total_row_count, data_range, self.max_connections)
+            await pager.run(partial(self._fetch_adaptive_page_async, client),
+                            lambda start, rows: self._rows.extend(rows), limit)
+            return
+
+        tasks = [asyncio.Task(self._get_export_results_async(client, i, data_range, limit)) for i in
+                 range(0, self.total_row_count, data_range)]
         for coroutine in asyncio.as_completed(tasks):
             self._rows.extend(await coroutine)
 
-        remaining_records = self.total_row_count % data_range
-        if remaining_records > 0:
-            self._rows.extend(
-                await self._get_export_results_async(self.client, self.total_row_count - remaining_records, data_range))
-        await self.client.aclose()
-
     def _calc_optimal_pagesize(self, pagesize):
 
         return self.DEFAULT_PAGESIZE
 
-    def RefreshData_async(self, data_range: int = None):
-        # todo get this to work. then modify environment to create event loop and take sessions from there.
+    def RefreshData_async(self, data_range: int = None, adaptive: bool = False):
+        """
+        refresh the worksheet rows, fetching pages concurrently on the environment event loop. blocks until complete\n
+        :param data_range: suggested page size
+        :param adaptive: Optional. True to tune page size and concurrency from the throughput of the pages fetched, data_range is the size of the first pages
+        """
+        self.environment.run(self._refresh_data_async(data_range, adaptive))
+
+    async def refresh_data_async(self, data_range: int = None, adaptive: bool = False):
+        """
+        coroutine equivalent of RefreshData_async, for callers already running an event loop (e.g. Jupyter)\n
+        :param data_range: suggested page size
+        :param adaptive: Optional. True to tune page size and concurrency from the throughput of the pages fetched
+        """
+        await self.environment.run_async(self._refresh_data_async(data_range, adaptive))
+
+    async def _refresh_data_async(self, data_range: int = None, adaptive: bool = False):
         calc_data_range = self._calc_optimal_pagesize(data_range)
 
-        self.environment.refresh_auth()
         # initialise_for_extract query
         self._rows.clear()
-        asyncio.run(self._main_get_export_results_async(calc_data_range))
-        self._queryID = None
+        try:
+            await self._main_get_export_results_async(calc_data_range, adaptive)
+        finally:
+            self._queryID = None
 
 
     def _prepare_upload_params(self):
@@ -905,8 +925,7 @@ class Worksheet(WorkbookResource):
             'Rows': rows
         })
 
-        response = requests.request("POST", self.environment.workbook_import_url,
-                                    headers=self.environment.global_headers, data=payload)
+        response = self.environment.request("POST", self.environment.workbook_import_url, data=payload)
         # check valid response
         if response.status_code == 200:
             response_dict = json.loads(response.text)
@@ -22,6 +22,12 @@ ENTERPRISE_DATA_SCENARIO = {"Name": "Enterprise Data", "Scope": SCOPE_PUBLIC}
 ALL_SITES = 'All Sites'
 ALL_PARTS = dict({"Name": "All Parts", "Scope": SCOPE_PUBLIC})
 
+# values RapidResponse sends in place of a date
+DATE_PAST = 'Past'
+DATE_FUTURE = 'Future'
+DATE_UNDEFINED = 'Undefined'
+DATE_TODAY = 'Today'
+
 
 class Error(Exception):
     pass
@@ -104,8 +110,9 @@ class RequestsError(Error):
         self.logger.error(f'Error: exception arguments stored in .args {self.args}.')
         self.logger.error(f'Error: exception str() {self}.')
         self.logger.error(self.msg)
-        self.logger.error(response.text)
-        self.logger.error(response.content)
+        if response is not None:
+            self.logger.error(response.text)
+            self.logger.error(response.content)
         self.logger.error(payload)
 
 
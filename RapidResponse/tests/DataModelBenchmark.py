@@ -0,0 +1,27 @@
+"""
+timings for building the data model from the bundled package resources.
+run with: python -m RapidResponse.tests.DataModelBenchmark
+"""
+import timeit
+
+from RapidResponse.DataModel import DataModel
+
+
+def bench_cold_data_model(repeat: int = 5):
+    timings = timeit.repeat(lambda: DataModel(None, None, None, None), repeat=repeat, number=1)
+    print(f'DataModel(None, None, None, None): best {min(timings):.4f}s, worst {max(timings):.4f}s over {repeat} runs')
+    return timings
+
+
+def bench_nested_field_validation(number: int = 1000):
+    dm = DataModel(None, None, None, None)
+    timing = timeit.timeit(
+        lambda: dm._validate_fully_qualified_field_name('IndependentDemand', 'Order.Type.ControlSet.Value'),
+        number=number)
+    print(f'_validate_fully_qualified_field_name: {timing / number * 1_000_000:.2f}us per call')
+    return timing
+
+
+if __name__ == '__main__':
+    bench_cold_data_model()
+    bench_nested_field_validation()
@@ -1,7 +1,16 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
 import unittest
+from unittest.mock import patch
+
+import httpx
 
 import RapidResponse.DataModel
 import RapidResponse.DataModel as DM
+import RapidResponse.Utils
 
 
 class DataModel_init_TestCase(unittest.TestCase):
@@ -187,6 +196,126 @@ class DataModel_init_TestCase(unittest.TestCase):
         with self.assertRaises(ValueError):
             tab = dm._get_referenced_table('PartSource', 'TransferPart.ReferencePart')
 
+    def test_field_index_populated(self):
+        dm = DM.DataModel()
+        self.assertEqual(len(dm._fields), sum(len(rows) for rows in dm._field_index.values()))
+        self.assertIn(('IndependentDemand', 'Order'), dm._field_index)
+        self.assertEqual(dm._reference_index['IndependentDemand']['Order']['referencedTable'], 'DemandOrder')
+
+    def test_referenced_tableAndNamespace_from_resolved_table(self):
+        dm = DM.DataModel()
+        # once a reference field has been resolved to its table, the table name resolves the same way
+        tab = dm._get_referenced_tableAndNamespace('DemandOrder', 'DemandType')
+        self.assertEqual(tab, 'Mfg::DemandType')
+
+    def test_referenced_tableAndNamespace_not_reference(self):
+        dm = DM.DataModel()
+        with self.assertRaises(RapidResponse.Utils.DataError):
+            dm._get_referenced_tableAndNamespace('IndependentDemand', 'Line')
+
+    def test_table_registry(self):
+        dm = DM.DataModel()
+        self.assertEqual(len(dm._table_registry), len({tab.name for tab in dm.tables}))
+        self.assertIs(dm.get_table('IndependentDemand', 'Mfg'), dm._table_registry['Mfg::IndependentDemand'])
+        self.assertIn('Mfg::Part', dm)
+        self.assertIn(RapidResponse.DataModel.Table('Part', 'Mfg'), dm)
+        self.assertNotIn('Mfg::Party', dm)
+        with self.assertRaises(ValueError):
+            dm.get_table('Party', 'Mfg')
+
+
+class DataModelSnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_snapshot_roundtrip(self):
+        built = DM.DataModel(cache_directory=self.cache_dir)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        with patch.object(DM.DataModel, '_load_from_package_resources') as load:
+            cached = DM.DataModel(cache_directory=self.cache_dir)
+            load.assert_not_called()
+        self.assertEqual([tab.name for tab in built.tables], [tab.name for tab in cached.tables])
+        self.assertEqual([list(tab.fields) for tab in built.tables], [list(tab.fields) for tab in cached.tables])
+        self.assertEqual(built._fields, cached._fields)
+        self.assertEqual(cached.get_table('Part', 'Mfg')._key_fields, ['Name', 'Site.Value'])
+        self.assertTrue(cached.validate_field('IndependentDemand', 'Order.Type.ControlSet.Value'))
+
+    def test_snapshot_invalidated_when_source_changes(self):
+        DM.DataModel(cache_directory=self.cache_dir)
+        snapshot_path = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        with open(snapshot_path, encoding='UTF-8') as f:
+            snapshot = json.load(f)
+        snapshot['source_hash'] = 'stale'
+        with open(snapshot_path, 'w', encoding='UTF-8') as f:
+            json.dump(snapshot, f)
+
+        with patch.object(DM.DataModel, '_load_from_package_resources', autospec=True,
+                          side_effect=DM.DataModel._load_from_package_resources) as load:
+            DM.DataModel(cache_directory=self.cache_dir)
+            load.assert_called_once()
+        with open(snapshot_path, encoding='UTF-8') as f:
+            self.assertNotEqual(json.load(f)['source_hash'], 'stale')
+
+    def test_snapshot_ignores_other_version(self):
+        DM.DataModel(cache_directory=self.cache_dir)
+        with patch.object(DM.DataModel, 'SNAPSHOT_VERSION', DM.DataModel.SNAPSHOT_VERSION + 1), \
+                patch.object(DM.DataModel, '_load_from_package_resources', autospec=True,
+                             side_effect=DM.DataModel._load_from_package_resources) as load:
+            DM.DataModel(cache_directory=self.cache_dir)
+            load.assert_called_once()
+
+
+class DataModelHelperWorkbookTestCase(unittest.TestCase):
+    tables = [[f'Table{i}', 'System' if i % 100 == 0 else 'Mfg', 'Input', 'Y', ''] for i in range(1203)]
+    fields = [[f'Table{i}', 'Mfg', 'Name', 'String', 'Y', '', '', '', 'Mfg'] for i in range(1, 1203)]
+
+    def _handler(self, request):
+        worksheet = 'DataModel_Tables' if 'DataModel_Tables' in (request.content.decode() + str(request.url)) \
+            else 'DataModel_Fields'
+        rows = self.tables if worksheet == 'DataModel_Tables' else self.fields
+        if request.method == 'POST':
+            return httpx.Response(200, json={'Worksheets': [
+                {'Name': worksheet, 'QueryHandle': {'QueryID': '!' + worksheet}, 'TotalRowCount': len(rows)}]})
+        start = int(request.url.params['startRow'])
+        page_size = int(request.url.params['pageSize'])
+        self.page_requests += 1
+        return httpx.Response(200, json={'Rows': [{'Values': r} for r in rows[start:start + page_size]]})
+
+    def test_load_from_workbook_concurrent(self):
+        self.page_requests = 0
+        real_client = httpx.AsyncClient
+
+        def mock_client(*args, **kwargs):
+            return real_client(*args, transport=httpx.MockTransport(self._handler), **kwargs)
+
+        with patch('RapidResponse.DataModel.httpx.AsyncClient', side_effect=mock_client):
+            dm = DM.DataModel(None, url='http://localhost/rapidresponse', headers={}, workbook='KXSHelperREST',
+                              max_connections=4)
+        self.assertEqual(self.page_requests, 3 + 3)
+        expected = [f'Mfg::Table{i}' for i in range(1203) if i % 100 != 0]
+        self.assertEqual([tab.name for tab in dm.tables], expected)
+        self.assertEqual(len(dm._fields), 1202)
+        self.assertEqual(dm.get_table('Table1', 'Mfg').fields[0].name, 'Name')
+
+    def test_load_from_workbook_inside_event_loop(self):
+        self.page_requests = 0
+        real_client = httpx.AsyncClient
+
+        def mock_client(*args, **kwargs):
+            return real_client(*args, transport=httpx.MockTransport(self._handler), **kwargs)
+
+        async def load():
+            return DM.DataModel(None, url='http://localhost/rapidresponse', headers={}, workbook='KXSHelperREST')
+
+        with patch('RapidResponse.DataModel.httpx.AsyncClient', side_effect=mock_client):
+            dm = asyncio.run(load())
+        self.assertEqual(self.page_requests, 3 + 3)
+        self.assertEqual(len(dm.tables), 1190)
+
 
 class DataModelWBKTestCase(unittest.TestCase):
 
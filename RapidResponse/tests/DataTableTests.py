@@ -1,11 +1,33 @@
+import asyncio
 import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
 import time
 import unittest
+from datetime import date, datetime
+from unittest.mock import patch
+
+import httpx
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
 
 from RapidResponse.DataModel import Column
-from RapidResponse.DataTable import DataTable, DataRow
-from RapidResponse.Environment import Environment
-from RapidResponse.Utils import DataError
+from RapidResponse.DataTable import DataTable, DataRow, DataRowView, ColumnStore, ExportCheckpoint, BulkResult, \
+    _decode_records, _decode_values, _encode_value
+import RapidResponse.Environment
+from RapidResponse.Environment import Environment, AdaptivePager
+from RapidResponse.Utils import DataError, RequestsError, SetupError
 # from samples import sample_configuration, local_sample_bootstrap
 from RapidResponse.tests.resources.samples import sample_configuration, local_sample_bootstrap
 
@@ -395,6 +417,848 @@ class TestCalcOptimalPagesize(unittest.TestCase):
         pagesize = self.data_table._calc_optimal_pagesize()
         self.assertEqual(pagesize, 340000)  # Default page size when datatype is unknown
 
+class DataTableExportTestCase(unittest.TestCase):
+    configuration = {'url': 'http://localhost/rapidresponse', 'auth_type': 'basic', 'username': 'user',
+                     'password': 'pass', 'max_retries': 0}
+    total_rows = 10
+
+    def setUp(self):
+        self.exports_created = 0
+        self.pages_fetched = []
+        self.failing_pages = set()
+        self.expired_exports = set()
+        self.page_delays = {}
+        self.timeout_pages = set()
+        self.page_requests = []
+        real_client = httpx.AsyncClient
+
+        def mock_client(*args, **kwargs):
+            return real_client(*args, transport=httpx.MockTransport(self._handler), **kwargs)
+
+        patcher = patch('RapidResponse.Environment.httpx.AsyncClient', side_effect=mock_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.env = Environment(self.configuration)
+        self.addCleanup(self.env.close)
+        self.spill_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spill_directory, ignore_errors=True)
+
+    async def _handler(self, request):
+        if request.method == 'POST':
+            self.exports_created += 1
+            return httpx.Response(200, json={'ExportId': f'#{self.exports_created}', 'TotalRows': self.total_rows})
+        export_id = request.url.path.rsplit('/', 1)[1]
+        start = int(request.url.params['startRow'])
+        page_size = int(request.url.params['pageSize'])
+        self.page_requests.append((start, page_size))
+        if (start, page_size) in self.timeout_pages:
+            self.timeout_pages.remove((start, page_size))
+            raise httpx.ReadTimeout('slow page', request=request)
+        if export_id in self.expired_exports:
+            return httpx.Response(404)
+        if start in self.failing_pages:
+            return httpx.Response(503)
+        await asyncio.sleep(self.page_delays.get(start, 0))
+        self.pages_fetched.append(start)
+        return httpx.Response(200, json={'Rows': [f'P{i}\tS{i}' for i in range(start, min(start + page_size, self.total_rows))]})
+
+    def _part(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site'], refresh=False)
+        part._calc_optimal_pagesize = lambda *args: 3
+        return part
+
+    def test_refresh_fetches_last_page(self):
+        self.total_rows = 9
+        part = self._part()
+        part.RefreshData_async()
+        self.assertEqual(len(part), 9)
+        self.assertEqual(sorted(self.pages_fetched), [0, 3, 6])
+
+    def test_resume_from_checkpoint(self):
+        part = self._part()
+        self.failing_pages = {6}
+        with self.assertRaises(RequestsError):
+            part.RefreshData_async(spill_directory=self.spill_directory)
+        self.assertEqual(sorted(self.pages_fetched), [0, 3, 9])
+
+        self.failing_pages = set()
+        self.pages_fetched = []
+        part.RefreshData_async(spill_directory=self.spill_directory)
+        self.assertEqual(self.exports_created, 1)
+        self.assertEqual(self.pages_fetched, [6])
+        self.assertEqual(sorted(row[0] for row in part), sorted(f'P{i}' for i in range(10)))
+        # the checkpoint is removed once the export completes
+        self.assertEqual(os.listdir(self.spill_directory), [])
+
+    def test_resume_expired_export(self):
+        part = self._part()
+        self.failing_pages = {6}
+        with self.assertRaises(RequestsError):
+            part.RefreshData_async(spill_directory=self.spill_directory)
+
+        self.failing_pages = set()
+        self.expired_exports = {'1'}
+        part.RefreshData_async(spill_directory=self.spill_directory)
+        self.assertEqual(self.exports_created, 2)
+        self.assertEqual(len(part), 10)
+
+    def test_refresh_ordered(self):
+        self.page_delays = {0: 0.1}
+        part = self._part()
+        part.RefreshData_async(ordered=True)
+        self.assertEqual([row[0] for row in part], [f'P{i}' for i in range(10)])
+
+    def test_refresh_ordered_buffer_bounded(self):
+        self.page_delays = {0: 0.1}
+        part = self._part()
+        part.RefreshData_async(ordered=True, max_buffered_pages=2)
+        # page 3 waits in the buffer behind page 0, so nothing further is fetched until page 0 lands
+        self.assertEqual(self.pages_fetched[:2], [3, 0])
+        self.assertEqual([row[0] for row in part], [f'P{i}' for i in range(10)])
+
+    def test_resume_ordered(self):
+        part = self._part()
+        self.failing_pages = {3}
+        with self.assertRaises(RequestsError):
+            part.RefreshData_async(spill_directory=self.spill_directory, ordered=True)
+
+        self.failing_pages = set()
+        self.pages_fetched = []
+        part.RefreshData_async(spill_directory=self.spill_directory, ordered=True)
+        self.assertEqual(self.pages_fetched, [3])
+        self.assertEqual([row[0] for row in part], [f'P{i}' for i in range(10)])
+
+    def test_refresh_adaptive(self):
+        part = self._part()
+        part.RefreshData_async(adaptive=True)
+        self.assertEqual(sorted(row[0] for row in part), sorted(f'P{i}' for i in range(10)))
+        self.assertEqual(self.exports_created, 1)
+
+    def test_refresh_adaptive_ordered(self):
+        self.page_delays = {0: 0.1}
+        part = self._part()
+        part.RefreshData_async(adaptive=True, ordered=True)
+        self.assertEqual([row[0] for row in part], [f'P{i}' for i in range(10)])
+
+    def test_refresh_adaptive_splits_timed_out_page(self):
+        env = Environment(dict(self.configuration, max_retries=3, retry_backoff=0))
+        self.addCleanup(env.close)
+        part = DataTable(env, 'Mfg::Part', ['Name', 'Site'], refresh=False)
+        part._calc_optimal_pagesize = lambda *args: 4
+        self.timeout_pages = {(0, 4)}
+        with patch.object(AdaptivePager, 'MIN_PAGE_SIZE', 1):
+            part.RefreshData_async(adaptive=True, ordered=True)
+        # the timed out page is not retried at the same size, the pager fetches it as two halves
+        self.assertEqual(self.page_requests.count((0, 4)), 1)
+        self.assertIn((0, 2), self.page_requests)
+        self.assertIn((2, 2), self.page_requests)
+        self.assertEqual([row[0] for row in part], [f'P{i}' for i in range(10)])
+
+    def test_refresh_adaptive_with_checkpoint(self):
+        part = self._part()
+        with self.assertRaises(ValueError):
+            part.RefreshData_async(adaptive=True, spill_directory=self.spill_directory)
+
+    def test_refresh_columnar(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site'], sync=False, refresh=False, columnar=True)
+        part._calc_optimal_pagesize = lambda *args: 3
+        part.RefreshData_async(ordered=True)
+        self.assertIsInstance(part._table_data, ColumnStore)
+        self.assertEqual(len(part), 10)
+        self.assertIsInstance(part[0], DataRowView)
+        self.assertEqual(list(part[-1]), ['P9', 'S9'])
+        self.assertEqual(part[4].Name, 'P4')
+        self.assertEqual(part.column('Site.Value'), [f'S{i}' for i in range(10)])
+        self.assertIn(['P5', 'S5'], part)
+        self.assertEqual(part.indexof(['P5', 'S5']), 5)
+
+    def test_columnar_mutations(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site'], sync=False, refresh=False, columnar=True)
+        part.extend([['A', 'S1'], ['B', 'S1']])
+        part.append(['C', 'S2'])
+        part[1] = ['D', 'S2']
+        part[0][1] = 'S3'
+        del part[2]
+        self.assertEqual([list(row) for row in part], [['A', 'S3'], ['D', 'S2']])
+        self.assertNotIn(['C', 'S2'], part)
+        with self.assertRaises(DataError):
+            part.append(['E'])
+
+    def test_columnar_slice_assignment(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site'], sync=False, refresh=False, columnar=True)
+        part.extend([['A', 'S1'], ['B', 'S1'], ['C', 'S1']])
+        self.assertIn(('B', 'S1'), part)
+        part[1:] = [['D', 'S2'], ['E', 'S2']]
+        self.assertEqual([list(row) for row in part], [['A', 'S1'], ['D', 'S2'], ['E', 'S2']])
+        self.assertNotIn(('B', 'S1'), part)
+        self.assertEqual(part.indexof(['E', 'S2']), 2)
+        # a columnar table cannot resize through a slice, nothing is written when it is refused
+        with self.assertRaises(ValueError):
+            part[0:2] = [['F', 'S3']]
+        with self.assertRaises(DataError):
+            part[0:2] = [['F', 'S3'], ['G']]
+        self.assertEqual([list(row) for row in part], [['A', 'S1'], ['D', 'S2'], ['E', 'S2']])
+        self.assertEqual(len(part), 3)
+
+    @unittest.skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_export_arrow(self):
+        part = self._part()
+        table = part.export_arrow(page_size=3)
+        self.assertEqual(table.column_names, ['Name', 'Site.Value'])
+        self.assertEqual(table.column('Name').to_pylist(), [f'P{i}' for i in range(10)])
+        self.assertEqual(len(part), 0)
+        part.RefreshData_async(ordered=True)
+        self.assertTrue(part.to_arrow().equals(table))
+
+    @unittest.skipUnless(pyarrow, 'pyarrow is not installed')
+    def test_to_arrow_columnar(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site'], sync=False, refresh=False, columnar=True)
+        part._calc_optimal_pagesize = lambda *args: 3
+        part.RefreshData_async(ordered=True)
+        table = part.to_arrow()
+        self.assertTrue(pyarrow.types.is_dictionary(table.schema.field('Site.Value').type))
+        self.assertEqual(table.column('Site.Value').to_pylist(), [f'S{i}' for i in range(10)])
+
+    @unittest.skipUnless(numpy, 'numpy is not installed')
+    def test_to_numpy(self):
+        part = self._part()
+        part.RefreshData_async(ordered=True)
+        arrays = part.to_numpy()
+        self.assertEqual(arrays['Name'].tolist(), [f'P{i}' for i in range(10)])
+
+    def test_to_arrow_requires_pyarrow(self):
+        part = self._part()
+        with patch.dict('sys.modules', {'pyarrow': None}):
+            with self.assertRaises(SetupError):
+                part.to_arrow()
+
+    def test_refresh_decode_executor(self):
+        for executor in ('thread', 'process'):
+            env = Environment(dict(self.configuration, decode_executor=executor, decode_workers=2))
+            self.addCleanup(env.close)
+            for columnar in (False, True):
+                part = DataTable(env, 'Mfg::Part', ['Name', 'Site'], sync=False, refresh=False, columnar=columnar)
+                part._calc_optimal_pagesize = lambda *args: 3
+                part.RefreshData_async(ordered=True, spill_directory=self.spill_directory)
+                self.assertEqual([list(row) for row in part], [[f'P{i}', f'S{i}'] for i in range(10)])
+
+    def test_decode_records_length_mismatch(self):
+        self.assertEqual(_decode_records(['a\tb', 'c\td'], 2), [['a', 'c'], ['b', 'd']])
+        self.assertEqual(_decode_records([], 2), [[], []])
+        with self.assertRaises(DataError):
+            _decode_records(['a\tb', 'c\td\te', 'f'], 2)
+
+    def test_stream_rows_in_order(self):
+        part = self._part()
+        rows = [row[0] for row in part.stream_rows(page_size=3, max_in_flight=2)]
+        self.assertEqual(rows, [f'P{i}' for i in range(10)])
+        self.assertEqual(sorted(self.pages_fetched), [0, 3, 6, 9])
+        self.assertEqual(len(part), 0)
+
+    def test_stream_pages_bounded(self):
+        part = self._part()
+        for page in part.stream_pages(page_size=3, max_in_flight=1):
+            self.assertEqual([row[0] for row in page], ['P0', 'P1', 'P2'])
+            break
+        # one page consumed, at most one more fetched ahead of it
+        self.assertLessEqual(len(self.pages_fetched), 2)
+        self.assertIsNone(part._exportID)
+
+    def test_stream_leaves_table_export(self):
+        part = self._part()
+        pages = part.stream_pages(page_size=3, max_in_flight=1)
+        rows = [row[0] for row in next(pages)]
+        # a refresh between pages neither uses nor disturbs the stream's export
+        part.RefreshData_async()
+        self.expired_exports = {'2'}
+        for page in pages:
+            rows.extend(row[0] for row in page)
+        self.assertEqual(rows, [f'P{i}' for i in range(10)])
+        self.assertEqual(len(part), 10)
+        self.assertEqual(part._total_row_count, 10)
+
+    def test_stream_does_not_set_row_count(self):
+        part = self._part()
+        self.assertEqual(len(list(part.stream_rows(page_size=4))), 10)
+        self.assertEqual(part._total_row_count, 0)
+        self.assertIsNone(part._exportID)
+        self.assertIn('DataTable(', str(part))
+
+    def test_stream_rows_async(self):
+        part = self._part()
+
+        async def consume():
+            return [row[0] async for row in part.stream_rows_async(page_size=4)]
+
+        self.assertEqual(asyncio.run(consume()), [f'P{i}' for i in range(10)])
+
+    def test_stale_checkpoint_ignored(self):
+        checkpoint = ExportCheckpoint(self.spill_directory, 'key')
+        checkpoint.start('#1', 10, 3)
+        checkpoint.save_page(0, ['P0\tS0'])
+        self.assertEqual(checkpoint.load()['ExportId'], '#1')
+        self.assertEqual(checkpoint.completed_pages(), {0})
+        with patch('RapidResponse.DataTable.time.time', return_value=time.time() + ExportCheckpoint.MAX_AGE + 1):
+            self.assertIsNone(checkpoint.load())
+        self.assertEqual(checkpoint.completed_pages(), set())
+
+
+class DataTableBulkTestCase(unittest.TestCase):
+    configuration = {'url': 'http://localhost/rapidresponse', 'auth_type': 'basic', 'username': 'user',
+                     'password': 'pass', 'max_retries': 0}
+
+    def setUp(self):
+        # (kind, rows) of each transaction created, in order
+        self.transactions = []
+        self.completed = []
+        # tab delimited rows an export of the table returns
+        self.server_rows = []
+        self.failing_transactions = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        real_client = httpx.AsyncClient
+
+        def mock_client(*args, **kwargs):
+            return real_client(*args, transport=httpx.MockTransport(self._handler), **kwargs)
+
+        patcher = patch('RapidResponse.Environment.httpx.AsyncClient', side_effect=mock_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.env = Environment(self.configuration)
+        self.addCleanup(self.env.close)
+
+    async def _handler(self, request):
+        path = request.url.path
+        if '/bulk/export' in path:
+            if request.method == 'POST':
+                return httpx.Response(200, json={'ExportId': '#1', 'TotalRows': len(self.server_rows)})
+            start = int(request.url.params['startRow'])
+            return httpx.Response(200, json={'Rows': self.server_rows[start:start + int(request.url.params['pageSize'])]})
+        kind = 'remove' if '/bulk/remove' in path else 'upload'
+        if path.endswith('/complete'):
+            transaction = int(path.rsplit('/', 2)[1])
+            self.in_flight -= 1
+            self.completed.append(transaction)
+            _, rows = self.transactions[transaction - 1]
+            if transaction in self.failing_transactions:
+                return httpx.Response(200, json={'Results': {'Status': 'Failure', 'ErrorRowCount': len(rows)}})
+            count = 'DeleteRowCount' if kind == 'remove' else 'InsertedRowCount'
+            return httpx.Response(200, json={'Results': {'Status': 'Success', count: len(rows), 'ErrorRowCount': 0}})
+        body = json.loads(request.content)
+        self.transactions.append((kind, [rec['Values'] for rec in body['Rows']]))
+        transaction_id = f'#{len(self.transactions)}'
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # keep the transaction open long enough for others to start
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json={'RemovalId' if kind == 'remove' else 'UploadId': transaction_id})
+
+    def _part(self, sync=False):
+        return DataTable(self.env, 'Mfg::Part', ['Name', 'Site'], sync=sync, refresh=False)
+
+    def _uploaded(self, kind='upload'):
+        return sorted(tuple(row) for k, rows in self.transactions if k == kind for row in rows)
+
+    def test_add_rows_concurrent(self):
+        part = self._part()
+        rows = [DataRow([f'P{i}', f'S{i}'], part) for i in range(10)]
+        result = part.add_rows(rows, chunk_size=3, max_in_flight=2)
+        self.assertEqual(result.transactions, 4)
+        self.assertEqual(result.inserted, 10)
+        self.assertEqual(result.status, 'Success')
+        self.assertEqual(self.max_in_flight, 2)
+        self.assertEqual(self._uploaded(), sorted((f'P{i}', f'S{i}') for i in range(10)))
+
+    def test_add_rows_serial(self):
+        part = self._part()
+        part.add_rows([DataRow([f'P{i}', f'S{i}'], part) for i in range(10)], chunk_size=3, max_in_flight=1)
+        self.assertEqual(self.max_in_flight, 1)
+        self.assertEqual(len(self.transactions), 4)
+
+    def test_add_rows_async(self):
+        part = self._part()
+        rows = [DataRow([f'P{i}', f'S{i}'], part) for i in range(5)]
+        result = asyncio.run(part.add_rows_async(rows, chunk_size=2))
+        self.assertEqual(result.inserted, 5)
+        self.assertEqual(result.transactions, 3)
+
+    def test_add_rows_failure(self):
+        self.failing_transactions = {2}
+        part = self._part()
+        with self.assertRaises(RequestsError):
+            part.add_rows([DataRow([f'P{i}', f'S{i}'], part) for i in range(10)], chunk_size=3, max_in_flight=1)
+
+    def test_add_rows_failure_completes_open_transactions(self):
+        self.failing_transactions = {1}
+        part = self._part()
+        with self.assertLogs('RapidPy.dm.tab', level='ERROR') as logs, self.assertRaises(RequestsError):
+            part.add_rows([DataRow([f'P{i}', f'S{i}'], part) for i in range(10)], chunk_size=3, max_in_flight=3)
+        # no transaction is left created but never completed, and every one that succeeded is counted
+        self.assertGreater(len(self.transactions), 1)
+        self.assertEqual(sorted(self.completed), list(range(1, len(self.transactions) + 1)))
+        self.assertIn(f'transactions={len(self.transactions) - 1}', logs.output[-1])
+
+    def test_extend_uploads_in_chunks(self):
+        part = self._part(sync=True)
+        part.extend([[f'P{i}', f'S{i}'] for i in range(10)])
+        self.assertEqual(len(part), 10)
+        self.assertEqual(self._uploaded(), sorted((f'P{i}', f'S{i}') for i in range(10)))
+
+    def _write_behind_part(self):
+        return DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'], refresh=False, write_behind=True)
+
+    def test_write_behind_coalesces(self):
+        part = self._write_behind_part()
+        part.append(['P1', 'S1', 'a'])
+        part.append(['P2', 'S2', 'a'])
+        part[0][2] = 'b'
+        part[0][2] = 'c'
+        del part[1]
+        self.assertEqual(self.transactions, [])
+        self.assertEqual(part.pending, 2)
+        result = part.flush()
+        self.assertEqual(self.transactions, [('remove', [['P2', 'S2', 'a']]), ('upload', [['P1', 'S1', 'c']])])
+        self.assertEqual((result.transactions, result.inserted, result.deleted), (2, 1, 1))
+        self.assertEqual(part.pending, 0)
+        self.assertEqual(len(part), 1)
+
+    def test_slice_assignment_sends_rows(self):
+        part = self._write_behind_part()
+        part.extend([[f'P{i}', f'S{i}', 'a'] for i in range(3)])
+        part.flush()
+        part[0:2] = [['P0', 'S0', 'b'], ['P1', 'S1', 'b'], ['P3', 'S3', 'b']]
+        self.assertEqual(len(part), 4)
+        self.assertEqual(part.flush().transactions, 1)
+        self.assertEqual(self.transactions[-1], ('upload', [['P0', 'S0', 'b'], ['P1', 'S1', 'b'], ['P3', 'S3', 'b']]))
+
+    def test_write_behind_size_threshold(self):
+        part = self._write_behind_part()
+        part.WRITE_BEHIND_ROWS = 3
+        part.extend([[f'P{i}', f'S{i}', 'a'] for i in range(2)])
+        self.assertEqual(self.transactions, [])
+        part.append(['P2', 'S2', 'a'])
+        self.assertEqual(len(self.transactions), 1)
+        self.assertEqual(part.pending, 0)
+
+    def test_write_behind_timer(self):
+        part = self._write_behind_part()
+        part.WRITE_BEHIND_SECONDS = 0.05
+        part.append(['P1', 'S1', 'a'])
+        deadline = time.monotonic() + 5
+        while not self.transactions and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.transactions, [('upload', [['P1', 'S1', 'a']])])
+
+    def test_write_behind_context_manager(self):
+        with self._write_behind_part() as part:
+            part.append(['P1', 'S1', 'a'])
+            part.append(['P1', 'S1', 'b'])
+            self.assertEqual(self.transactions, [])
+        self.assertEqual(self.transactions, [('upload', [['P1', 'S1', 'b']])])
+
+    def test_write_behind_requeue_on_failure(self):
+        self.failing_transactions = {1}
+        part = self._write_behind_part()
+        part.append(['P1', 'S1', 'a'])
+        with self.assertRaises(RequestsError):
+            part.flush()
+        self.assertEqual(part.pending, 1)
+        self.failing_transactions = set()
+        self.assertEqual(part.flush().inserted, 1)
+        self.assertEqual(part.pending, 0)
+
+    def test_write_behind_requeue_restarts_timer(self):
+        self.failing_transactions = {1}
+        part = self._write_behind_part()
+        part.WRITE_BEHIND_SECONDS = 0.05
+        part.append(['P1', 'S1', 'a'])
+        with self.assertRaises(RequestsError):
+            part.flush()
+        # the failed change is sent by the timer without another change or flush
+        self.failing_transactions = set()
+        deadline = time.monotonic() + 5
+        while part.pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(part.pending, 0)
+        self.assertEqual(self.transactions[-1], ('upload', [['P1', 'S1', 'a']]))
+
+    def test_write_behind_flushed_on_close(self):
+        env = Environment(self.configuration)
+        part = DataTable(env, 'Mfg::Part', ['Name', 'Site', 'Description'], refresh=False, write_behind=True)
+        part.append(['P1', 'S1', 'a'])
+        self.assertIs(RapidResponse.Environment._write_behind_environments.get(id(env)), env)
+        env.close()
+        self.assertEqual(self.transactions, [('upload', [['P1', 'S1', 'a']])])
+        self.assertEqual(part.pending, 0)
+        self.assertNotIn(id(env), RapidResponse.Environment._write_behind_environments)
+
+    def test_write_behind_flushed_at_exit(self):
+        # the exit flush serialises on the decode executor, which must still be running
+        script = textwrap.dedent('''
+            import json
+            from unittest.mock import patch
+            import httpx
+            from RapidResponse.DataTable import DataTable
+            from RapidResponse.Environment import Environment
+
+            def handler(request):
+                if request.url.path.endswith('/complete'):
+                    return httpx.Response(200, json={'Results': {'Status': 'Success', 'InsertedRowCount': 1}})
+                print('uploaded', json.dumps([row['Values'] for row in json.loads(request.content)['Rows']]))
+                return httpx.Response(200, json={'UploadId': '#1'})
+
+            real_client = httpx.AsyncClient
+            patch('RapidResponse.Environment.httpx.AsyncClient',
+                  side_effect=lambda *args, **kwargs: real_client(*args, transport=httpx.MockTransport(handler),
+                                                                  **kwargs)).start()
+            env = Environment(dict(%r, decode_executor='thread'))
+            env.run(env.decode_async(len, 'warm up the executor'))
+            part = DataTable(env, 'Mfg::Part', ['Name', 'Site', 'Description'], refresh=False, write_behind=True)
+            part.append(['P1', 'S1', 'a'])
+        ''') % (self.configuration,)
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        completed = subprocess.run([sys.executable, '-c', script], cwd=directory, capture_output=True, text=True,
+                                   timeout=60, env=dict(os.environ, PYTHONPATH=root))
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertIn('uploaded [["P1", "S1", "a"]]', completed.stdout)
+
+    def test_batch_sends_net_changes(self):
+        self.server_rows = ['P0\tS0\ta']
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'])
+        with part.batch() as result:
+            part.append(['P1', 'S1', 'a'])
+            part.append(['P2', 'S2', 'a'])
+            part.append(['P3', 'S3', 'a'])
+            part[1][2] = 'b'
+            # P2 is created in the batch so its deletion cancels out, P0 is already on the server
+            del part[2]
+            del part[0]
+            part.extend([['P4', 'S4', 'a'], ['P1', 'S1', 'c']])
+            self.assertEqual(self.transactions, [])
+        self.assertEqual(self.transactions, [('remove', [['P0', 'S0', 'a']]),
+                                             ('upload', [['P3', 'S3', 'a'], ['P4', 'S4', 'a'], ['P1', 'S1', 'c']])])
+        self.assertEqual((result.transactions, result.inserted, result.deleted), (2, 3, 1))
+        # outside the batch changes are sent as they are made again
+        with patch.object(part, 'add_row') as add_row:
+            part.append(['P5', 'S5', 'a'])
+        add_row.assert_called_once()
+        self.assertEqual(part.pending, 0)
+
+    def test_batch_delete_sent_unless_table_complete(self):
+        # the table does not hold every row, so a row appended in the batch may already be on the server
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'], refresh=False)
+        with part.batch():
+            part.append(['P1', 'S1', 'a'])
+            del part[0]
+        self.assertEqual(self.transactions, [('remove', [['P1', 'S1', 'a']])])
+
+    def test_batch_kept_on_error_is_superseded(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'], refresh=False)
+        part.extend([['P1', 'S1', 'a'], ['P2', 'S2', 'a']])
+        self.transactions = []
+        with self.assertRaises(KeyError):
+            with part.batch():
+                part[0] = ['P1', 'S1', 'old']
+                part[1] = ['P2', 'S2', 'old']
+                raise KeyError('stop')
+        # a change sent immediately replaces the queued one, the next batch does not send the older value over it
+        with patch.object(part, 'add_row') as add_row:
+            part[0] = ['P1', 'S1', 'new']
+        add_row.assert_called_once()
+        self.assertEqual(part.pending, 1)
+        self.transactions = []
+        with part.batch():
+            pass
+        self.assertEqual(self.transactions, [('upload', [['P2', 'S2', 'old']])])
+
+    def test_refresh_flushes_queued_changes(self):
+        part = self._write_behind_part()
+        part.append(['P1', 'S1', 'a'])
+        self.server_rows = ['P1\tS1\ta']
+        part.RefreshData_async()
+        self.assertEqual(self.transactions, [('upload', [['P1', 'S1', 'a']])])
+        self.assertEqual(part.pending, 0)
+        self.assertEqual([list(row) for row in part], [['P1', 'S1', 'a']])
+
+    def test_batch_kept_on_error(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'], refresh=False)
+        with self.assertRaises(KeyError):
+            with part.batch():
+                part.append(['P1', 'S1', 'a'])
+                raise KeyError('stop')
+        # nothing is sent, the local row and its queued change are kept for the caller to flush
+        self.assertEqual(self.transactions, [])
+        self.assertEqual(len(part), 1)
+        self.assertEqual(part.pending, 1)
+        self.assertEqual(part.flush().inserted, 1)
+        self.assertEqual(self._uploaded(), [('P1', 'S1', 'a')])
+
+    def test_batch_nested(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'], refresh=False)
+        with part.batch() as outer:
+            with part.batch() as inner:
+                part.append(['P1', 'S1', 'a'])
+            self.assertIs(inner, outer)
+            part.append(['P2', 'S2', 'a'])
+            self.assertEqual(self.transactions, [])
+        self.assertEqual(self._uploaded(), [('P1', 'S1', 'a'), ('P2', 'S2', 'a')])
+        self.assertEqual(outer.transactions, 1)
+
+    def test_batch_flushes_write_behind_first(self):
+        part = self._write_behind_part()
+        part.append(['P1', 'S1', 'a'])
+        with self.assertRaises(KeyError):
+            with part.batch():
+                part.append(['P2', 'S2', 'a'])
+                raise KeyError('stop')
+        self.assertEqual(self._uploaded(), [('P1', 'S1', 'a')])
+
+    def test_batch_async(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'], refresh=False)
+
+        async def correct():
+            async with part.batch_async() as result:
+                part.extend([[f'P{i}', f'S{i}', 'a'] for i in range(4)])
+                part[1][2] = 'b'
+            return result
+
+        result = asyncio.run(correct())
+        self.assertEqual(result.inserted, 4)
+        self.assertEqual(len(self.transactions), 1)
+        self.assertIn(('P1', 'S1', 'b'), self._uploaded())
+
+    def _loaded_part(self, columnar=False):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'], refresh=False, columnar=columnar)
+        with part.batch():
+            part.extend([[f'P{i}', f'S{i % 2}', 'a'] for i in range(10)])
+        self.transactions = []
+        self.max_in_flight = 0
+        return part
+
+    def test_delete_rows_predicate(self):
+        part = self._loaded_part()
+        result = part.delete_rows(lambda row: row[1] == 'S1', chunk_size=2, max_in_flight=2)
+        self.assertEqual(result.deleted, 5)
+        self.assertEqual(result.transactions, 3)
+        self.assertEqual(self.max_in_flight, 2)
+        self.assertEqual(self._uploaded('remove'), [(f'P{i}', 'S1', 'a') for i in range(1, 10, 2)])
+        self.assertEqual([row[0] for row in part], [f'P{i}' for i in range(0, 10, 2)])
+        self.assertEqual(len(part), 5)
+
+    def test_delete_rows_given_rows(self):
+        part = self._loaded_part(columnar=True)
+        result = part.delete_rows([['P3', 'S1', 'a'], ['P4', 'S0', 'a'], ['P4', 'S0', 'a'], ['P99', 'S0', 'a']])
+        # rows not in the table are still removed from RR, duplicates are sent once
+        self.assertEqual(result.deleted, 3)
+        self.assertEqual([row[0] for row in part], ['P0', 'P1', 'P2', 'P5', 'P6', 'P7', 'P8', 'P9'])
+        self.assertEqual(part.column('Site.Value'), ['S0', 'S1', 'S0', 'S1', 'S0', 'S1', 'S0', 'S1'])
+
+    def test_delete_rows_failure_leaves_table(self):
+        part = self._loaded_part()
+        self.failing_transactions = {1}
+        with self.assertRaises(RequestsError):
+            part.delete_rows(lambda row: True)
+        self.assertEqual(len(part), 10)
+
+    def test_delete_rows_matched_by_key(self):
+        part = self._loaded_part()
+        # the other values of a given row need not match the table
+        part.delete_rows([['P3', 'S1', 'stale']])
+        self.assertEqual(self._uploaded('remove'), [('P3', 'S1', 'stale')])
+        self.assertNotIn(('P3', 'S1'), part)
+        self.assertEqual(len(part), 9)
+
+    def test_delete_rows_partial_failure(self):
+        part = self._loaded_part()
+        self.failing_transactions = {2}
+        with self.assertRaises(RequestsError):
+            part.delete_rows(lambda row: True, chunk_size=2, max_in_flight=2)
+        # the rows of the chunks removed from RR before the failure are gone from the table, the rest stay
+        removed = {row[0] for i, (_, rows) in enumerate(self.transactions, 1) if i != 2 for row in rows}
+        self.assertTrue(removed)
+        self.assertEqual(sorted(row[0] for row in part), sorted({f'P{i}' for i in range(10)} - removed))
+
+    def test_delete_rows_in_batch(self):
+        part = self._loaded_part()
+        with part.batch():
+            part.delete_rows(lambda row: row[0] in ('P1', 'P2'))
+            self.assertEqual(self.transactions, [])
+            self.assertEqual(len(part), 8)
+        self.assertEqual(self._uploaded('remove'), [('P1', 'S1', 'a'), ('P2', 'S0', 'a')])
+
+    def test_delete_rows_async(self):
+        part = self._loaded_part()
+        result = asyncio.run(part.delete_rows_async(lambda row: row[0] == 'P0'))
+        self.assertEqual(result.deleted, 1)
+        self.assertEqual(len(part), 9)
+
+    def test_bulk_result(self):
+        result = BulkResult()
+        self.assertEqual(result.status, 'Success')
+        result.add({'Status': 'Success', 'InsertedRowCount': 3, 'ModifiedRowCount': 1, 'ErrorRowCount': 0})
+        result.add({'Status': 'Partial Success', 'InsertedRowCount': 2, 'ErrorRowCount': 1})
+        self.assertEqual((result.transactions, result.inserted, result.modified, result.errors), (2, 5, 1, 1))
+        self.assertEqual(result.status, 'Partial Success')
+        failed = BulkResult()
+        failed.add({'Status': 'Failure', 'ErrorRowCount': 4})
+        self.assertEqual(failed.status, 'Failure')
+
+
+class DataTableKeyIndexTestCase(unittest.TestCase):
+    configuration = {'url': 'http://localhost/rapidresponse', 'auth_type': 'basic', 'username': 'user',
+                     'password': 'pass'}
+
+    def setUp(self):
+        self.env = Environment(self.configuration)
+        self.addCleanup(self.env.close)
+
+    def _part(self, columnar=False):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'], sync=False, refresh=False,
+                         columnar=columnar)
+        part.extend([[f'P{i}', f'S{i}', 'a'] for i in range(5)])
+        return part
+
+    def test_get_by_key(self):
+        part = self._part()
+        self.assertEqual(list(part.get_by_key('P1', 'S1')), ['P1', 'S1', 'a'])
+        self.assertEqual(list(part.get_by_key(('P2', 'S2'))), ['P2', 'S2', 'a'])
+        self.assertIsNone(part.get_by_key('P9', 'S9'))
+        self.assertIn(('P1', 'S1'), part)
+        self.assertIn(['P1', 'S1', 'a'], part)
+        self.assertNotIn(['P1', 'S1', 'b'], part)
+        part[1][2] = 'b'
+        self.assertIn(['P1', 'S1', 'b'], part)
+        self.assertEqual(part.indexof(['P3', 'S3', 'a']), 3)
+
+    def test_key_index_maintained(self):
+        part = self._part()
+        part.get_by_key('P0', 'S0')
+        part.append(['P5', 'S5', 'a'])
+        part.extend([['P6', 'S6', 'a'], ['P7', 'S7', 'a']])
+        self.assertEqual(part.get_by_key('P6', 'S6')[0], 'P6')
+        part[0] = ['P0', 'S0', 'z']
+        self.assertEqual(part.get_by_key('P0', 'S0')[2], 'z')
+        part[0] = ['Q0', 'S0', 'z']
+        self.assertIsNone(part.get_by_key('P0', 'S0'))
+        self.assertEqual(part.get_by_key('Q0', 'S0')[0], 'Q0')
+        del part[-1]
+        self.assertIsNone(part.get_by_key('P7', 'S7'))
+        del part[0]
+        self.assertEqual(part.get_by_key('P1', 'S1')[0], 'P1')
+        part.get_by_key('P1', 'S1')[0] = 'R1'
+        self.assertEqual(part.get_by_key('R1', 'S1')[0], 'R1')
+        self.assertNotIn(('P1', 'S1'), part)
+
+    def test_delete_by_key(self):
+        part = self._part()
+        part.delete_by_key('P2', 'S2')
+        self.assertEqual([row[0] for row in part], ['P0', 'P1', 'P3', 'P4'])
+        self.assertNotIn(('P2', 'S2'), part)
+        with self.assertRaises(KeyError):
+            part.delete_by_key('P2', 'S2')
+        part.del_row(['P3', 'S3', 'a'])
+        self.assertEqual([row[0] for row in part], ['P0', 'P1', 'P4'])
+
+    def test_duplicate_keys(self):
+        part = self._part()
+        part.append(['P1', 'S1', 'b'])
+        self.assertIn(['P1', 'S1', 'b'], part)
+        self.assertEqual(part.indexof(['P1', 'S1', 'b']), 5)
+        with self.assertRaises(ValueError):
+            part.indexof(['P1', 'S1', 'c'])
+
+    def test_index_without_key_columns(self):
+        # no selected column is a key, so every column is indexed
+        part = DataTable(self.env, 'Mfg::Part', ['Description'], sync=False, refresh=False)
+        part.extend([['a'], ['b']])
+        self.assertIn(['a'], part)
+        part[0][0] = 'z'
+        self.assertIn(['z'], part)
+        self.assertNotIn(['a'], part)
+        self.assertEqual(list(part.get_by_key('z')), ['z'])
+        part.del_row(['z'])
+        self.assertEqual([list(row) for row in part], [['b']])
+
+    def test_duplicate_key_replaced(self):
+        part = DataTable(self.env, 'Mfg::Part', ['Name', 'Site', 'Description'], sync=False, refresh=False)
+        part.extend([['P1', 'S1', 'a'], ['P1', 'S1', 'b'], ['P2', 'S2', 'a']])
+        self.assertEqual(list(part.get_by_key('P1', 'S1')), ['P1', 'S1', 'a'])
+        # replacing the indexed row of a duplicate key leaves the other row findable
+        part[0] = ['Q1', 'S1', 'a']
+        self.assertEqual(list(part.get_by_key('P1', 'S1')), ['P1', 'S1', 'b'])
+        self.assertIn(('P1', 'S1'), part)
+        self.assertIn(['P1', 'S1', 'b'], part)
+        self.assertEqual(list(part.get_by_key('Q1', 'S1')), ['Q1', 'S1', 'a'])
+        # as does deleting it
+        part.append(['P2', 'S2', 'b'])
+        del part[2]
+        self.assertEqual(list(part.get_by_key('P2', 'S2')), ['P2', 'S2', 'b'])
+
+    def test_columnar_key_index(self):
+        part = self._part(columnar=True)
+        self.assertEqual(list(part.get_by_key('P4', 'S4')), ['P4', 'S4', 'a'])
+        part.delete_by_key('P0', 'S0')
+        self.assertEqual(part.get_by_key('P4', 'S4')[0], 'P4')
+        self.assertIn(('P3', 'S3'), part)
+
+
+class TypedValuesTestCase(unittest.TestCase):
+    def test_decode_values(self):
+        self.assertEqual(_decode_values('Quantity', ['1.5', '2', '']), [1.5, 2.0, None])
+        self.assertEqual(_decode_values('Integer', ['7', '-3']), [7, -3])
+        self.assertEqual(_decode_values('Boolean', ['Y', 'false']), [True, False])
+        self.assertEqual(_decode_values('String', ['Past', '']), ['Past', ''])
+        self.assertEqual(_decode_values('Date', ['2024-03-01', 'Past', 'Future', 'Undefined', 'Today']),
+                         [date(2024, 3, 1), date.min, date.max, None, 'Today'])
+        self.assertEqual(_decode_values('DateTime', ['2024-03-01T10:30:00', 'Future']),
+                         [datetime(2024, 3, 1, 10, 30), datetime.max])
+        with self.assertRaises(DataError):
+            _decode_values('Integer', ['1', 'x'])
+
+    def test_encode_value_round_trip(self):
+        for datatype, values in [('Date', ['2024-03-01', 'Past', 'Future', 'Undefined', 'Today']),
+                                 ('Quantity', ['1.5', '2', '']),
+                                 ('Integer', ['7', '']),
+                                 ('Boolean', ['Y', 'N']),
+                                 ('DateTime', ['2024-03-01T10:30:00', 'Past'])]:
+            self.assertEqual([_encode_value(datatype, v) for v in _decode_values(datatype, values)], values)
+
+    def test_typed_table(self):
+        env = Environment(DataTableExportTestCase.configuration)
+        self.addCleanup(env.close)
+        for columnar in (False, True):
+            demand = DataTable(env, 'Mfg::IndependentDemand', ['Order.Id', 'Line', 'DueDate', 'Quantity'],
+                               sync=False, refresh=False, columnar=columnar, typed=True)
+            demand._add_rows(demand._decode_rows(['O1\t1\t2024-03-01\t5', 'O2\t2\tPast\t2.5']))
+            demand[1][3] = 4.0
+            self.assertEqual(demand.column('DueDate'), [date(2024, 3, 1), date.min])
+            self.assertEqual(demand.column('Quantity'), [5.0, 4.0])
+            self.assertEqual([demand._encode_values(row) for row in demand],
+                             [['O1', '1', '2024-03-01', '5'], ['O2', '2', 'Past', '4']])
+
+    @unittest.skipUnless(pyarrow and numpy, 'pyarrow or numpy is not installed')
+    def test_typed_table_to_arrow_and_numpy(self):
+        env = Environment(DataTableExportTestCase.configuration)
+        self.addCleanup(env.close)
+        records = ['O1\t1\t2024-03-01\t5', 'O2\t2\tPast\t2.5', 'O3\t3\tUndefined\t', 'O4\t4\tToday\t1']
+        for columnar in (False, True):
+            demand = DataTable(env, 'Mfg::IndependentDemand', ['Order.Id', 'Line', 'DueDate', 'Quantity'],
+                               sync=False, refresh=False, columnar=columnar, typed=True)
+            demand._add_rows(demand._decode_rows(records))
+            table = demand.to_arrow()
+            self.assertEqual(table.schema.field('Quantity').type, pyarrow.float64())
+            self.assertEqual(table.column('DueDate').to_pylist(), [date(2024, 3, 1), date.min, None, date.today()])
+            self.assertEqual(demand[3][2], 'Today')
+            schema = pyarrow.schema([(c.name, demand._arrow_type(pyarrow, c)) for c in demand.columns])
+            self.assertTrue(demand._arrow_batch(pyarrow, schema, records).equals(table.to_batches()[0].cast(schema)))
+            arrays = demand.to_numpy()
+            self.assertEqual(arrays['Quantity'].dtype, numpy.float64)
+            self.assertTrue(numpy.isnan(arrays['Quantity'][2]))
+            self.assertEqual(arrays['DueDate'].dtype, numpy.dtype('datetime64[D]'))
+
+
 '''
 class TestRefreshDataAsync(unittest.IsolatedAsyncioTestCase):
     async def test_refresh_data_async_with_no_data_range(self):
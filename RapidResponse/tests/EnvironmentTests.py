@@ -1,12 +1,19 @@
+import asyncio
 import base64
 import json
+import os
+import threading
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 
+import httpx
+import requests
+
 import RapidResponse
 import RapidResponse.DataModel as DataModel
 import RapidResponse.Utils
-from RapidResponse.Environment import Environment
+from RapidResponse.Environment import Environment, AdaptivePager
 
 
 class TestPackages(unittest.TestCase):
@@ -132,10 +139,333 @@ class TestEnvironment(unittest.TestCase):
         env = Environment(self.valid_config)
         self.assertEqual(env._data_model_dir, 'C:\\Users\\gpinkney\\PycharmProjects\\RapidResponse\\RapidResponse\\tests\\DataModel')
 
+    def test_data_model_shared(self):
+        config = self.valid_config.copy()
+        del config['data_model_directory']
+        env1 = Environment(config)
+        env2 = Environment(dict(config, username='other_user'))
+        self.assertIs(env1.data_model, env2.data_model)
+        self.assertEqual(DataModel.DataModelRegistry.reference_count(env1.data_model), 2)
+        env1.close()
+        self.assertEqual(DataModel.DataModelRegistry.reference_count(env2.data_model), 1)
+        env2.close()
+        self.assertEqual(DataModel.DataModelRegistry.reference_count(env2.data_model), 0)
+
+    def test_data_model_built_outside_registry_lock(self):
+        slow_started = threading.Event()
+        release_slow = threading.Event()
+        builds = []
+
+        def build(data_model_directory, *args):
+            builds.append(data_model_directory)
+            if data_model_directory == 'slow':
+                slow_started.set()
+                release_slow.wait(5)
+            return MagicMock()
+
+        registry = DataModel.DataModelRegistry
+        with patch('RapidResponse.DataModel.DataModel', side_effect=build):
+            slow = [threading.Thread(target=registry.acquire, args=('slow',)) for _ in range(2)]
+            for thread in slow:
+                thread.start()
+            self.assertTrue(slow_started.wait(5))
+            # another source is not held up by the slow build
+            fast = registry.acquire('fast')
+            self.assertEqual(registry.reference_count(fast), 1)
+            release_slow.set()
+            for thread in slow:
+                thread.join(5)
+        self.assertEqual(sorted(builds), ['fast', 'slow'])
+        registry.release(fast)
+        with registry._lock:
+            held = registry._models.pop(registry._source_key('slow'))
+        self.assertEqual(held[1], 2)
+        self.assertEqual(registry._building, {})
+
+    def test_shared_client(self):
+        config = self.valid_config.copy()
+        del config['data_model_directory']
+        config['max_connections'] = 4
+        env = Environment(config)
+
+        async def borrow():
+            return env.client, env.limit
+
+        client1, limit1 = env.run(borrow())
+        client2, limit2 = env.run(borrow())
+        self.assertIs(client1, client2)
+        self.assertIs(limit1, limit2)
+        self.assertEqual(env.max_connections, 4)
+        self.assertEqual(env.session.get_adapter('https://example.com')._pool_maxsize, 4)
+        env.close()
+        self.assertTrue(client1.is_closed)
+
+    def test_run_inside_event_loop(self):
+        config = self.valid_config.copy()
+        del config['data_model_directory']
+        env = Environment(config)
+        thread = env._loop_thread
+
+        async def caller():
+            # the sync facade still works while this thread is running its own loop
+            env.refresh_auth()
+            return await env.run_async(asyncio.sleep(0, result='done'))
+
+        self.assertEqual(asyncio.run(caller()), 'done')
+        self.assertTrue(env.global_headers['Authorization'].startswith('Basic '))
+        env.close()
+        self.assertFalse(thread.is_alive())
+
+    def _oauth2_env(self, expires_in, **configuration):
+        self.token_requests = 0
+        real_client = httpx.AsyncClient
+
+        self.rejected = set()
+        self.failures = []
+        self.token_error = None
+
+        def handler(request):
+            if request.url.path == '/oauth2/token':
+                if self.token_error:
+                    raise self.token_error
+                self.token_requests += 1
+                return httpx.Response(200, json={'access_token': f'token{self.token_requests}', 'expires_in': expires_in})
+            # any other endpoint rejects tokens that have been revoked
+            if request.headers['Authorization'] in self.rejected:
+                return httpx.Response(401)
+            if self.failures:
+                failure = self.failures.pop(0)
+                if isinstance(failure, Exception):
+                    raise failure
+                return failure
+            return httpx.Response(200, json={'Authorization': request.headers['Authorization']})
+
+        def mock_client(*args, **kwargs):
+            return real_client(*args, transport=httpx.MockTransport(handler), **kwargs)
+
+        config = self.valid_config.copy()
+        del config['data_model_directory']
+        config.update(auth_type='oauth2', clientID='client_id', client_secret='client_secret', **configuration)
+        with patch('RapidResponse.Environment.httpx.AsyncClient', side_effect=mock_client):
+            env = Environment(config)
+        self.addCleanup(env.close)
+        return env
+
+    def test_oauth2_token_cached(self):
+        env = self._oauth2_env(3600)
+        env.refresh_auth()
+        env.refresh_auth()
+        self.assertEqual(self.token_requests, 1)
+        self.assertEqual(env.global_headers['Authorization'], 'Bearer token1')
+
+    def test_oauth2_token_transport_error(self):
+        env = self._oauth2_env(3600)
+        env._token_refresh_at = 0.0
+        self.token_error = httpx.ConnectError('connection refused')
+        with self.assertRaises(RapidResponse.Utils.RequestsError) as raised:
+            env.refresh_auth()
+        self.assertIsNone(raised.exception.response)
+        self.assertIsInstance(raised.exception.__cause__, httpx.ConnectError)
+
+    def test_oauth2_token_single_flight(self):
+        env = self._oauth2_env(3600)
+        env._token_refresh_at = 0.0
+
+        async def refresh_concurrently():
+            await asyncio.gather(*(env.refresh_auth_async() for _ in range(10)))
+
+        asyncio.run(refresh_concurrently())
+        self.assertEqual(self.token_requests, 2)
+        self.assertEqual(env.global_headers['Authorization'], 'Bearer token2')
+
+    def test_oauth2_token_refreshed_before_expiry(self):
+        # a 100 second token is refreshed 50 seconds before it expires
+        env = self._oauth2_env(100)
+        with patch('RapidResponse.Environment.time.monotonic', return_value=time.monotonic() + 49):
+            env.refresh_auth()
+        self.assertEqual(self.token_requests, 1)
+        with patch('RapidResponse.Environment.time.monotonic', return_value=time.monotonic() + 51):
+            env.refresh_auth()
+        self.assertEqual(self.token_requests, 2)
+        self.assertEqual(env.global_headers['Authorization'], 'Bearer token2')
+
+    def test_request_async_reauthenticates_on_401(self):
+        env = self._oauth2_env(3600)
+        self.rejected.add('Bearer token1')
+
+        async def get_concurrently():
+            return await asyncio.gather(*(env.request_async('GET', 'http://example.com/integration/V1/bulk/export/1')
+                                          for _ in range(5)))
+
+        responses = env.run(get_concurrently())
+        self.assertEqual([r.status_code for r in responses], [200] * 5)
+        self.assertEqual({r.json()['Authorization'] for r in responses}, {'Bearer token2'})
+        self.assertEqual(self.token_requests, 2)
+
+    def test_request_reauthenticates_on_401(self):
+        env = self._oauth2_env(3600)
+        rejected = MagicMock(status_code=401)
+        accepted = MagicMock(status_code=200)
+        with patch.object(env.session, 'request', side_effect=[rejected, accepted]) as mock_request:
+            response = env.request('POST', 'http://example.com/integration/V1/bulk/upload', data='{}')
+        self.assertIs(response, accepted)
+        self.assertEqual(self.token_requests, 2)
+        self.assertEqual(mock_request.call_args_list[0].kwargs['headers']['Authorization'], 'Bearer token1')
+        self.assertEqual(mock_request.call_args_list[1].kwargs['headers']['Authorization'], 'Bearer token2')
+
+    def test_request_does_not_retry_twice(self):
+        env = self._oauth2_env(3600)
+        rejected = MagicMock(status_code=401)
+        with patch.object(env.session, 'request', return_value=rejected) as mock_request:
+            response = env.request('GET', 'http://example.com/integration/V1/data/worksheet')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(mock_request.call_count, 2)
+
+    def test_request_async_retries_idempotent(self):
+        env = self._oauth2_env(3600, retry_backoff=0)
+        self.failures = [httpx.Response(503, headers={'Retry-After': '0'}), httpx.Response(429)]
+        url = 'http://example.com/integration/V1/bulk/export/1'
+        response = env.run(env.request_async('GET', url, idempotent=True))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.failures, [])
+
+        # the last response is returned once the retries are used up
+        self.failures = [httpx.Response(503) for _ in range(5)]
+        response = env.run(env.request_async('GET', url, idempotent=True))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.failures), 1)
+
+    def test_request_async_does_not_retry_non_idempotent(self):
+        env = self._oauth2_env(3600, retry_backoff=0)
+        self.failures = [httpx.Response(503)]
+        response = env.run(env.request_async('POST', 'http://example.com/integration/V1/bulk/export'))
+        self.assertEqual(response.status_code, 503)
+
+    def test_request_async_timeout_not_retried(self):
+        env = self._oauth2_env(3600, retry_backoff=0)
+        url = 'http://example.com/integration/V1/bulk/export/1'
+        self.failures = [httpx.ReadTimeout('slow'), httpx.ConnectError('refused')]
+        with self.assertRaises(httpx.ReadTimeout):
+            env.run(env.request_async('GET', url, idempotent=True, retry_timeouts=False))
+        # connection errors are still retried
+        response = env.run(env.request_async('GET', url, idempotent=True, retry_timeouts=False))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.failures, [])
+
+    def test_request_retries_connection_error(self):
+        env = self._oauth2_env(3600, retry_backoff=0)
+        accepted = MagicMock(status_code=200)
+        with patch.object(env.session, 'request', side_effect=[requests.ConnectionError(), accepted]) as mock_request:
+            response = env.request('GET', 'http://example.com/integration/V1/data/worksheet', idempotent=True)
+        self.assertIs(response, accepted)
+        self.assertEqual(mock_request.call_count, 2)
+
+    def test_retry_delay(self):
+        env = self._oauth2_env(3600, retry_backoff=1, retry_backoff_max=10)
+        self.assertEqual(env._retry_delay(0, '7'), 7)
+        self.assertEqual(env._retry_delay(0, '120'), 10)
+        self.assertEqual(env._retry_delay(0, 'Thu, 01 Jan 1970 00:00:00 GMT'), 0)
+        for attempt in range(6):
+            self.assertLessEqual(env._retry_delay(attempt), min(10, 2 ** attempt))
+
+    def test_decode_executor(self):
+        config = self.valid_config.copy()
+        del config['data_model_directory']
+        env = Environment(config)
+        self.addCleanup(env.close)
+        self.assertIsNone(env.decode_executor)
+        # without an executor the function runs on the event loop thread
+        self.assertEqual(env.run(env.decode_async(threading.current_thread)), env._loop_thread)
+
+        config['decode_executor'] = 'thread'
+        env = Environment(config)
+        self.addCleanup(env.close)
+        thread = env.run(env.decode_async(threading.current_thread))
+        self.assertTrue(thread.name.startswith('RapidPy-decode'))
+        env.close()
+        self.assertIsNone(env._decode_executor)
+
+        config['decode_executor'] = 'process'
+        config['decode_workers'] = 1
+        env = Environment(config)
+        self.addCleanup(env.close)
+        self.assertNotEqual(env.run(env.decode_async(os.getpid)), os.getpid())
+
+        config['decode_executor'] = 'fork'
+        with self.assertRaises(ValueError):
+            Environment(config)
+
+    def test_http2_requires_h2(self):
+        config = self.valid_config.copy()
+        del config['data_model_directory']
+        config['http2'] = True
+        with patch.dict('sys.modules', {'h2': None}):
+            with self.assertRaises(RapidResponse.Utils.SetupError):
+                Environment(config)
+
     def test_env_with_scripts(self):
         env = Environment(self.local_sample_bootstrap)
         # print(env._worksheet_script)
         self.assertEqual(env._worksheet_script, 'GP.GetWorkbook.Worksheets')
 
+class TestAdaptivePager(unittest.TestCase):
+    def test_fast_pages_grow(self):
+        pager = AdaptivePager(100000, 1000, 8)
+        self.assertEqual(pager.concurrency, 4)
+        self.assertEqual(pager.next_page(), (0, 1000))
+        # 10000 rows/s would size pages at 20000 rows, growth is capped at double per page
+        pager.record(1000, 100000, 0.1)
+        self.assertEqual(pager.page_size, 2000)
+        self.assertEqual(pager.concurrency, 5)
+        self.assertEqual(pager.next_page(), (1000, 2000))
+
+    def test_slow_pages_shrink(self):
+        pager = AdaptivePager(100000, 4000, 8)
+        pager.record(4000, 400000, 10.0)
+        self.assertEqual(pager.page_size, 2000)
+        self.assertEqual(pager.concurrency, 2)
+
+    def test_page_bytes_capped(self):
+        pager = AdaptivePager(100000, 1000, 8)
+        pager.MAX_PAGE_BYTES = 1000 * 100
+        pager.record(1000, 1000 * 200, 0.1)
+        self.assertEqual(pager.page_size, 500)
+
+    def test_timeout_splits_page(self):
+        pager = AdaptivePager(3000, 1000, 8, min_page_size=500)
+        self.assertEqual(pager.next_page(), (0, 1000))
+        self.assertTrue(pager.timed_out(0, 1000))
+        self.assertEqual(pager.page_size, 500)
+        self.assertEqual(pager.concurrency, 2)
+        self.assertEqual([pager.next_page() for _ in range(6)],
+                         [(0, 500), (500, 500), (1000, 500), (1500, 500), (2000, 500), (2500, 500)])
+        self.assertIsNone(pager.next_page())
+        self.assertFalse(pager.timed_out(0, 500))
+
+    def test_run_ordered_after_timeout(self):
+        timed_out = []
+
+        async def fetch(start, size):
+            if start == 0 and not timed_out:
+                timed_out.append(size)
+                raise httpx.ReadTimeout('slow page')
+            await asyncio.sleep(0.001 * (20 - start))
+            return list(range(start, start + size)), size, size * 10
+
+        pages = []
+        pager = AdaptivePager(20, 4, 4, min_page_size=1)
+        asyncio.run(pager.run(fetch, lambda start, page: pages.append(page), ordered=True))
+        self.assertEqual(timed_out, [4])
+        self.assertEqual([row for page in pages for row in page], list(range(20)))
+
+    def test_run_raises_timeout_at_min_page_size(self):
+        async def fetch(start, size):
+            raise httpx.ReadTimeout('slow page')
+
+        pager = AdaptivePager(10, 2, 2, min_page_size=2)
+        with self.assertRaises(httpx.TimeoutException):
+            asyncio.run(pager.run(fetch, lambda start, page: None))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,8 @@
+import json
 import unittest
 
 import RapidResponse.DataModel
+import RapidResponse.Utils
 
 
 class TableTestCase(unittest.TestCase):
@@ -52,6 +54,36 @@ class TableTestCase(unittest.TestCase):
         part.add_fields([col1, col2])
         self.assertEqual(part.get_field('Column1'), RapidResponse.DataModel.Column('Column1', 'string', 'N'))
 
+    def test_get_field_after_remove(self):
+        part = RapidResponse.DataModel.Table('Part', 'Mfg', 'input', 'Y')
+        col1 = RapidResponse.DataModel.Column('Column1', 'string', 'N')
+        col2 = RapidResponse.DataModel.Column('Column2', 'string', 'N')
+        part.add_fields([col1, col2, col1])
+        part.remove_fields(col1)
+        self.assertEqual(part.fields, [col2])
+        with self.assertRaises(RapidResponse.Utils.DataError):
+            part.get_field('Column1')
+
+    def test_remove_field_by_name(self):
+        part = RapidResponse.DataModel.Table('Part', 'Mfg', 'input', 'Y')
+        col1 = RapidResponse.DataModel.Column('Column1', 'string', 'Y')
+        col2 = RapidResponse.DataModel.Column('Column2', 'string', 'N')
+        part.add_fields([col1, col2])
+        # a Column with the same name but other attributes removes the field the table holds
+        part.remove_fields(RapidResponse.DataModel.Column('Column1', 'Integer', 'N'))
+        self.assertEqual(part.fields, [col2])
+        self.assertEqual(part._key_fields, [])
+
+    def test_dict_round_trip(self):
+        part = RapidResponse.DataModel.Table('Part', 'Mfg', 'input', 'Y', 'Name')
+        col1 = RapidResponse.DataModel.Column('Name', 'String', 'Y')
+        col2 = RapidResponse.DataModel.Column('Site', 'Reference', 'Y', 'Site', 'Mfg')
+        part.add_fields([col1, col2])
+        restored = RapidResponse.DataModel.Table.from_dict(json.loads(json.dumps(part.to_dict())))
+        self.assertEqual(repr(restored), repr(part))
+        self.assertEqual(restored.get_field('Site'), col2)
+        self.assertEqual(restored._key_fields, ['Name', 'Site'])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -25,6 +25,8 @@ setup(
     #package_dir={"": "."},
     python_requires=">=3.10, <4",
     install_requires=["requests>=2.31.0", "httpx", "setuptools>=70"],
+    extras_require={"http2": ["httpx[http2]"], "arrow": ["pyarrow"], "numpy": ["numpy"],
+                    "pandas": ["pandas", "pyarrow"], "orjson": ["orjson"]},
     # "csv", "logging", "os". all the other stuff is from standard lib
     include_package_data=True,
     package_data={  # Optional